@@ -0,0 +1,323 @@
+"""
+Benchmark the trust-products pipeline offline, over the Trustify responses recorded in
+tests/testdata. See DEVELOP.md for usage.
+"""
+
+import copy
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable
+from unittest.mock import patch
+
+import click
+
+from trustshell import console as trustshell_console
+from trustshell import products
+from trustshell.product_definitions import ProdDefs
+from trustshell.products import (
+    _render_tree,
+    _trees_with_cpes,
+    build_ancestor_tree,
+    extract_affects,
+)
+from trustshell.tree import TreeNode
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+TESTDATA_DIR = os.path.join(BENCHMARKS_DIR, "..", "tests", "testdata")
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+PRODUCT_DEFINITIONS = "product-definitions.json"
+FIXTURES = [
+    "quarkus-vertx-core",
+    "quarkus-3.15-xmlsec",
+    "quarkus-3.20-agroal-api",
+    "openssl",
+    "openssl-libs",
+    "libreoffice",
+    "quay-builder-qemu-multi",
+    "quay-builder-qemu-index-name",
+    "quay-builder-qemu-rhcos-rhel-8",
+    "NGX",
+    "chardet",
+    "openssl-libs-products",
+]
+# Fixtures made up from the recorded ones, since few recorded responses map to the products in
+# product-definitions.json
+PRODUCTS_FIXTURE = "openssl-libs-products"
+PRODUCTS_FIXTURE_VERSIONS = 10
+PHASES = ["parse", "trees", "map", "affects", "render"]
+# Differences smaller than these are noise rather than regressions, phases taking a few
+# milliseconds can vary by more than the threshold from run to run
+MIN_TIME_DELTA_MS = 5.0
+MIN_MEMORY_DELTA_KB = 100.0
+
+
+def _replace_purl_versions(component: dict[str, Any], old: str, new: str) -> None:
+    for ancestor in [component, *component.get("ancestors", [])]:
+        ancestor["purl"] = [
+            purl.replace(f"@{old}", f"@{new}") for purl in ancestor["purl"]
+        ]
+        if ancestor is not component:
+            _replace_purl_versions(ancestor, old, new)
+
+
+def _products_fixture(product_definitions: dict[str, Any]) -> bytes:
+    """
+    An analysis response which maps to every product in the product definitions. The first
+    component recorded in openssl-libs.json is copied for several versions of openssl, with the
+    CPE of its product replaced by each stream CPE, and by CPEs only matching module patterns.
+    """
+    with open(os.path.join(TESTDATA_DIR, "openssl-libs.json")) as f:
+        component = json.load(f)["items"][0]
+    cpes = [
+        cpe
+        for stream in product_definitions["ps_update_streams"].values()
+        for cpe in stream.get("cpe", [])
+    ]
+    cpes += [
+        f"{cpe}::synthetic"
+        for module in product_definitions["ps_modules"].values()
+        for cpe in module.get("cpe", [])
+    ]
+    items = []
+    for version in range(PRODUCTS_FIXTURE_VERSIONS):
+        for i, cpe in enumerate(cpes):
+            item = copy.deepcopy(component)
+            item["sbom_id"] = f"{item['sbom_id']}-{version}-{i}"
+            _replace_purl_versions(item, "3.0.7-18", f"3.0.{version}-1")
+            product = item["ancestors"][0]["ancestors"][0]["ancestors"][0]
+            product["cpe"] = [cpe]
+            items.append(item)
+    return json.dumps({"items": items, "total": len(items)}).encode()
+
+
+def _run_pipeline(raw: bytes, prod_defs: ProdDefs, measure: Callable) -> dict[str, Any]:
+    """Run each phase of the pipeline on a recorded response, measure is called with the
+    phase name and a function running it, and returns its result"""
+    data = measure("parse", lambda: json.loads(raw))
+    trees = measure("trees", lambda: _trees_with_cpes(data))
+    tree_nodes = sum(len(tree.descendants) + 1 for tree in trees)
+    results = measure("map", lambda: prod_defs.extend_with_product_mappings(trees))
+    affects = measure("affects", lambda: extract_affects(results))
+
+    def render():
+        with products.console.capture():
+            for result in results:
+                _render_tree(result.root)
+
+    measure("render", render)
+    return {
+        "trees": len(trees),
+        "tree_nodes": tree_nodes,
+        "results": len(results),
+        "affects": len(affects),
+    }
+
+
+def _ancestor_nodes(raw: bytes) -> int:
+    """The number of nodes in the ancestor tree before it's pruned"""
+    base_node = TreeNode("root")
+    build_ancestor_tree(base_node, json.loads(raw)["items"])
+    return len(base_node.descendants)
+
+
+def benchmark_fixture(raw: bytes, prod_defs: ProdDefs, repeat: int) -> dict[str, Any]:
+    """Get the fastest wall time of each phase over repeat runs, and peak memory of each
+    phase in a separate run since tracing memory slows everything down"""
+    times_ms: dict[str, float] = {}
+
+    def timed(phase, run):
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        elapsed = (time.perf_counter() - start) * 1000
+        times_ms[phase] = min(elapsed, times_ms.get(phase, elapsed))
+        return result
+
+    # An untimed run first, so the first timed run doesn't pay for warming up
+    _run_pipeline(raw, prod_defs, lambda phase, run: run())
+    for _ in range(repeat):
+        counts = _run_pipeline(raw, prod_defs, timed)
+
+    peak_kb: dict[str, float] = {}
+
+    def traced(phase, run):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            return run()
+        finally:
+            peak_kb[phase] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+
+    _run_pipeline(raw, prod_defs, traced)
+    return {
+        "counts": {"ancestor_nodes": _ancestor_nodes(raw), **counts},
+        "time_ms": {phase: round(times_ms[phase], 2) for phase in PHASES},
+        "peak_kb": {phase: round(peak_kb[phase], 1) for phase in PHASES},
+    }
+
+
+def compare(
+    results: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """Get a description of each regression from baseline in results"""
+    regressions = []
+    for fixture, result in results.items():
+        if fixture not in baseline:
+            continue
+        base = baseline[fixture]
+        for count, value in result["counts"].items():
+            if base["counts"].get(count, value) != value:
+                regressions.append(
+                    f"{fixture}: {count} changed from {base['counts'][count]} to {value}"
+                )
+        for phase in PHASES:
+            value_ms = result["time_ms"][phase]
+            # Budgets are coarse enough to hold on any machine, unlike the timings
+            budget_ms = base.get("budget_ms", {}).get(phase)
+            if budget_ms is not None and value_ms > budget_ms:
+                regressions.append(
+                    f"{fixture}: {phase} took {value_ms:.1f}ms, budget {budget_ms:.0f}ms"
+                )
+            # Baselines without timings only check the counts and budgets
+            base_ms = base.get("time_ms", {}).get(phase)
+            if (
+                base_ms is not None
+                and value_ms > base_ms * (1 + threshold)
+                and value_ms - base_ms > MIN_TIME_DELTA_MS
+            ):
+                regressions.append(
+                    f"{fixture}: {phase} took {value_ms:.1f}ms, baseline {base_ms:.1f}ms"
+                )
+            base_kb = base.get("peak_kb", {}).get(phase)
+            value_kb = result["peak_kb"][phase]
+            if (
+                base_kb is not None
+                and value_kb > base_kb * (1 + threshold)
+                and value_kb - base_kb > MIN_MEMORY_DELTA_KB
+            ):
+                regressions.append(
+                    f"{fixture}: {phase} peak memory {value_kb:.0f}KB, "
+                    f"baseline {base_kb:.0f}KB"
+                )
+    return regressions
+
+
+def _print_results(results: dict[str, Any]) -> None:
+    header = f"{'fixture':32} {'nodes':>7} {'results':>7}"
+    for phase in PHASES:
+        header += f" {phase + ' ms':>10} {'KB':>8}"
+    click.echo(header)
+    for fixture, result in results.items():
+        counts = result["counts"]
+        line = f"{fixture:32} {counts['ancestor_nodes']:>7} {counts['results']:>7}"
+        for phase in PHASES:
+            line += (
+                f" {result['time_ms'][phase]:>10.2f} {result['peak_kb'][phase]:>8.0f}"
+            )
+        click.echo(line)
+
+
+@click.command()
+@click.option(
+    "--repeat",
+    "-r",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of timed runs per fixture, the fastest is reported.",
+)
+@click.option(
+    "--threshold",
+    "-t",
+    type=click.FloatRange(min=0),
+    default=0.25,
+    show_default=True,
+    help="Fraction by which time or memory can exceed the baseline before it's a regression.",
+)
+@click.option(
+    "--baseline",
+    "baseline_file",
+    type=click.Path(dir_okay=False),
+    default=BASELINE_FILE,
+    show_default=True,
+    help="Baseline results file.",
+)
+@click.option("--save", is_flag=True, help="Save the results as the new baseline.")
+@click.option(
+    "--counts-only",
+    is_flag=True,
+    help="Only save and compare the counts, which don't depend on the machine.",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON.")
+@click.argument("fixtures", nargs=-1)
+def benchmark(repeat, threshold, baseline_file, save, counts_only, as_json, fixtures):
+    """Benchmark the trust-products pipeline on recorded Trustify responses"""
+    fixtures = fixtures or FIXTURES
+    with open(os.path.join(TESTDATA_DIR, PRODUCT_DEFINITIONS)) as f:
+        product_definitions = json.load(f)
+    with patch.dict(os.environ, {"PRODDEFS_URL": ""}):
+        with patch.object(
+            ProdDefs,
+            "get_product_definitions_service",
+            return_value=product_definitions,
+        ):
+            prod_defs = ProdDefs()
+
+    results = {}
+    # Warnings about CPEs without products aren't interesting here
+    trustshell_console.quiet = products.console.quiet = True
+    try:
+        for fixture in fixtures:
+            if fixture == PRODUCTS_FIXTURE:
+                raw = _products_fixture(product_definitions)
+            else:
+                with open(os.path.join(TESTDATA_DIR, f"{fixture}.json"), "rb") as f:
+                    raw = f.read()
+            results[fixture] = benchmark_fixture(raw, prod_defs, repeat)
+    finally:
+        trustshell_console.quiet = products.console.quiet = False
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+
+    if counts_only:
+        results = {
+            fixture: {"counts": result["counts"]} for fixture, result in results.items()
+        }
+    if save:
+        # The budgets are set by hand, keep them
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                for fixture, base in json.load(f).items():
+                    if fixture in results and "budget_ms" in base:
+                        results[fixture]["budget_ms"] = base["budget_ms"]
+        with open(baseline_file, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        click.echo(f"Saved baseline to {baseline_file}")
+        return
+    if not os.path.exists(baseline_file):
+        click.echo(
+            f"No baseline found at {baseline_file}, run with --save to create it"
+        )
+        return
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, threshold)
+    if regressions:
+        click.echo(f"\n{len(regressions)} regression(s) from baseline:", err=True)
+        for regression in regressions:
+            click.echo(f"  {regression}", err=True)
+        sys.exit(1)
+    click.echo("\nNo regressions from baseline")
+
+
+if __name__ == "__main__":
+    benchmark()
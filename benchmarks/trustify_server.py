@@ -0,0 +1,314 @@
+"""
+A local stand-in for the Trustify endpoints used by trustshell, serving the responses recorded
+in tests/testdata or with TRUSTSHELL_RECORD, so the concurrency, caching and retries of
+trustshell can be load tested without Atlas. See DEVELOP.md for usage.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+import click
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+TESTDATA_DIR = os.path.join(BENCHMARKS_DIR, "..", "tests", "testdata")
+API_PATH = "/api/v2/"
+# trustshell uses http://localhost:8080/api/v2/ when TRUSTIFY_URL isn't set
+DEFAULT_PORT = 8080
+ANALYSIS_ENDPOINTS = ("analysis/component", "analysis/latest/component")
+
+
+def base_purl(purl: str) -> str:
+    """Strip the version, qualifiers and subpath from a purl"""
+    return purl.split("?")[0].split("#")[0].split("@")[0]
+
+
+def _purl_uuid(purl: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, purl))
+
+
+def _matches(item: dict[str, Any], query: str) -> bool:
+    """Check a component against a single Trustify query condition, 'field~value' for
+    contains or 'field=value' for equals. A query without a condition matches names."""
+    ops = [i for i in (query.find("~"), query.find("=")) if i > 0]
+    if not ops:
+        return query in item.get("name", "")
+    field, op, value = query[: min(ops)], query[min(ops)], query[min(ops) + 1 :]
+    values = item.get(field)
+    if not isinstance(values, list):
+        values = [values]
+    for candidate in values:
+        if isinstance(candidate, str):
+            if (op == "~" and value in candidate) or (op == "=" and value == candidate):
+                return True
+    return False
+
+
+def _page(items: list, params: dict[str, list[str]]) -> dict[str, Any]:
+    """Apply limit and offset query parameters to a list of items"""
+    offset = int(params.get("offset", ["0"])[0])
+    limit = params.get("limit")
+    end = offset + int(limit[0]) if limit else None
+    return {"items": items[offset:end], "total": len(items)}
+
+
+class FixtureStore:
+    """
+    Recorded Trustify responses, loaded from JSON files by their shape: analysis responses
+    provide components, base purl details and purl search pages provide base purls. Analysis
+    queries are answered with the recorded components which match them, so a response
+    recorded for one purl also answers queries for the others in its ancestor trees.
+    """
+
+    def __init__(self, fixture_dirs: list[str], scale: int = 1):
+        self.scale = scale
+        self.components: list[dict[str, Any]] = []
+        self.base_purl_details: dict[str, dict[str, Any]] = {}
+        self.base_purls: set[str] = set()
+        self._component_ids: set[tuple[str, str]] = set()
+        for fixture_dir in fixture_dirs:
+            for name in sorted(os.listdir(fixture_dir)):
+                if name.endswith(".json"):
+                    self.load(os.path.join(fixture_dir, name))
+
+    def load(self, path: str) -> None:
+        with open(path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return
+        if isinstance(data.get("purl"), str) and isinstance(data.get("versions"), list):
+            self.base_purl_details[data["purl"]] = data
+            self.base_purls.add(data["purl"])
+        items = data.get("items")
+        if not isinstance(items, list):
+            return
+        # Trustify can list a component more than once in a response, which is kept, but
+        # components already loaded from another response are skipped
+        loaded = set(self._component_ids)
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            purls = item.get("purl")
+            if isinstance(purls, list):
+                component_id = (item.get("sbom_id", ""), item.get("node_id", ""))
+                if component_id in loaded:
+                    continue
+                self._component_ids.add(component_id)
+                self.components.append(item)
+                self.base_purls.update(base_purl(purl) for purl in purls)
+            elif isinstance(purls, str):
+                self.base_purls.add(purls)
+
+    def status(self) -> dict[str, Any]:
+        sbom_count = len({item.get("sbom_id") for item in self.components}) * self.scale
+        return {"sbom_count": sbom_count, "graph_count": sbom_count}
+
+    def analysis(self, params: dict[str, list[str]]) -> dict[str, Any]:
+        query = params.get("q", [""])[0]
+        matches = [item for item in self.components if _matches(item, query)]
+        # Copies of the matches from made up SBOMs make the response larger, and the ancestor
+        # trees wider, without changing the products they map to
+        scaled = list(matches)
+        for copy in range(1, self.scale):
+            for item in matches:
+                scaled.append(
+                    {
+                        **item,
+                        "sbom_id": f"{item.get('sbom_id')}-{copy}",
+                        "node_id": f"{item.get('node_id')}-{copy}",
+                    }
+                )
+        return _page(scaled, params)
+
+    def purl_search(self, params: dict[str, list[str]]) -> dict[str, Any]:
+        query = params.get("q", [""])[0]
+        purls = sorted(purl for purl in self.base_purls if query in purl)
+        return _page([{"uuid": _purl_uuid(p), "purl": p} for p in purls], params)
+
+    def purl_details(self, purl: str) -> Optional[dict[str, Any]]:
+        """The recorded details of a base purl, or details made from the versions of the
+        recorded components"""
+        if purl in self.base_purl_details:
+            return self.base_purl_details[purl]
+        if purl not in self.base_purls:
+            return None
+        versions: dict[str, dict[str, Any]] = {}
+        for item in self.components:
+            for component_purl in item["purl"]:
+                if base_purl(component_purl) != purl or "@" not in component_purl:
+                    continue
+                version = component_purl.split("@", 1)[1].split("?")[0].split("#")[0]
+                entry = versions.setdefault(
+                    version,
+                    {
+                        "uuid": _purl_uuid(f"{purl}@{version}"),
+                        "purl": f"{purl}@{version}",
+                        "version": version,
+                        "purls": [],
+                    },
+                )
+                entry["purls"].append({"purl": component_purl})
+        return {
+            "uuid": _purl_uuid(purl),
+            "purl": purl,
+            "versions": list(versions.values()),
+        }
+
+
+class TrustifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        server_address,
+        store: FixtureStore,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        quiet: bool = False,
+    ):
+        super().__init__(server_address, Handler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quiet = quiet
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def fault(self) -> tuple[float, bool]:
+        """Pick the delay in seconds for a request, and whether it fails"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return max(0.0, delay), fail
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep connections alive like Trustify, so client connection pooling is exercised
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        delay, fail = self.server.fault()
+        time.sleep(delay)
+        if fail:
+            self._send_json(503, {"error": "Injected error"})
+            return
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith(API_PATH):
+            self._send_json(404, {"error": f"Not found: {parsed.path}"})
+            return
+        endpoint = parsed.path[len(API_PATH) :].strip("/")
+        params = parse_qs(parsed.query)
+        store = self.server.store
+        if endpoint == "analysis/status":
+            self._send_json(200, store.status())
+        elif endpoint in ANALYSIS_ENDPOINTS:
+            self._send_json(200, store.analysis(params))
+        elif endpoint == "purl/base":
+            self._send_json(200, store.purl_search(params))
+        elif endpoint.startswith("purl/base/"):
+            details = store.purl_details(unquote(endpoint[len("purl/base/") :]))
+            if details is None:
+                self._send_json(404, {"error": "Base purl not found"})
+            else:
+                self._send_json(200, details)
+        else:
+            self._send_json(404, {"error": f"Not found: {endpoint}"})
+
+    def _send_json(self, status: int, response_data: Any) -> None:
+        body = json.dumps(response_data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", "-p", type=int, default=DEFAULT_PORT, show_default=True)
+@click.option(
+    "--fixtures",
+    "-f",
+    "fixture_dirs",
+    multiple=True,
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory of recorded responses, can be repeated. Defaults to tests/testdata.",
+)
+@click.option(
+    "--latency",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Delay before each response, in milliseconds.",
+)
+@click.option(
+    "--jitter",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Random variation of the delay, in milliseconds either way.",
+)
+@click.option(
+    "--error-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0,
+    show_default=True,
+    help="Fraction of requests which fail with a 503.",
+)
+@click.option(
+    "--scale",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Multiply the components in analysis responses by this.",
+)
+@click.option("--seed", type=int, help="Seed for the latency and errors.")
+@click.option("--quiet", "-q", is_flag=True, help="Don't log each request.")
+def serve(host, port, fixture_dirs, latency, jitter, error_rate, scale, seed, quiet):
+    """Serve recorded responses in place of Trustify"""
+    store = FixtureStore(list(fixture_dirs) or [TESTDATA_DIR], scale=scale)
+    server = TrustifyServer(
+        (host, port),
+        store,
+        latency=latency / 1000,
+        jitter=jitter / 1000,
+        error_rate=error_rate,
+        seed=seed,
+        quiet=quiet,
+    )
+    click.echo(
+        f"Serving {len(store.components)} components and {len(store.base_purls)} base "
+        f"purls on http://{host}:{server.server_address[1]}{API_PATH}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        click.echo(
+            f"Served {server.requests} requests, {server.errors} errors injected"
+        )
+
+
+if __name__ == "__main__":
+    serve()
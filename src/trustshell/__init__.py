@@ -1,61 +1,98 @@
-import time
-import importlib.metadata
+import functools
 import logging
 import os
+import sys
+from typing import Any, Union
 from urllib.parse import urlparse, urlunparse, quote, parse_qs
 
-import httpx
-import jwt
 from packageurl import PackageURL
 from rich.console import Console
 from rich.logging import RichHandler
 from rich.theme import Theme
-import webbrowser
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
-
-from trustshell.oidc.oidc_pkce_authcode import (
-    LOCAL_SERVER_PORT,
-    REDIRECT_URI,
-    build_url,
-    code_to_token,
-    gen_things,
-)
+# Modules which are slow to import, such as httpx, jwt, the OIDC helpers and anything using
+# osidb_bindings or univers, are imported where they're used so that commands start quickly.
+# tests/test_imports.py checks they aren't imported with the command modules.
 
 CONFIG_DIR = os.path.expanduser("~/.config/trustshell/")
-os.makedirs(CONFIG_DIR, exist_ok=True)
 TOKEN_FILE = os.path.join(CONFIG_DIR, "access_token.jwt")
-HEADLESS = "DISPLAY" not in os.environ
-LOCAL_AUTH_SERVER_PORT = ""
-if "LOCAL_AUTH_SERVER_PORT" in os.environ:
-    LOCAL_AUTH_SERVER_PORT = os.getenv("LOCAL_AUTH_SERVER_PORT")
+TRUSTIFY_URL_PATH = "/api/v2/"
+# Directory to record Trustify responses in, for benchmarks/trustify_server.py to serve
+RECORD_ENV = "TRUSTSHELL_RECORD"
 
 
-TRUSTIFY_URL_PATH = "/api/v2/"
-if "TRUSTIFY_URL" in os.environ:
-    url_env = os.getenv("TRUSTIFY_URL")
-    parsed_url = urlparse(url_env)
-    if not parsed_url.path or parsed_url.path != TRUSTIFY_URL_PATH:
-        TRUSTIFY_URL = urlunparse(
-            (parsed_url.scheme, parsed_url.netloc, TRUSTIFY_URL_PATH, "", "", "")
-        )
-    else:
-        TRUSTIFY_URL = url_env
-    AUTH_ENABLED = True
-else:
-    TRUSTIFY_URL = "http://localhost:8080/api/v2/"
-    AUTH_ENABLED = False
+class Config:
+    """Settings from the environment, read when they're first used rather than on import"""
+
+    @functools.cached_property
+    def trustify_url(self) -> str:
+        if not self.auth_enabled:
+            return "http://localhost:8080/api/v2/"
+        url_env = os.environ["TRUSTIFY_URL"]
+        parsed_url = urlparse(url_env)
+        if not parsed_url.path or parsed_url.path != TRUSTIFY_URL_PATH:
+            return urlunparse(
+                (parsed_url.scheme, parsed_url.netloc, TRUSTIFY_URL_PATH, "", "", "")
+            )
+        return url_env
+
+    @functools.cached_property
+    def auth_enabled(self) -> bool:
+        # Authentication is only needed for a remote Trustify
+        return "TRUSTIFY_URL" in os.environ
+
+    @functools.cached_property
+    def headless(self) -> bool:
+        return "DISPLAY" not in os.environ
+
+    @functools.cached_property
+    def local_auth_server_port(self) -> str:
+        return os.getenv("LOCAL_AUTH_SERVER_PORT", "")
+
+    @functools.cached_property
+    def record_dir(self) -> str:
+        return os.getenv(RECORD_ENV, "")
+
+    @functools.cached_property
+    def version(self) -> str:
+        import importlib.metadata
+
+        return importlib.metadata.version("trustshell")
+
+
+config = Config()
+
+# Module attributes kept for compatibility, which are now read from config
+_CONFIG_ATTRIBUTES = {
+    "TRUSTIFY_URL": "trustify_url",
+    "AUTH_ENABLED": "auth_enabled",
+    "HEADLESS": "headless",
+    "LOCAL_AUTH_SERVER_PORT": "local_auth_server_port",
+    "version": "version",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _CONFIG_ATTRIBUTES:
+        return getattr(config, _CONFIG_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def ensure_config_dir() -> str:
+    """Create the config directory, if it doesn't exist, before writing to it"""
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    return CONFIG_DIR
+
 
 custom_theme = Theme({"warning": "magenta", "error": "bold red"})
 console = Console(color_system="auto", theme=custom_theme)
-version = importlib.metadata.version("trustshell")
 logger = logging.getLogger("trustshell")
 
 
 def print_version(ctx, param, value):
     if not value or ctx.resilient_parsing:
         return
-    console.print(f"Current version: {version}")
+    console.print(f"Current version: {config.version}")
     ctx.exit()
 
 
@@ -79,8 +116,64 @@ def urlencoded(base_purl: str) -> str:
     return quote(base_purl, safe="")
 
 
-def get_tag_from_purl(purl: PackageURL) -> str:
+# Number of purl strings to keep parsed and normalized forms of
+PURL_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=PURL_CACHE_SIZE)
+def parse_purl(purl: str) -> PackageURL:
+    """Parse a purl string. The same purls appear many times in Trustify responses, so parsed
+    purls are cached and shared; the returned PackageURL must not be modified."""
+    return PackageURL.from_string(purl)
+
+
+@functools.lru_cache(maxsize=PURL_CACHE_SIZE)
+def normalize_purl(purl: str) -> str:
+    """
+    Get the base purl which represents purl in ancestor trees: all qualifiers are removed
+    except the OCI repository_url and tag. If there is a tag the version is removed too.
+    """
+    purl_obj = parse_purl(purl)
+    tag = get_tag_from_purl(purl_obj)
+    qualifiers = {}
+    if "repository_url" in purl_obj.qualifiers and purl_obj.type == "oci":
+        qualifiers["repository_url"] = purl_obj.qualifiers["repository_url"]
+    version = ""
+    if tag:
+        qualifiers["tag"] = tag
+    elif purl_obj.version:
+        version = purl_obj.version
+    base_purl = PackageURL(
+        type=purl_obj.type,
+        name=purl_obj.name,
+        namespace=purl_obj.namespace,
+        version=version,
+        qualifiers=qualifiers,
+    )
+    return sys.intern(base_purl.to_string())
+
+
+@functools.lru_cache(maxsize=PURL_CACHE_SIZE)
+def purl_sans_version(purl: str, remove_tag: bool = False) -> str:
+    """Get purl without its version, and optionally without the tag of an OCI purl"""
+    purl_obj = parse_purl(purl)
+    qualifiers = purl_obj.qualifiers
+    if remove_tag and purl_obj.type == "oci" and "tag" in qualifiers:
+        qualifiers = {k: v for k, v in qualifiers.items() if k != "tag"}
+    version_less = PackageURL(
+        type=purl_obj.type,
+        name=purl_obj.name,
+        namespace=purl_obj.namespace,
+        qualifiers=qualifiers,
+        subpath=purl_obj.subpath,
+    )
+    return sys.intern(version_less.to_string())
+
+
+def get_tag_from_purl(purl: Union[PackageURL, str]) -> str:
     """Extract tag from OCI purl"""
+    if isinstance(purl, str):
+        purl = parse_purl(purl)
     tag = ""
     if purl.type != "oci":
         return tag
@@ -93,29 +186,10 @@ def get_tag_from_purl(purl: PackageURL) -> str:
 
 
 def check_or_get_access_token() -> str:
-    if not os.path.exists(TOKEN_FILE):
-        logger.debug("Access token not found. Getting a new one...")
-        access_token = _get_and_store_access_token()
-    else:
-        logger.debug("Access token found. Checking its validity...")
-        with open(TOKEN_FILE, "r") as f:
-            stored_token = f.read().strip()
-        try:
-            decoded_token = jwt.decode(
-                stored_token, options={"verify_signature": False}
-            )
-            if int(time.time()) > decoded_token["exp"]:
-                logger.debug("Access token is expired. Getting a new one...")
-                access_token = _get_and_store_access_token()
-            else:
-                logger.debug("Access token is valid.")
-                access_token = stored_token
-        except jwt.ExpiredSignatureError:
-            logger.debug("Access token is expired. Getting a new one...")
-            access_token = _get_and_store_access_token()
-        except jwt.InvalidTokenError:
-            logger.debug("Access token is invalid. Getting a new one...")
-            access_token = _get_and_store_access_token()
+    """Get a valid access token, from memory, the token file or a new OIDC flow"""
+    from trustshell.auth import get_token_broker
+
+    access_token = get_token_broker().get_token()
     if not access_token:
         console.print(
             "Unable to authenticate to Atlas, please try again after authenticating in the browser."
@@ -124,17 +198,11 @@ def check_or_get_access_token() -> str:
     return access_token
 
 
-def _get_and_store_access_token() -> str:
-    access_token = get_access_token()
-    if not access_token:
-        return ""
-    with open(TOKEN_FILE, "w") as f:
-        f.write(access_token)
-        os.chmod(TOKEN_FILE, 0o600)
-    return access_token
+def local_http_server(code_challenge, state):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
 
+    from trustshell.oidc.oidc_pkce_authcode import LOCAL_SERVER_PORT
 
-def local_http_server(code_challenge, state):
     logger.info(
         f"Starting the local web server on {LOCAL_SERVER_PORT}. Your web browser will send the code"
         " to it."
@@ -169,7 +237,16 @@ def local_http_server(code_challenge, state):
 
 
 def get_access_token():
-    if HEADLESS or LOCAL_AUTH_SERVER_PORT:
+    import httpx
+
+    from trustshell.oidc.oidc_pkce_authcode import (
+        REDIRECT_URI,
+        build_url,
+        code_to_token,
+        gen_things,
+    )
+
+    if config.headless or config.local_auth_server_port:
         logger.debug(
             f"Running in HEADLESS mode, trying OIDC PKCE flow with {REDIRECT_URI}"
         )
@@ -199,6 +276,10 @@ def get_access_token():
 
 
 def launch_browser(code_challenge, state):
+    import webbrowser
+
+    from trustshell.oidc.oidc_pkce_authcode import build_url
+
     url = build_url(code_challenge, state)
     logger.debug(
         f"Launching your browser to go to {url}.  "
@@ -1,18 +1,17 @@
 import click
-import httpx
 import json
 import logging
+import sys
+from typing import IO, TYPE_CHECKING, Any, Iterable, Optional
 from urllib.parse import quote
 
 from rich.console import Console
 from rich.theme import Theme
 
-from trustshell import (
-    AUTH_ENABLED,
-    TRUSTIFY_URL,
-    check_or_get_access_token,
-    config_logging,
-)
+from trustshell import config_logging
+
+if TYPE_CHECKING:
+    from trustshell.client import TrustifyClient
 
 custom_theme = Theme({"warning": "magenta", "error": "bold red"})
 console = Console(color_system="auto", theme=custom_theme)
@@ -23,23 +22,60 @@ logger = logging.getLogger("trustshell")
 @click.option("--debug", "-d", is_flag=True, help="Debug log level.")
 @click.argument("endpoint", type=click.STRING)
 @click.option("-s", "--subpath", type=click.STRING, required=False)
+@click.option(
+    "--output",
+    "-o",
+    type=click.File("wb"),
+    help="Write the response to a file, '-' for stdout. Implies --raw.",
+)
+@click.option(
+    "--raw",
+    "-r",
+    is_flag=True,
+    help="Write the response body as it's received, without formatting.",
+)
+@click.option(
+    "--select",
+    "-S",
+    "select",
+    type=click.STRING,
+    help="Only output the values at a dotted path, eg. items.purl, as JSON Lines.",
+)
+@click.option(
+    "--all-pages",
+    "-a",
+    is_flag=True,
+    help="Follow limit/offset pagination and output every item as JSON Lines.",
+)
 @click.argument("params", nargs=-1, type=click.STRING)
-def api(endpoint: str, subpath: str, params: tuple[str], debug: bool):
+def api(
+    endpoint: str,
+    subpath: str,
+    params: tuple[str],
+    output: Optional[IO[bytes]],
+    raw: bool,
+    select: Optional[str],
+    all_pages: bool,
+    debug: bool,
+):
     """Make direct API calls to Trustify endpoints
 
     ENDPOINT: API endpoint path (e.g., 'analysis/latest/component', 'analysis/status')
     SUBPATH: Optional subpath appended to endpoint that will be URL-encoded (e.g., 'cpe:/redhat:12')
     PARAMS: Query parameters in key=value format (e.g., q=cpe~enterprise_linux limit=10)
+
+    With --all-pages a limit parameter sets the page size, and paging starts from the offset
+    parameter.
     """
     if not debug:
         config_logging(level="INFO")
     else:
         config_logging(level="DEBUG")
 
-    auth_header = {}
-    if AUTH_ENABLED:
-        access_token = check_or_get_access_token()
-        auth_header = {"Authorization": f"Bearer {access_token}"}
+    # Imported here so --help doesn't wait for httpx to load
+    import httpx
+
+    from trustshell.client import get_client
 
     query_params = {}
     for param in params:
@@ -53,16 +89,36 @@ def api(endpoint: str, subpath: str, params: tuple[str], debug: bool):
             )
             return
 
-    url = f"{TRUSTIFY_URL}{endpoint.strip('/')}"
+    url = endpoint.strip("/")
     if subpath:
         url += f"/{quote(subpath, safe='')}"
 
+    if output is None and (raw or select or all_pages):
+        output = sys.stdout.buffer
+    path = select.split(".") if select else []
+    if all_pages:
+        limit = query_params.get("limit", "1")
+        if not limit.isdigit() or int(limit) < 1:
+            raise click.BadParameter("The limit parameter must be a positive integer.")
+        if not query_params.get("offset", "0").isdigit():
+            raise click.BadParameter(
+                "The offset parameter must be a non-negative integer."
+            )
+    response = None
     try:
-        response = httpx.get(url, params=query_params, headers=auth_header, timeout=300)
-        response.raise_for_status()
+        client = get_client()
+        if all_pages:
+            _write_all_pages(client, url, query_params, path, output)
+        elif select:
+            _write_selected(client, url, query_params, path, output)
+        elif output:
+            _write_raw(client, url, query_params, output)
+        else:
+            response = client.get(url, params=query_params)
+            response.raise_for_status()
 
-        data = response.json()
-        console.print(json.dumps(data, indent=2))
+            data = response.json()
+            console.print(json.dumps(data, indent=2))
 
     except httpx.HTTPStatusError as exc:
         console.print(
@@ -70,8 +126,73 @@ def api(endpoint: str, subpath: str, params: tuple[str], debug: bool):
         )
     except httpx.RequestError as exc:
         console.print(f"Request error: {str(exc)}", style="error")
-    except json.JSONDecodeError:
-        console.print("Response is not valid JSON:", style="warning")
-        console.print(response.text)
+    except ValueError as exc:
+        if response is None:
+            console.print(f"Response is not valid JSON: {exc}", style="error")
+        else:
+            console.print("Response is not valid JSON:", style="warning")
+            console.print(response.text)
     except Exception as exc:
         console.print(f"Unexpected error: {str(exc)}", style="error")
+
+
+def _stream(client: "TrustifyClient", url: str, params: dict[str, str]):
+    """Stream a response, reading the body of error responses so they can be reported"""
+    with client.stream("GET", url, params=params) as response:
+        if response.is_error:
+            response.read()
+        response.raise_for_status()
+        yield from response.iter_bytes()
+
+
+def _write_raw(
+    client: "TrustifyClient", url: str, params: dict[str, str], output: IO[bytes]
+) -> None:
+    """Copy the response body to output as it's received"""
+    for chunk in _stream(client, url, params):
+        output.write(chunk)
+    output.flush()
+
+
+def _write_selected(
+    client: "TrustifyClient",
+    url: str,
+    params: dict[str, str],
+    path: list[str],
+    output: IO[bytes],
+) -> None:
+    """Write the values at path in the response to output as JSON Lines, decoding only the
+    selected values while the response is received"""
+    from trustshell.json_stream import iter_json_tokens, select_values
+
+    tokens = iter_json_tokens(_stream(client, url, params))
+    _write_json_lines(select_values(path, next(tokens), tokens), output)
+
+
+def _write_all_pages(
+    client: "TrustifyClient",
+    url: str,
+    params: dict[str, str],
+    path: list[str],
+    output: IO[bytes],
+) -> None:
+    """Write the items of every page to output as JSON Lines, or with a path the values at
+    that path in each page. Pages after the first are fetched concurrently."""
+    from trustshell.client import DEFAULT_PAGE_SIZE
+    from trustshell.json_stream import project
+
+    params = dict(params)
+    offset = int(params.pop("offset", 0))
+    page_size = int(params.pop("limit", DEFAULT_PAGE_SIZE))
+    pages = client.paginate(url, params=params, page_size=page_size, offset=offset)
+    for page in pages:
+        if path:
+            _write_json_lines(project(page, path), output)
+        else:
+            _write_json_lines(page.get("items", []), output)
+
+
+def _write_json_lines(values: Iterable[Any], output: IO[bytes]) -> None:
+    for value in values:
+        output.write(json.dumps(value).encode("utf-8") + b"\n")
+    output.flush()
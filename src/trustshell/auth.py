@@ -0,0 +1,147 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+from trustshell.trace import span
+
+logger = logging.getLogger("trustshell")
+
+# Tokens are refreshed this many seconds before they expire, so that a request sent with a
+# token which is about to expire isn't rejected in flight
+REFRESH_MARGIN = 60
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Get the expiry time of a JWT access token, or None if it isn't a valid JWT with an exp
+    claim. The signature isn't verified, Trustify does that."""
+    import jwt
+
+    try:
+        claims = jwt.decode(
+            token, options={"verify_signature": False, "verify_exp": False}
+        )
+        return float(claims["exp"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBroker:
+    """
+    Hands out a valid access token to any number of threads. The token and its expiry are
+    cached in memory, and the token file is only read when the cached token is about to expire,
+    in case another process refreshed it. Refreshing is single-flight: one thread fetches a new
+    token while the others wait for it, rather than each starting an OIDC flow. The token file
+    is replaced atomically so other processes never read a partially written token.
+    """
+
+    def __init__(
+        self,
+        token_file: str,
+        fetch_token: Callable[[], str],
+        refresh_margin: float = REFRESH_MARGIN,
+    ):
+        self.token_file = token_file
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self._token = ""
+        self._refresh_at = 0.0
+        # A token which was rejected isn't used again, even though it's still in the file
+        self._rejected = ""
+        self._lock = threading.Lock()
+
+    def _refresh_time(self, expires_at: float) -> float:
+        """When to refresh a token which expires at expires_at. A token with less time left
+        than twice the margin is refreshed halfway through, so short lived tokens are still
+        used."""
+        lifetime = expires_at - time.time()
+        return expires_at - min(self.refresh_margin, lifetime / 2)
+
+    def get_token(self) -> str:
+        """Get a token which isn't about to expire, or an empty string if a new token couldn't
+        be fetched"""
+        token = self.cached_token()
+        if token:
+            return token
+        with self._lock:
+            # Another thread may have refreshed the token while this one waited for the lock
+            if self._token and time.time() < self._refresh_at:
+                return self._token
+            token = self._read_token_file()
+            expires_at = None
+            if token and token != self._rejected:
+                expires_at = token_expiry(token)
+            if expires_at and time.time() < expires_at - self.refresh_margin:
+                logger.debug("Access token is valid.")
+                refresh_at = expires_at - self.refresh_margin
+            else:
+                logger.debug(
+                    "Access token is missing or expiring. Getting a new one..."
+                )
+                with span("access token refresh"):
+                    token = self.fetch_token()
+                if not token:
+                    return ""
+                self._write_token_file(token)
+                expires_at = token_expiry(token)
+                # An opaque token is used until Trustify rejects it
+                refresh_at = (
+                    self._refresh_time(expires_at) if expires_at else float("inf")
+                )
+            self._token = token
+            self._refresh_at = refresh_at
+            return token
+
+    def cached_token(self) -> str:
+        """Get the cached token if it isn't about to expire, or an empty string. Never blocks,
+        so it can be called from an event loop before falling back to get_token in a thread."""
+        token = self._token
+        if token and time.time() < self._refresh_at:
+            return token
+        return ""
+
+    def invalidate(self, token: str) -> None:
+        """Stop handing out token, eg. after it was rejected. A newer token is kept."""
+        with self._lock:
+            self._rejected = token
+            if self._token == token:
+                self._token = ""
+                self._refresh_at = 0.0
+
+    def _read_token_file(self) -> str:
+        try:
+            with open(self.token_file, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def _write_token_file(self, token: str) -> None:
+        token_dir = os.path.dirname(self.token_file)
+        os.makedirs(token_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=token_dir, suffix=".tmp")
+        try:
+            # mkstemp creates the file readable by the owner only
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            os.replace(tmp_path, self.token_file)
+        except OSError as e:
+            logger.debug(f"Failed to store access token in {self.token_file}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_token_broker: Optional[TokenBroker] = None
+_token_broker_lock = threading.Lock()
+
+
+def get_token_broker() -> TokenBroker:
+    """Get the TokenBroker shared by all clients in this process"""
+    global _token_broker
+    with _token_broker_lock:
+        if _token_broker is None:
+            from trustshell import TOKEN_FILE, get_access_token
+
+            _token_broker = TokenBroker(TOKEN_FILE, get_access_token)
+    return _token_broker
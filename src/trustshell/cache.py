@@ -0,0 +1,189 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING, BinaryIO, Iterator, Optional
+
+from trustshell import CONFIG_DIR
+from trustshell.json_stream import iter_file_chunks
+
+if TYPE_CHECKING:
+    from trustshell.client import TrustifyClient
+
+logger = logging.getLogger("trustshell")
+
+CACHE_DIR = os.path.join(CONFIG_DIR, "cache")
+# Entries older than this are re-fetched even if no new SBOMs were ingested
+DEFAULT_TTL = 24 * 60 * 60
+# Least recently used entries are evicted once the cache grows beyond this size
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+STATUS_ENDPOINT = "analysis/status"
+
+
+class ResponseCache:
+    """
+    An on-disk cache of Trustify responses. Entries are addressed by a hash of the request url,
+    and are invalidated by age or when the sbom_count/graph_count reported by analysis/status
+    changes, ie. when SBOMs have been ingested or the graph cache was rebuilt.
+
+    Each entry is stored in a single file; the first line is a JSON header with the entry
+    metadata, the rest is the raw response body. File modification times are used to track
+    recency for LRU eviction.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._generation: Optional[list[int]] = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.cache")
+
+    def _open_entry(self, url: str, generation: list[int]) -> Optional[BinaryIO]:
+        """Open a cache entry positioned at the start of the response body, or return None if
+        it's missing or stale"""
+        path = self._path(self.key(url))
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            header = json.loads(f.readline())
+            if header["url"] != url:
+                stale_reason = "a different url"
+            elif header["generation"] != generation:
+                stale_reason = "an older graph"
+            elif time.time() - header["created"] > self.ttl:
+                stale_reason = "expired"
+            else:
+                # Mark the entry as recently used
+                os.utime(path)
+                return f
+            logger.debug(f"Cache entry for {url} is stale: {stale_reason}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(f"Ignoring unreadable cache entry {path}: {e}")
+        f.close()
+        return None
+
+    def _header(self, url: str, generation: list[int]) -> bytes:
+        header = {"url": url, "generation": generation, "created": time.time()}
+        return json.dumps(header).encode("utf-8") + b"\n"
+
+    def get(self, url: str, generation: list[int]) -> Optional[bytes]:
+        """Get a cached response body for url, or None if it's missing or stale"""
+        f = self._open_entry(url, generation)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, url: str, body: bytes, generation: list[int]) -> None:
+        """Store a response body for url, then evict old entries if the cache is too large"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._header(url, generation))
+                f.write(body)
+            os.replace(tmp_path, self._path(self.key(url)))
+        except OSError as e:
+            logger.debug(f"Failed to write cache entry for {url}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".cache"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed by another evict
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> None:
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".cache"):
+                    # Another evict or clear may have removed it since it was listed
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(entry.path)
+
+    def generation(self, client: "TrustifyClient") -> list[int]:
+        """The sbom_count and graph_count of the Trustify server, looked up once per process"""
+        if self._generation is None:
+            status_response = client.get(STATUS_ENDPOINT)
+            status_response.raise_for_status()
+            status = status_response.json()
+            self._generation = [status["sbom_count"], status["graph_count"]]
+        return self._generation
+
+    def fetch(self, client: "TrustifyClient", url: str, refresh: bool = False) -> bytes:
+        """Get the response body for url from the cache, or from Trustify if it's not cached.
+        With refresh the cache is not read, but is updated with the new response"""
+        generation = self.generation(client)
+        if not refresh:
+            body = self.get(url, generation)
+            if body is not None:
+                logger.debug(f"Using cached response for {url}")
+                return body
+        response = client.get(url)
+        response.raise_for_status()
+        self.put(url, response.content, generation)
+        return response.content
+
+    def stream(
+        self, client: "TrustifyClient", url: str, refresh: bool = False
+    ) -> Iterator[bytes]:
+        """Like fetch, but yields the response body in chunks. A response streamed from
+        Trustify is written to the cache as it arrives, and only stored once it's complete"""
+        generation = self.generation(client)
+        if not refresh:
+            f = self._open_entry(url, generation)
+            if f is not None:
+                logger.debug(f"Using cached response for {url}")
+                with f:
+                    yield from iter_file_chunks(f)
+                return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, client.stream("GET", url) as response:
+                response.raise_for_status()
+                f.write(self._header(url, generation))
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self._path(self.key(url)))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
@@ -0,0 +1,439 @@
+import atexit
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httpx
+
+from trustshell import check_or_get_access_token, config
+from trustshell.auth import get_token_broker
+from trustshell.trace import span
+
+logger = logging.getLogger("trustshell")
+
+# Read timeouts in seconds, by Trustify endpoint. The longest matching endpoint prefix wins.
+# Analysis queries walk the SBOM graph on the server and can take minutes on a cold graph cache.
+ENDPOINT_TIMEOUTS = {
+    "analysis/component": 300.0,
+    "analysis/latest/component": 300.0,
+    "analysis/status": 30.0,
+    "purl/base": 60.0,
+}
+DEFAULT_TIMEOUT = 300.0
+CONNECT_TIMEOUT = 10.0
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+# Items requested per page, and pages in flight at once, when paginating list endpoints
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_PAGE_CONCURRENCY = 4
+
+
+def http2_available() -> bool:
+    """HTTP/2 support in httpx requires the optional h2 package"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class AuthenticationError(httpx.RequestError):
+    """No access token could be fetched for a request to Trustify"""
+
+
+class TrustifyAuth(httpx.Auth):
+    """Inject a bearer token into requests sent to the Trustify host only, so the same client
+    can be used for other services such as product definitions without leaking the token.
+    Tokens come from the shared TokenBroker, which refreshes them before they expire; a request
+    rejected with a 401 is retried once with a new token. These flows run in worker threads and
+    in the event loop, so a token which can't be fetched raises AuthenticationError rather than
+    exiting; TrustifyClient.authenticate resolves the first token on the main thread."""
+
+    def __init__(self, host: str):
+        self.host = host
+
+    def _get_token(self, request: httpx.Request) -> str:
+        access_token = get_token_broker().get_token()
+        if not access_token:
+            raise AuthenticationError(
+                "Unable to authenticate to Atlas, please try again after authenticating in"
+                " the browser.",
+                request=request,
+            )
+        return access_token
+
+    async def _get_token_async(self, request: httpx.Request) -> str:
+        """Get a token without blocking the event loop, a refresh may read the token file or
+        start an OIDC flow"""
+        import asyncio
+
+        access_token = get_token_broker().cached_token()
+        if access_token:
+            return access_token
+        return await asyncio.to_thread(self._get_token, request)
+
+    def auth_flow(self, request: httpx.Request):
+        if request.url.host != self.host:
+            yield request
+            return
+        access_token = self._get_token(request)
+        request.headers["Authorization"] = f"Bearer {access_token}"
+        response = yield request
+        if response.status_code == 401:
+            logger.debug("Access token was rejected. Getting a new one...")
+            get_token_broker().invalidate(access_token)
+            access_token = self._get_token(request)
+            request.headers["Authorization"] = f"Bearer {access_token}"
+            yield request
+
+    async def async_auth_flow(self, request: httpx.Request):
+        if request.url.host != self.host:
+            yield request
+            return
+        access_token = await self._get_token_async(request)
+        request.headers["Authorization"] = f"Bearer {access_token}"
+        response = yield request
+        if response.status_code == 401:
+            logger.debug("Access token was rejected. Getting a new one...")
+            get_token_broker().invalidate(access_token)
+            access_token = await self._get_token_async(request)
+            request.headers["Authorization"] = f"Bearer {access_token}"
+            yield request
+
+
+def fixture_name(endpoint: str) -> str:
+    """
+    Name the file to record the response of a Trustify endpoint in, after the component it's
+    about where possible, eg. 'openssl-<hash>.json' for an analysis query of
+    pkg:rpm/redhat/openssl or 'base_purl-openssl-<hash>.json' for the details of that base
+    purl. The hash of the endpoint keeps the names of different queries apart.
+    """
+    parsed = urlparse(endpoint)
+    query = parse_qs(parsed.query).get("q", [""])[0]
+    if parsed.path.startswith("purl/base/"):
+        base_purl = unquote(parsed.path[len("purl/base/") :])
+        name = f"base_purl-{base_purl.split('?')[0].split('/')[-1]}"
+    elif parsed.path.startswith("analysis/") and "purl~" in query:
+        name = query.split("purl~", 1)[1].split("@")[0].split("/")[-1]
+    else:
+        name = parsed.path.strip("/").replace("/", "-")
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", name) or "response"
+    digest = hashlib.sha1(endpoint.encode()).hexdigest()[:8]
+    return f"{name}-{digest}.json"
+
+
+class _Recorder:
+    """Saves the JSON bodies of successful GET responses from Trustify to record_dir"""
+
+    def __init__(self, base_url: str, record_dir: str):
+        self.base_url = base_url
+        self.record_dir = record_dir
+
+    def wants(self, request: httpx.Request) -> bool:
+        return request.method == "GET" and str(request.url).startswith(self.base_url)
+
+    def record(self, request: httpx.Request, response: httpx.Response, raw: bytes):
+        """Save a response, given its raw body, returning a response to replace it with"""
+        replay = httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            content=raw,
+            request=request,
+            extensions=response.extensions,
+        )
+        content_type = response.headers.get("content-type", "")
+        if response.status_code == 200 and "json" in content_type:
+            endpoint = str(request.url)[len(self.base_url) :]
+            path = os.path.join(self.record_dir, fixture_name(endpoint))
+            os.makedirs(self.record_dir, exist_ok=True)
+            # The body is decoded from any content encoding when it's read
+            with open(path, "wb") as f:
+                f.write(replay.read())
+            logger.debug(f"Recorded {endpoint} in {path}")
+        return replay
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Records Trustify responses in the format of the fixtures in tests/testdata, so they can
+    be served by benchmarks/trustify_server.py. Responses are read in full before they're
+    returned, so streamed responses are recorded too."""
+
+    def __init__(self, transport: httpx.BaseTransport, base_url: str, record_dir: str):
+        self.transport = transport
+        self.recorder = _Recorder(base_url, record_dir)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.transport.handle_request(request)
+        if not self.recorder.wants(request):
+            return response
+        try:
+            raw = b"".join(response.stream)
+        finally:
+            response.close()
+        return self.recorder.record(request, response, raw)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    """RecordingTransport for async clients"""
+
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, base_url: str, record_dir: str
+    ):
+        self.transport = transport
+        self.recorder = _Recorder(base_url, record_dir)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        if not self.recorder.wants(request):
+            return response
+        try:
+            raw = b"".join([chunk async for chunk in response.stream])
+        finally:
+            await response.aclose()
+        return self.recorder.record(request, response, raw)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class TrustifyClient:
+    """
+    A pooled keep-alive HTTP client for Trustify. Endpoints can be given relative to the
+    Trustify API base url (eg. 'analysis/status') or as absolute urls. With record_dir, which
+    defaults to TRUSTSHELL_RECORD, the responses from Trustify are saved in that directory.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        auth_enabled: Optional[bool] = None,
+        http2: Optional[bool] = None,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        transport: Optional[httpx.BaseTransport] = None,
+        record_dir: Optional[str] = None,
+    ):
+        if base_url is None:
+            base_url = config.trustify_url
+        if auth_enabled is None:
+            auth_enabled = config.auth_enabled
+        if record_dir is None:
+            record_dir = config.record_dir
+        self.record_dir = record_dir
+        self.base_url = base_url
+        if http2 is None:
+            http2 = http2_available()
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.auth: Optional[TrustifyAuth] = None
+        if auth_enabled:
+            self.auth = TrustifyAuth(urlparse(base_url).hostname)
+        if record_dir:
+            if transport is None:
+                transport = httpx.HTTPTransport(http2=self.http2, limits=self.limits)
+            transport = RecordingTransport(transport, base_url, record_dir)
+        self._transport = transport
+        self._client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def authenticate(self) -> None:
+        """Make sure there's a valid access token before requests are sent from worker threads
+        or an event loop. This may open a browser for the OIDC flow, and exits if no token could
+        be fetched, so it must be called from the main thread."""
+        if self.auth is not None:
+            check_or_get_access_token()
+
+    @property
+    def client(self) -> httpx.Client:
+        """The underlying httpx client, created on first use"""
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    auth=self.auth,
+                    http2=self.http2,
+                    limits=self.limits,
+                    timeout=self.timeout(""),
+                    transport=self._transport,
+                )
+        return self._client
+
+    def url(self, endpoint: str) -> str:
+        """Get the absolute url of a Trustify endpoint"""
+        if urlparse(endpoint).scheme:
+            return endpoint
+        return f"{self.base_url}{endpoint.lstrip('/')}"
+
+    def timeout(self, url: str) -> httpx.Timeout:
+        """Get the timeout for a request to url based on the Trustify endpoint it targets"""
+        read_timeout = DEFAULT_TIMEOUT
+        if url.startswith(self.base_url):
+            url = url[len(self.base_url) :]
+        matched = ""
+        for endpoint, endpoint_timeout in ENDPOINT_TIMEOUTS.items():
+            if url.startswith(endpoint) and len(endpoint) > len(matched):
+                matched = endpoint
+                read_timeout = endpoint_timeout
+        return httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+
+    def request(self, method: str, endpoint: str, **kwargs: Any) -> httpx.Response:
+        url = self.url(endpoint)
+        kwargs.setdefault("timeout", self.timeout(url))
+        with span(_span_name(method, url), "http", url=url) as args:
+            response = self.client.request(method, url, **kwargs)
+            args["status"] = response.status_code
+            return response
+
+    def get(self, endpoint: str, **kwargs: Any) -> httpx.Response:
+        return self.request("GET", endpoint, **kwargs)
+
+    def head(self, endpoint: str, **kwargs: Any) -> httpx.Response:
+        return self.request("HEAD", endpoint, **kwargs)
+
+    @contextmanager
+    def stream(
+        self, method: str, endpoint: str, **kwargs: Any
+    ) -> Iterator[httpx.Response]:
+        """Send a request without reading the response body, for use as a context manager,
+        eg. 'with client.stream("GET", url) as response:'"""
+        url = self.url(endpoint)
+        kwargs.setdefault("timeout", self.timeout(url))
+        with span(_span_name(method, url), "http", url=url) as args:
+            with self.client.stream(method, url, **kwargs) as response:
+                args["status"] = response.status_code
+                yield response
+
+    def paginate(
+        self,
+        endpoint: str,
+        params: Optional[dict[str, Any]] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_results: Optional[int] = None,
+        concurrency: int = DEFAULT_PAGE_CONCURRENCY,
+        offset: int = 0,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Get the pages of a Trustify list endpoint using limit and offset, starting from the item
+        at offset. The first page is fetched on its own to learn the total, then up to
+        'concurrency' of the remaining pages are fetched at once. Pages are yielded in order as
+        soon as they arrive, so the caller can work on the first page while later ones are in
+        flight. No more than max_results items are fetched, and pages still in flight are
+        cancelled if the generator is closed early.
+        """
+        params = dict(params or {})
+
+        def fetch(start: int, limit: int) -> dict[str, Any]:
+            response = self.get(
+                endpoint, params={**params, "offset": offset + start, "limit": limit}
+            )
+            response.raise_for_status()
+            return response.json()
+
+        limit = page_size if max_results is None else min(page_size, max_results)
+        if limit <= 0:
+            return
+        page = fetch(0, limit)
+        yield page
+        fetched = len(page.get("items", []))
+        total = page.get("total")
+        if total is not None:
+            # The items from offset onwards
+            total = max(total - offset, 0)
+        if max_results is not None:
+            total = max_results if total is None else min(total, max_results)
+        if fetched == 0 or (total is not None and fetched >= total):
+            return
+        if total is None:
+            # Without a total the pages can only be fetched one after the other
+            while len(page.get("items", [])) == limit:
+                page = fetch(fetched, limit)
+                yield page
+                fetched += len(page.get("items", []))
+            return
+
+        # The server may return fewer items per page than asked for
+        stride = fetched
+        starts = iter(range(stride, total, stride))
+        pending: deque[Future] = deque()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            def submit_next() -> None:
+                start = next(starts, None)
+                if start is not None:
+                    pending.append(
+                        executor.submit(fetch, start, min(stride, total - start))
+                    )
+
+            try:
+                for _ in range(concurrency):
+                    submit_next()
+                while pending:
+                    page = pending.popleft().result()
+                    submit_next()
+                    yield page
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def async_client(self, max_connections: Optional[int] = None) -> httpx.AsyncClient:
+        """Create an async client sharing the auth and connection settings of this client. The
+        caller is responsible for closing it, eg. 'async with client.async_client() as ac:'"""
+        limits = self.limits
+        if max_connections:
+            limits = httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            )
+        transport = None
+        if self.record_dir:
+            transport = AsyncRecordingTransport(
+                httpx.AsyncHTTPTransport(http2=self.http2, limits=limits),
+                self.base_url,
+                self.record_dir,
+            )
+        return httpx.AsyncClient(
+            auth=self.auth,
+            http2=self.http2,
+            limits=limits,
+            timeout=self.timeout(""),
+            transport=transport,
+        )
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def __enter__(self) -> "TrustifyClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _span_name(method: str, url: str) -> str:
+    """Name trace spans of requests by endpoint, without the query"""
+    return f"{method} {urlparse(url).path}"
+
+
+_shared_client: Optional[TrustifyClient] = None
+
+
+def get_client() -> TrustifyClient:
+    """Get the TrustifyClient shared by all commands in this process. Commands get it on the
+    main thread before starting concurrent work, which is where the access token is resolved."""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = TrustifyClient()
+        atexit.register(_shared_client.close)
+        _shared_client.authenticate()
+    return _shared_client
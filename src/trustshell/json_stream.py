@@ -0,0 +1,139 @@
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator
+
+# Size of the chunks to read when streaming a file or response body
+READ_SIZE = 64 * 1024
+
+# Matches a single JSON token after optional whitespace and separators. The groups are, in
+# order: structural characters, the contents of a string and scalars (numbers, true, false,
+# null).
+_TOKEN_RE = re.compile(
+    r'[ \t\n\r,:]*(?:([\[\]{}])|"([^"\\]*(?:\\.[^"\\]*)*)"|([^ \t\n\r\[\]{},:"]+))',
+    re.S,
+)
+
+Token = tuple[str, Any]
+
+
+def iter_json_tokens(chunks: Iterable[bytes]) -> Iterator[Token]:
+    """
+    Incrementally tokenize a JSON document delivered as chunks of UTF-8 bytes, only holding
+    the unconsumed part of the current chunk in memory.
+
+    Yields ('{', None), ('}', None), ('[', None), (']', None) for structural characters,
+    ('s', str) for strings and ('v', value) for numbers, booleans and null. Separators are
+    not reported, consumers are expected to know the structure of the document.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunk_iter = iter(chunks)
+    buf = ""
+    pos = 0
+    final = False
+    while True:
+        match = _TOKEN_RE.match(buf, pos)
+        # A scalar at the end of the buffer might continue in the next chunk
+        if match is None or (
+            not final and match.group(3) is not None and match.end() == len(buf)
+        ):
+            if final:
+                if buf[pos:].strip():
+                    raise ValueError(f"Invalid JSON near: {buf[pos : pos + 40]!r}")
+                return
+            try:
+                text = decoder.decode(next(chunk_iter))
+            except StopIteration:
+                text = decoder.decode(b"", final=True)
+                final = True
+            buf = buf[pos:] + text
+            pos = 0
+            continue
+        pos = match.end()
+        structural, string, scalar = match.groups()
+        if structural:
+            yield structural, None
+        elif string is not None:
+            if "\\" in string:
+                string = json.loads(f'"{string}"')
+            yield "s", string
+        else:
+            yield "v", json.loads(scalar)
+
+
+def skip_value(first: Token, tokens: Iterator[Token]) -> None:
+    """Consume the rest of the value starting with the token 'first' without decoding it"""
+    if first[0] not in ("{", "["):
+        return
+    depth = 1
+    for kind, _ in tokens:
+        if kind in ("{", "["):
+            depth += 1
+        elif kind in ("}", "]"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def read_value(first: Token, tokens: Iterator[Token]) -> Any:
+    """Consume and decode the value starting with the token 'first'"""
+    kind, value = first
+    if kind == "[":
+        items = []
+        for token in tokens:
+            if token[0] == "]":
+                return items
+            items.append(read_value(token, tokens))
+    if kind == "{":
+        obj = {}
+        for key_kind, key in tokens:
+            if key_kind == "}":
+                return obj
+            obj[key] = read_value(next(tokens), tokens)
+    return value
+
+
+def select_values(
+    path: list[str], first: Token, tokens: Iterator[Token]
+) -> Iterator[Any]:
+    """
+    Consume the value starting with the token 'first' and yield the values found at path, a
+    list of object keys. Arrays are walked into, so ['items', 'purl'] yields the purl of every
+    item, and an array found at the end of the path yields its elements. Only the selected
+    values are decoded.
+    """
+    kind = first[0]
+    if kind == "[":
+        for token in tokens:
+            if token[0] == "]":
+                return
+            yield from select_values(path, token, tokens)
+        return
+    if not path:
+        yield read_value(first, tokens)
+    elif kind == "{":
+        for key_kind, key in tokens:
+            if key_kind == "}":
+                return
+            value_first = next(tokens)
+            if key == path[0]:
+                yield from select_values(path[1:], value_first, tokens)
+            else:
+                skip_value(value_first, tokens)
+
+
+def project(value: Any, path: list[str]) -> Iterator[Any]:
+    """Yield the values found at path in an already decoded value, the same way as
+    select_values"""
+    if isinstance(value, list):
+        for element in value:
+            yield from project(element, path)
+    elif not path:
+        yield value
+    elif isinstance(value, dict) and path[0] in value:
+        yield from project(value[path[0]], path[1:])
+
+
+def iter_file_chunks(f) -> Iterator[bytes]:
+    """Read a binary file in READ_SIZE chunks"""
+    yield from iter(lambda: f.read(READ_SIZE), b"")
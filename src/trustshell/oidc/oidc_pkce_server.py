@@ -1,62 +1,148 @@
 import json
 import os
-from http.server import SimpleHTTPRequestHandler
 import socketserver
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler
 from urllib.parse import (
     parse_qs,
     urlparse,
 )
 
-from oidc_pkce_authcode import code_to_token, gen_things, get_fresh_token, AUTH_ENDPOINT
+import jwt
+
+import oidc_pkce_authcode
+from oidc_pkce_authcode import code_to_token, gen_things, AUTH_ENDPOINT
+
+# Access tokens are refreshed this many seconds before they expire, so trustshell doesn't get
+# a token which expires while it's being used
+REFRESH_MARGIN = 60
+STATS_PATH = "/stats"
+
+
+def token_expiry(access_token: str) -> float:
+    """Get the expiry time of an access token, or 0 if it doesn't have one so it isn't cached"""
+    try:
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+        return float(claims["exp"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class TokenCache:
+    """
+    Holds the refresh token and the last access token. The access token is handed out until
+    it's close to expiry, then one request refreshes it while any concurrent requests wait for
+    that refresh rather than each calling the SSO token endpoint.
+    """
+
+    def __init__(self, refresh_margin: float = REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.refresh_token = ""
+        self.access_token = ""
+        self.expires_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.refresh_seconds = 0.0
+        self.max_refresh_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return bool(self.access_token) and time.time() < (
+            self.expires_at - self.refresh_margin
+        )
+
+    def set_tokens(self, access_token: str, refresh_token: str) -> None:
+        with self._lock:
+            self.access_token = access_token
+            self.refresh_token = refresh_token
+            self.expires_at = token_expiry(access_token)
+
+    def get_access_token(self) -> str:
+        """Get a cached access token, or a fresh one from the SSO server. Requires a refresh
+        token."""
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self.access_token
+            self.misses += 1
+            start = time.perf_counter()
+            try:
+                access_token, refresh_token = oidc_pkce_authcode.get_fresh_token(
+                    self.refresh_token
+                )
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self.refresh_seconds += elapsed
+                self.max_refresh_seconds = max(self.max_refresh_seconds, elapsed)
+            self.access_token = access_token
+            self.refresh_token = refresh_token
+            self.expires_at = token_expiry(access_token)
+            return access_token
 
-PORT = int(os.getenv("LISTEN_PORT"))
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "refresh_ms_total": round(self.refresh_seconds * 1000, 1),
+                "refresh_ms_max": round(self.max_refresh_seconds * 1000, 1),
+                "refresh_populated": bool(self.refresh_token),
+                "expires_in": max(0, round(self.expires_at - time.time())),
+            }
 
-# These can remain global as they are generated once and don't change
-code_verifer, code_challenge, state = gen_things()
 
+# 1. Custom HTTPServer to hold the tokens, handling each request in its own thread
+class CustomHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
 
-# 1. Custom HTTPServer to hold the refresh_token
-class CustomHTTPServer(socketserver.TCPServer):
     def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
         super().__init__(server_address, RequestHandlerClass, bind_and_activate)
-        self.refresh_token = ""  # Initialize refresh_token on the server instance
+        # These are generated once and don't change
+        self.code_verifier, self.code_challenge, self.state = gen_things()
+        self.token_cache = TokenCache()
 
 
 class Handler(SimpleHTTPRequestHandler):
     def do_GET(self):
-        query = parse_qs(urlparse(self.path).query)
+        parsed_path = urlparse(self.path)
+        if parsed_path.path == STATS_PATH:
+            self._send_json(200, self.server.token_cache.stats())
+            return
+
+        query = parse_qs(parsed_path.query)
         codes = query.get("code", [])
 
         if not codes:
+            token_cache = self.server.token_cache
             # Check refresh_token on the server instance
-            if not self.server.refresh_token:
+            if not token_cache.refresh_token:
                 response_data = {
-                    "code_challenge": code_challenge,
-                    "state": state,
+                    "code_challenge": self.server.code_challenge,
+                    "state": self.server.state,
                     "auth_server": AUTH_ENDPOINT,
                 }
             else:
-                # Use the refresh_token from the server instance to get a fresh token
-                access_token, refresh_token = get_fresh_token(self.server.refresh_token)
-                # Update the access_token and refresh_token on the server instance
-                self.server.refresh_token = refresh_token
-                response_data = {"access_token": access_token}
-
-            response_content = json.dumps(response_data)
-            response_bytes = response_content.encode("utf-8")
-
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(response_bytes)))
-            self.end_headers()
-            self.wfile.write(response_bytes)  # Write response bytes to client
+                try:
+                    response_data = {"access_token": token_cache.get_access_token()}
+                except Exception as e:
+                    self._send_json(502, {"error": f"Failed to refresh token: {e}"})
+                    return
+            self._send_json(200, response_data)
             return
 
         # This handles the callback with the authorization code
         # Store the access_token and refresh_token on the server instance
-        access_token, refresh_token, _ = code_to_token(codes[0], code_verifer)
-        self.server.access_token = access_token
-        self.server.refresh_token = refresh_token
+        access_token, refresh_token, _ = code_to_token(
+            codes[0], self.server.code_verifier
+        )
+        self.server.token_cache.set_tokens(access_token, refresh_token)
 
         self.send_response(200)
         self.send_header("Content-type", "text/html")
@@ -65,17 +151,30 @@ class Handler(SimpleHTTPRequestHandler):
             b"<html><h2>Auth server initialized re-run the command in TrustShell</h2></html>\n"
         )
 
+    def _send_json(self, status, response_data):
+        response_bytes = json.dumps(response_data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)  # Write response bytes to client
+
     def log_message(self, format, *args):
         # Enhanced logging for clarity
-        refresh_populated = False
-        if self.server.refresh_token:
-            refresh_populated = True
+        stats = self.server.token_cache.stats()
         print(
-            f"[{self.log_date_time_string()}] {self.command} {self.path} - refresh populated?: {refresh_populated}"
+            f"[{self.log_date_time_string()}] {self.command} {self.path} - refresh populated?: "
+            f"{stats['refresh_populated']} hits: {stats['hits']} misses: {stats['misses']}"
         )
 
 
-# Use the CustomHTTPServer for your server instance
-with CustomHTTPServer(("", PORT), Handler) as httpd:
-    print(f"Serving HTTP on port {PORT}")
-    httpd.serve_forever()
+def main():
+    port = int(os.getenv("LISTEN_PORT"))
+    # Use the CustomHTTPServer for your server instance
+    with CustomHTTPServer(("", port), Handler) as httpd:
+        print(f"Serving HTTP on port {port}")
+        httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
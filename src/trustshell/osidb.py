@@ -1,27 +1,96 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
 import os
 import subprocess
 import sys
 import tempfile
+import time
+from typing import Any, Callable, Optional
 
 import click
 from requests import HTTPError
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import ConnectTimeout, RequestException, Timeout
+from urllib3.exceptions import NewConnectionError
 from trustshell import console
+from trustshell.trace import span
 import osidb_bindings
 from osidb_bindings.bindings.python_client.models import Flaw
 
 logger = logging.getLogger(__name__)
 
+# Affects are created this many at a time, with up to OSIDB_WORKERS creates or deletes in flight
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_WORKERS = 4
+# A request which fails with a server error or a connection problem is attempted up to this
+# many times, waiting RETRY_DELAY seconds before the first retry and doubling after that
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+
+def _is_retryable(e: RequestException) -> bool:
+    if isinstance(e, HTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return isinstance(e, (RequestsConnectionError, Timeout))
+
+
+def _was_not_processed(e: RequestException) -> bool:
+    """Whether a failed request certainly wasn't acted on by OSIDB, so that a request which
+    isn't idempotent can be sent again as it is"""
+    if isinstance(e, HTTPError) and e.response is not None:
+        return e.response.status_code in (429, 503)
+    if isinstance(e, ConnectTimeout):
+        return True
+    if isinstance(e, RequestsConnectionError) and e.args:
+        # requests wraps the urllib3 error, which has the underlying error as its reason
+        reason = getattr(e.args[0], "reason", e.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _error_message(e: RequestException) -> str:
+    if isinstance(e, HTTPError) and e.response is not None:
+        return f"{e}: {e.response.text}"
+    return str(e)
+
 
 class OSIDB:
-    def __init__(self):
-        endpoint = os.getenv("OSIDB_ENDPOINT")
-        if endpoint is None:
-            raise EnvironmentError(
-                "The environment variable 'OSIDB_ENDPOINT' is not set."
-            )
-        self.session = osidb_bindings.new_session(osidb_server_uri=endpoint)
+    def __init__(
+        self,
+        session: Optional[Any] = None,
+        chunk_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        retry_delay: float = RETRY_DELAY,
+    ):
+        if session is None:
+            endpoint = os.getenv("OSIDB_ENDPOINT")
+            if endpoint is None:
+                raise EnvironmentError(
+                    "The environment variable 'OSIDB_ENDPOINT' is not set."
+                )
+            with span("osidb session", "osidb"):
+                session = osidb_bindings.new_session(osidb_server_uri=endpoint)
+        self.session = session
+        self.chunk_size = chunk_size or int(
+            os.getenv("OSIDB_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+        )
+        self.workers = workers or int(os.getenv("OSIDB_WORKERS", DEFAULT_WORKERS))
+        self.retry_delay = retry_delay
+
+    def _call_with_retry(self, name: str, call: Callable[[], Any], **args: Any) -> Any:
+        """Call an OSIDB endpoint, retrying server errors and connection problems"""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                with span(name, "osidb", attempt=attempt, **args):
+                    return call()
+            except RequestException as e:
+                if attempt == MAX_ATTEMPTS or not _is_retryable(e):
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.debug(f"{name} failed: {e}, retrying in {delay}s")
+                time.sleep(delay)
 
     @staticmethod
     def parse_module_purl_tuples(tuples_list: list[str]) -> set[tuple[str, str]]:
@@ -94,9 +163,10 @@ class OSIDB:
         return OSIDB.parse_module_purl_tuples(modified_lines)
 
     def add_affects(self, flaw: Flaw, affects_to_add: set[tuple[str, str]]) -> None:
-        console.print("Adding affects...")
+        """Create affects in chunks of chunk_size, several chunks at a time. Exits after
+        reporting the affects which couldn't be added if any chunk fails."""
         affects_data = []
-        for affect in affects_to_add:
+        for affect in sorted(affects_to_add):
             osidb_affect = {
                 "flaw": flaw.uuid,
                 "embargoed": flaw.embargoed,
@@ -105,15 +175,154 @@ class OSIDB:
                 "purl": affect[1],
             }
             affects_data.append(osidb_affect)
+        chunks = [
+            affects_data[i : i + self.chunk_size]
+            for i in range(0, len(affects_data), self.chunk_size)
+        ]
+        console.print(
+            f"Adding {len(affects_data)} affects in {len(chunks)} requests..."
+        )
         try:
-            bulk_create_response = self.session.affects.bulk_create(
-                form_data=affects_data
+            # The affects on the flaw before any are created, so that after a failure the
+            # affects which this call created can be told apart from those already there
+            before = {affect.uuid for affect in self.retrieve_flaw(flaw.uuid).affects}
+        except RequestException as e:
+            console.print(
+                f"Could not retrieve flaw {flaw.uuid}: {_error_message(e)}",
+                style="error",
             )
-        except HTTPError as e:
-            msg = e.response.text
-            console.print(f"Failed to update flaw: {e}: {msg}")
             exit(1)
-        console.print(f"Added {len(bulk_create_response.results)} new affects")
+        added = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._create_affects, flaw, chunk, before)
+                for chunk in chunks
+            ]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    added += future.result()
+                except RequestException as e:
+                    failed.append((chunk, _error_message(e)))
+        console.print(f"Added {added} new affects")
+        if failed:
+            for chunk, error in failed:
+                console.print(
+                    f"Failed to update flaw, {len(chunk)} affects weren't added: {error}",
+                    style="error",
+                )
+                for affect in chunk:
+                    console.print(f"  - {affect['ps_module']},{affect['purl']}")
+            exit(1)
+
+    def _create_affects(
+        self, flaw: Flaw, chunk: list[dict[str, Any]], before: set[str]
+    ) -> int:
+        """
+        Create a chunk of affects, returning the number created. bulk_create isn't idempotent,
+        so after a failure which OSIDB might have acted on, eg. a timeout or a 500, the flaw's
+        affects are read again and the ones created since before, the uuids of the affects
+        the flaw had beforehand, are dropped from the chunk before it's retried.
+        """
+        created = 0
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                with span(
+                    "osidb affects.bulk_create",
+                    "osidb",
+                    attempt=attempt,
+                    count=len(chunk),
+                ):
+                    response = self.session.affects.bulk_create(form_data=chunk)
+                return created + len(response.results)
+            except RequestException as e:
+                if attempt == MAX_ATTEMPTS or not _is_retryable(e):
+                    raise
+                if not _was_not_processed(e):
+                    created_since = {
+                        (affect.ps_module, affect.purl)
+                        for affect in self.retrieve_flaw(flaw.uuid).affects
+                        if affect.uuid not in before
+                    }
+                    remaining = [
+                        affect
+                        for affect in chunk
+                        if (affect["ps_module"], affect["purl"]) not in created_since
+                    ]
+                    created += len(chunk) - len(remaining)
+                    chunk = remaining
+                    if not chunk:
+                        return created
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.debug(f"Creating affects failed: {e}, retrying in {delay}s")
+                time.sleep(delay)
+
+    def delete_affects(self, affects_to_delete: dict[tuple[str, str], str]) -> None:
+        """Delete affects, given by (ps_module, purl) with their uuid, several at a time.
+        Exits after reporting the affects which couldn't be deleted if any delete fails."""
+        if not affects_to_delete:
+            return
+        console.print(f"Deleting {len(affects_to_delete)} affects...")
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                key: executor.submit(
+                    self._call_with_retry,
+                    "osidb affects.delete",
+                    partial(self.session.affects.delete, id=uuid),
+                )
+                for key, uuid in affects_to_delete.items()
+            }
+            for key, future in futures.items():
+                try:
+                    future.result()
+                except RequestException as e:
+                    failed[key] = _error_message(e)
+        console.print(f"Deleted {len(affects_to_delete) - len(failed)} affects")
+        if failed:
+            for key, error in failed.items():
+                console.print(
+                    f"Failed to delete flaw affect {key}: {error}", style="error"
+                )
+            exit(1)
+
+    def retrieve_flaw(self, flaw_id: str) -> Flaw:
+        """Get a flaw by uuid or CVE, with its affects"""
+        return self._call_with_retry(
+            "osidb flaws.retrieve", partial(self.session.flaws.retrieve, id=flaw_id)
+        )
+
+    @staticmethod
+    def plan_affects(
+        flaw: Flaw, ps_module_purls: set[tuple[str, str]], replace_mode=False
+    ) -> tuple[set[tuple[str, str]], dict[tuple[str, str], str]]:
+        """
+        Work out the changes needed to give flaw the affects in ps_module_purls. Returns the
+        affects to add, which aren't already on the flaw in NEW state, and with replace_mode
+        the uuids of the NEW affects which aren't in ps_module_purls, to be deleted.
+        """
+        existing_new = set()
+        affects_to_delete = {}
+        for affect in flaw.affects:
+            if affect.affectedness != "NEW":
+                continue
+            key = (affect.ps_module, affect.purl)
+            existing_new.add(key)
+            # Don't delete and re-add existing new affects
+            if replace_mode and affect.purl and key not in ps_module_purls:
+                affects_to_delete[key] = affect.uuid
+        return ps_module_purls - existing_new, affects_to_delete
+
+    def apply_affects(
+        self,
+        flaw: Flaw,
+        affects_to_add: set[tuple[str, str]],
+        affects_to_delete: dict[tuple[str, str], str],
+    ) -> None:
+        """Delete then add affects as planned by plan_affects. Exits if any change fails."""
+        self.delete_affects(affects_to_delete)
+        if affects_to_add:
+            self.add_affects(flaw, affects_to_add)
 
     def edit_flaw_affects(
         self, flaw_id: str, ps_module_purls: set[tuple[str, str]], replace_mode=False
@@ -125,7 +334,7 @@ class OSIDB:
         console.print(f"Processing flaw affects for flaw: {flaw_id}")
 
         try:
-            flaw = self.session.flaws.retrieve(id=flaw_id)
+            flaw = self.retrieve_flaw(flaw_id)
         except Exception as e:
             console.print(f"Could not retrieve flaw {flaw_id}: {e}")
             return
@@ -165,10 +374,10 @@ class OSIDB:
                 console.print("  (No tuples provided after editing)")
             console.print("-----------------------------------\n")
 
+        affects_to_add, affects_to_delete = self.plan_affects(
+            flaw, ps_module_purls, replace_mode
+        )
         if not replace_mode:
-            affects_to_add = (
-                ps_module_purls - affects_by_state["NEW"]
-            )  # Only truly new ones
             if not affects_to_add:
                 console.print(
                     "No new ps_module/purl tuples to add. All provided are already present or in different states."
@@ -211,31 +420,4 @@ class OSIDB:
             )
 
             console.print("Replacing affects...")
-            existing_affects = {}
-            for affect in flaw.affects:
-                if affect.purl:
-                    existing_affects[(affect.ps_module, affect.purl)] = (
-                        affect.uuid,
-                        affect.affectedness,
-                    )
-
-            # Check for existing affects in new state to remove
-            for existing_key, existing_value in existing_affects.items():
-                existing_uuid, existing_affectedness = existing_value
-                # Don't delete and re-add existing new affects
-                if (
-                    existing_key not in ps_module_purls
-                    and existing_affectedness == "NEW"
-                ):
-                    try:
-                        self.session.affects.delete(id=existing_uuid)
-                    except HTTPError as e:
-                        msg = e.response.text
-                        console.print(
-                            f"Failed to delete flaw affect {existing_key}: {e}: {msg}",
-                            style="error",
-                        )
-                        exit(1)
-
-            # Add any new affects not already on the flaw in NEW state
-            self.add_affects(flaw, ps_module_purls)
+            self.apply_affects(flaw, affects_to_add, affects_to_delete)
@@ -1,16 +1,24 @@
 from collections import defaultdict
-import copy
+import functools
 import json
 import logging
 import os
 import re
-import httpx
+import tempfile
+from typing import Any, Optional
 
 from anytree import Node, NodeMixin, LevelOrderGroupIter
-from trustshell import CONFIG_DIR, console
+from trustshell import CONFIG_DIR, console, ensure_config_dir
+from trustshell.client import get_client
 
 logger = logging.getLogger(__name__)
 
+_REGEX_SPECIAL = set(".^$*+?{}[]|()\\")
+_REGEX_QUANTIFIERS = set("*+?{")
+
+# Patterns are compiled on first use, so loading a ProdDefs index doesn't compile them all
+_compile = functools.cache(re.compile)
+
 
 class ProductBase(object):
     def __init__(self, name):
@@ -33,13 +41,109 @@ class ProductModule(ProductBase, NodeMixin):
         ]
 
     def match(self, cpe) -> bool:
-        # First try to match exactly, then substring
-        for suffix in ("$", ""):
-            # We must try in descending-length order so that X:10 matches before X:1.
-            for regex in sorted(self.cpe_patterns, key=len, reverse=True):
-                if re.match(regex + suffix, cpe):
-                    return True
-        return False
+        # Any pattern matching exactly also matches as a prefix, so a single prefix match of
+        # each pattern is enough to tell if the module matches
+        return any(_compile(regex).match(cpe) for regex in self.cpe_patterns)
+
+
+def _split_literal_prefix(regex: str) -> tuple[str, str]:
+    """Split a regex into the literal text it must start with, and the remaining regex"""
+    if "|" in regex:
+        # An alternation can match without the leading literal
+        return "", regex
+    literals: list[tuple[str, int]] = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\" and i + 1 < len(regex) and not regex[i + 1].isalnum():
+            literals.append((regex[i + 1], i))
+            i += 2
+            continue
+        if char in _REGEX_SPECIAL:
+            break
+        literals.append((char, i))
+        i += 1
+    if i < len(regex) and regex[i] in _REGEX_QUANTIFIERS and literals:
+        # The quantifier applies to the last literal, so it's not required
+        _, i = literals.pop()
+    return "".join(char for char, _ in literals), regex[i:]
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        # (item index, regex the rest of the string must match or "")
+        self.entries: list[tuple[int, str]] = []
+
+
+class CPEMatcher:
+    """
+    Match a CPE against the patterns of many items at once. The literal start of each pattern
+    is stored in a character trie, so a lookup walks the CPE once and only tries the regex
+    remainder of patterns whose literal prefix matched. Matching items are returned in the
+    order they were added, as many times as they were added.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._items: list[Any] = []
+
+    def add(self, item: Any, patterns: list[str]) -> None:
+        """Add an item which matches a CPE when any of the regex patterns match its start"""
+        index = len(self._items)
+        self._items.append(item)
+        for pattern in patterns:
+            prefix, remainder = _split_literal_prefix(pattern)
+            node = self._root
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            node.entries.append((index, remainder))
+
+    @property
+    def items(self) -> list[Any]:
+        """The items in the order they were added"""
+        return self._items
+
+    def trie(self) -> list[list]:
+        """The trie as plain data, a list of [entries, {char: child position}] with the root
+        first, so it can be stored and loaded with from_trie without adding every pattern"""
+        nodes = [self._root]
+        trie = []
+        for node in nodes:
+            children = {}
+            for char, child in node.children.items():
+                children[char] = len(nodes)
+                nodes.append(child)
+            trie.append([node.entries, children])
+        return trie
+
+    @classmethod
+    def from_trie(cls, items: list[Any], trie: list[list]) -> "CPEMatcher":
+        """Create a matcher from its items and the data returned by trie"""
+        matcher = cls()
+        matcher._items = items
+        nodes = [_TrieNode() for _ in trie]
+        for node, (entries, children) in zip(nodes, trie):
+            node.entries = [(index, remainder) for index, remainder in entries]
+            node.children = {char: nodes[child] for char, child in children.items()}
+        matcher._root = nodes[0]
+        return matcher
+
+    def match(self, cpe: str) -> list[Any]:
+        matched: set[int] = set()
+        node: Optional[_TrieNode] = self._root
+        pos = 0
+        while node is not None:
+            for index, remainder in node.entries:
+                if not remainder or _compile(remainder).match(cpe, pos):
+                    matched.add(index)
+            if pos == len(cpe):
+                break
+            node = node.children.get(cpe[pos])
+            pos += 1
+        return [self._items[index] for index in sorted(matched)]
 
 
 class ProductStream(ProductBase, NodeMixin):
@@ -77,10 +181,13 @@ class ProductStream(ProductBase, NodeMixin):
 class ProdDefs:
     ETAG_FILE = os.path.join(CONFIG_DIR, "etag.txt")
     PRODUCT_FILE = os.path.join(CONFIG_DIR, "products.json")
+    INDEX_FILE = os.path.join(CONFIG_DIR, "products-{}.index")
+    # Increment when the attributes stored in the index change, to discard old index files
+    INDEX_VERSION = 2
 
     @classmethod
     def get_etag(cls, url: str):
-        response = httpx.head(url)
+        response = get_client().head(url)
         return response.headers.get("etag")
 
     # Assisted by watsonx Code Assistant
@@ -100,12 +207,12 @@ class ProdDefs:
     # Assisted by watsonx Code Assistant
     @classmethod
     def load_product_definitions(cls, url: str, file_path: str):
-        response = httpx.get(url)
+        response = get_client().get(url)
         with open(file_path, "w") as f:
             f.write(response.text)
 
     @classmethod
-    def get_product_definitions_service(cls) -> dict:
+    def get_product_definitions_service(cls, url_etag: Optional[str] = None) -> dict:
         proddefs_url = None
         if "PRODDEFS_URL" not in os.environ:
             console.print(
@@ -116,8 +223,10 @@ class ProdDefs:
         else:
             proddefs_url = os.getenv("PRODDEFS_URL")
 
+        ensure_config_dir()
         etag = cls.load_etag(cls.ETAG_FILE)
-        url_etag = cls.get_etag(proddefs_url)
+        if url_etag is None:
+            url_etag = cls.get_etag(proddefs_url)
 
         if etag == url_etag:
             with open(cls.PRODUCT_FILE, "r") as f:
@@ -130,15 +239,31 @@ class ProdDefs:
         return product_definitions
 
     def __init__(self, active_only: bool = True):
-        self.stream_nodes_by_cpe = defaultdict(list)
-        product_streams_by_name = defaultdict(list)
-        self.product_trees: list[NodeMixin] = []
+        self._reset_index()
 
-        data = self.get_product_definitions_service()
+        url_etag = None
+        if proddefs_url := os.getenv("PRODDEFS_URL"):
+            url_etag = self.get_etag(proddefs_url)
+            if url_etag and self._load_index(url_etag, active_only):
+                return
+
+        data = self.get_product_definitions_service(url_etag)
 
         if not data:
             return
 
+        self._build(data, active_only)
+        if url_etag:
+            self._save_index(url_etag, active_only)
+
+    def _reset_index(self) -> None:
+        self.stream_nodes_by_cpe: dict[str, list[ProductStream]] = defaultdict(list)
+        self.product_trees: list[NodeMixin] = []
+        self.module_matcher = CPEMatcher()
+
+    def _build(self, data: dict, active_only: bool) -> None:
+        product_streams_by_name = defaultdict(list)
+
         for ps_update_stream, stream_data in data["ps_update_streams"].items():
             cpes = stream_data.get("cpe", [])
             stream_node = ProductStream(ps_update_stream, cpes)
@@ -170,6 +295,120 @@ class ProdDefs:
                     module_node.parent = stream_node
                     self.product_trees.append(stream_node)
 
+        for module in self._iter_modules():
+            self.module_matcher.add(module, module.cpe_patterns)
+
+    @classmethod
+    def _index_file(cls, active_only: bool) -> str:
+        return cls.INDEX_FILE.format("active" if active_only else "all")
+
+    def _load_index(self, etag: str, active_only: bool) -> bool:
+        """Load the product trees and matchers built from the product definitions with etag,
+        returns False if there is no such index"""
+        index_file = self._index_file(active_only)
+        try:
+            with open(index_file, "r") as f:
+                # The header is a separate line so a stale index isn't loaded completely
+                header = json.loads(f.readline())
+                if header != {"version": self.INDEX_VERSION, "etag": etag}:
+                    logger.debug(
+                        f"Ignoring stale product definitions index {index_file}"
+                    )
+                    return False
+                self._from_index(json.loads(f.readline()))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.debug(
+                f"Ignoring unreadable product definitions index {index_file}: {e}"
+            )
+            self._reset_index()
+            return False
+        return True
+
+    def _save_index(self, etag: str, active_only: bool) -> None:
+        index_file = self._index_file(active_only)
+        ensure_config_dir()
+        header = {"version": self.INDEX_VERSION, "etag": etag}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_file), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(header) + "\n")
+                f.write(json.dumps(self._to_index()) + "\n")
+            os.replace(tmp_path, index_file)
+        except OSError as e:
+            logger.debug(f"Failed to write product definitions index {index_file}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _to_index(self) -> dict:
+        """The product trees and stream map as plain JSON data. Streams and modules are listed
+        once and referred to by position, as a stream can be in several trees and maps."""
+        streams: dict[int, int] = {}
+        stream_data: list[list] = []
+        module_data: list[list] = []
+
+        def stream_index(stream: ProductStream) -> int:
+            if id(stream) not in streams:
+                streams[id(stream)] = len(stream_data)
+                stream_data.append([stream.name, stream.cpes, stream.active])
+            return streams[id(stream)]
+
+        for streams_of_cpe in self.stream_nodes_by_cpe.values():
+            for stream in streams_of_cpe:
+                stream_index(stream)
+        product_trees = [stream_index(stream) for stream in self.product_trees]
+        modules: dict[int, int] = {}
+        for stream in self.product_trees:
+            for module in stream.children:
+                if id(module) not in modules:
+                    modules[id(module)] = len(module_data)
+                    module_data.append(
+                        [module.name, module.cpe_patterns, streams[id(stream)]]
+                    )
+        return {
+            "streams": stream_data,
+            "modules": module_data,
+            "product_trees": product_trees,
+            "stream_nodes_by_cpe": {
+                cpe: [streams[id(stream)] for stream in streams_of_cpe]
+                for cpe, streams_of_cpe in self.stream_nodes_by_cpe.items()
+            },
+            "matched_modules": [
+                modules[id(module)] for module in self.module_matcher.items
+            ],
+            "module_trie": self.module_matcher.trie(),
+        }
+
+    def _from_index(self, index: dict) -> None:
+        """Rebuild the product trees, stream map and module matcher from _to_index data"""
+        streams = [
+            ProductStream(name, cpes, active) for name, cpes, active in index["streams"]
+        ]
+        modules = []
+        for name, cpe_patterns, stream in index["modules"]:
+            # The patterns are stored as regexes already, don't convert them again
+            module = ProductModule(name, [])
+            module.cpe_patterns = cpe_patterns
+            module.parent = streams[stream]
+            modules.append(module)
+        self.product_trees = [streams[stream] for stream in index["product_trees"]]
+        for cpe, streams_of_cpe in index["stream_nodes_by_cpe"].items():
+            self.stream_nodes_by_cpe[cpe] = [
+                streams[stream] for stream in streams_of_cpe
+            ]
+        self.module_matcher = CPEMatcher.from_trie(
+            [modules[module] for module in index["matched_modules"]],
+            index["module_trie"],
+        )
+
+    def _iter_modules(self):
+        for module_tree in self.product_trees:
+            for modules in LevelOrderGroupIter(module_tree, maxlevel=2):
+                for module in modules:
+                    if isinstance(module, ProductModule):
+                        yield module
+
     @staticmethod
     def _check_stream_name(seen_stream_names, stream):
         if stream in seen_stream_names:
@@ -179,15 +418,7 @@ class ProdDefs:
         seen_stream_names.add(stream)
 
     def match_module_pattern(self, cpe: str) -> list[ProductModule]:
-        module_matches = []
-        for module_tree in self.product_trees:
-            for modules in LevelOrderGroupIter(module_tree, maxlevel=2):
-                for module in modules:
-                    if not isinstance(module, ProductModule):
-                        continue
-                    if module.match(cpe):
-                        module_matches.append(module)
-        return module_matches
+        return self.module_matcher.match(cpe)
 
     @staticmethod
     def _clean_cpe(cpe: str) -> str:
@@ -207,52 +438,74 @@ class ProdDefs:
         for tree in ancestor_trees:
             for leaf in tree.leaves:
                 cleaned_leaf_name = self._clean_cpe(leaf.name)
-                leaf_with_products = self._check_streams(leaf, cleaned_leaf_name)
-                if not leaf_with_products:
-                    leaf_with_products = self._check_modules(leaf, cleaned_leaf_name)
-                if not leaf_with_products:
+                product_nodes = self._match_products(cleaned_leaf_name)
+                if not product_nodes:
                     console.print(
                         f"Warning, didn't find any products matching {cleaned_leaf_name}",
                         style="warning",
                     )
-                ancestors_with_products.extend(leaf_with_products)
+                ancestors_with_products.extend(
+                    self._duplicate_leaves_and_set_parents(leaf, product_nodes)
+                )
         return ancestors_with_products
 
-    def _check_streams(self, leaf: Node, cpe: str) -> list[Node]:
-        """Check if cpe matches exactly to any ProductStreams, if it does add the CPE as a parent
-        of the stream. If more than one stream matches, create copies of the stream and leaf"""
-        if cpe not in self.stream_nodes_by_cpe:
-            return []
-        stream_nodes = self.stream_nodes_by_cpe[cpe]
-        # Create a copy so that pop in the _duplicate_leaves_and_set_parent function doesn't modify
-        # the original stream_nodes_by_cpe map which should be preserved incase we encounter the
-        # same CPE twice
-        copy_of_stream_nodes = copy.deepcopy(stream_nodes)
-        return self._duplicate_leaves_and_set_parents(leaf, copy_of_stream_nodes)
-
-    def _check_modules(self, leaf: Node, cpe: str) -> list[Node]:
-        """Check if the cpe matches any ProductModule"""
-        module_nodes = self.match_module_pattern(cpe)
-        return self._duplicate_leaves_and_set_parents(leaf, module_nodes)
-
-    def _duplicate_leaves_and_set_parents(self, leaf, product_nodes) -> list[Node]:
-        """Assign each product as a ancestor of the leaf. Copy the leaf when assigning it another
-        parent because one leaf can exist in mutliple products"""
+    def _match_products(self, cpe: str) -> list[NodeMixin]:
+        """Get the ProductStreams which match the cpe exactly, or else any matching
+        ProductModules"""
+        stream_nodes = self.stream_nodes_by_cpe.get(cpe)
+        if stream_nodes:
+            return stream_nodes
+        return self.match_module_pattern(cpe)
+
+    @staticmethod
+    def _duplicate_leaves_and_set_parents(leaf, product_nodes) -> list[Node]:
+        """Assign each product as a ancestor of the leaf. Copy the tree of the leaf when assigning
+        it another product because one leaf can exist in mutliple products. Products are attached
+        by copying their stream, which is only a few nodes, so the product definitions are never
+        modified and can be shared by many results."""
         leaf_with_products: list[Node] = []
-        while product_nodes:
-            last_product = product_nodes.pop()
-            copy_of_leaf = copy.deepcopy(leaf)
-            copy_of_product = copy.deepcopy(last_product)
-            self._add_ancestor(copy_of_leaf, copy_of_product)
-            leaf_with_products.append(copy_of_leaf)
-            # For the last item in the product_nodes list no need to copy:
-            if len(product_nodes) == 1:
-                self._add_ancestor(leaf, product_nodes.pop())
-                leaf_with_products.append(leaf)
+        for i, product in enumerate(reversed(product_nodes)):
+            # For the last product of several, no need to copy
+            if i < len(product_nodes) - 1 or len(product_nodes) == 1:
+                leaf_with_product = _copy_tree(leaf.root, leaf)
+            else:
+                leaf_with_product = leaf
+            _copy_tree(product.root).parent = leaf_with_product
+            leaf_with_products.append(leaf_with_product)
         return leaf_with_products
 
-    def _add_ancestor(self, leaf, product):
-        if product.parent:
-            product.parent.parent = leaf
-        else:
-            product.parent = leaf
+
+def _copy_node(node: NodeMixin) -> NodeMixin:
+    """Copy a node's attributes, without its parent or children"""
+    node_copy = object.__new__(type(node))
+    node_copy.__dict__.update(
+        (key, value)
+        for key, value in node.__dict__.items()
+        if not key.startswith("_NodeMixin__")
+    )
+    return node_copy
+
+
+def _copy_tree(root: NodeMixin, node: Optional[NodeMixin] = None) -> NodeMixin:
+    """Copy the tree below root. Unlike copy.deepcopy this doesn't follow the parent of root,
+    or copy attribute values. Returns the copy of node if one is given, otherwise the copy of
+    root."""
+    root_copy = _copy_node(root)
+    found = root_copy if node is root else None
+    stack = [(root, root_copy)]
+    while stack:
+        original, original_copy = stack.pop()
+        children_copy = []
+        for child in original.children:
+            child_copy = _copy_node(child)
+            # The copy is known to be a valid tree, so set the anytree links directly rather
+            # than through the parent setter which checks for loops on every attach
+            child_copy._NodeMixin__parent = original_copy
+            children_copy.append(child_copy)
+            if child is node:
+                found = child_copy
+            stack.append((child, child_copy))
+        original_copy._NodeMixin__children = children_copy
+    if node is not None:
+        return found
+    return root_copy
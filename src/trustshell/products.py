@@ -1,31 +1,46 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 import click
-import httpx
+import hashlib
+import json
 import logging
 import sys
 
-from anytree import Node, RenderTree, PreOrderIter
-from anytree.walker import Walker, WalkError
-from packageurl import PackageURL
+from anytree import Node, RenderTree
 from rich.console import Console
 from rich.theme import Theme
-from typing import Any, Optional
-from univers.versions import RpmVersion
+from typing import TYPE_CHECKING, Any, Iterator, Optional, TextIO
+import trustshell
 from trustshell import (
-    AUTH_ENABLED,
-    TRUSTIFY_URL,
-    check_or_get_access_token,
     config_logging,
     get_tag_from_purl,
+    normalize_purl,
+    parse_purl,
     print_version,
+    purl_sans_version,
     urlencoded,
 )
-from trustshell.osidb import OSIDB
-from trustshell.product_definitions import ProdDefs, ProductModule
-
-LATEST_ENDPOINT = f"{TRUSTIFY_URL}analysis/latest/component"
-ANALYSIS_ENDPOINT = f"{TRUSTIFY_URL}analysis/component"
+from trustshell.json_stream import Token, iter_json_tokens, read_value, skip_value
+from trustshell.trace import TRACE_ENV, span, tracing
+from trustshell.tree import TreeNode, to_anytree
+
+# The Trustify client (httpx), product definitions, OSIDB (osidb_bindings) and version
+# (univers) modules are imported where they're needed, so --help and trust-prime start quickly
+if TYPE_CHECKING:
+    from trustshell.cache import ResponseCache
+    from trustshell.client import TrustifyClient
+
+LATEST_ENDPOINT = "analysis/latest/component"
+ANALYSIS_ENDPOINT = "analysis/component"
 ANCESTOR_COUNT = 10000
+# Number of concurrent Trustify queries in batch mode
+DEFAULT_BATCH_WORKERS = 4
+OUTPUT_FORMATS = ["rich", "plain", "json"]
+# Branches drawn by plain output, the same as anytree's ContStyle used by rich output
+TREE_BRANCH = "├── "
+TREE_LAST_BRANCH = "└── "
+TREE_VERTICAL = "│   "
+TREE_SPACE = "    "
 
 custom_theme = Theme({"warning": "magenta", "error": "bold red"})
 console = Console(color_system="auto", theme=custom_theme)
@@ -42,13 +57,10 @@ def prime_cache(check: bool, debug: bool):
     else:
         config_logging(level="DEBUG")
 
-    auth_header = {}
-    if AUTH_ENABLED:
-        access_token = check_or_get_access_token()
-        auth_header = {"Authorization": f"Bearer {access_token}"}
-    status_response = httpx.get(
-        f"{TRUSTIFY_URL}analysis/status", headers=auth_header, timeout=300
-    )
+    from trustshell.client import get_client
+
+    client = get_client()
+    status_response = client.get("analysis/status")
     status_response.raise_for_status()
     status = status_response.json()
     graph_count = status["graph_count"]
@@ -58,7 +70,7 @@ def prime_cache(check: bool, debug: bool):
     console.print(f"sbom_count: {sbom_count}")
     if not check:
         console.print("Priming graph cache...")
-        httpx.get(f"{TRUSTIFY_URL}analysis/component", headers=auth_header, timeout=300)
+        client.get("analysis/component")
 
 
 @click.command(context_settings={"help_option_names": ["-h", "--help"]})
@@ -79,43 +91,253 @@ def prime_cache(check: bool, debug: bool):
     help="Replace flaw affects. Requires --flaw to be set.",
     callback=lambda ctx, param, value: _check_flaw(ctx, param, value, "replace"),
 )
+@click.option(
+    "--no-cache", is_flag=True, help="Don't read or write the local response cache."
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached responses and update the cache with fresh ones.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Parse the Trustify response as it arrives, pruning branches without CPEs as "
+    "they're read, to reduce peak memory use.",
+)
+@click.option(
+    "--batch",
+    "-b",
+    type=click.File("r"),
+    help="Read purls, one per line, from a file or '-' for stdin. "
+    "A JSON Lines record is written for each purl.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BATCH_WORKERS,
+    show_default=True,
+    help="Number of concurrent Trustify queries in batch mode.",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="rich",
+    show_default=True,
+    help="How to print the product trees. plain is much faster for large trees, json "
+    "includes the affects. Batch mode always writes JSON Lines.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    envvar=TRACE_ENV,
+    help="Time each phase of the run, write the timings to a Chrome trace event file and "
+    f"print a summary. Can also be set with {TRACE_ENV}.",
+)
 @click.option("--debug", "-d", is_flag=True, help="Debug log level.")
 @click.argument(
     "purl",
     type=click.STRING,
+    required=False,
 )
-def search(purl: str, flaw: str, replace: bool, debug: bool, latest: bool):
+def search(
+    purl: Optional[str],
+    flaw: str,
+    replace: bool,
+    no_cache: bool,
+    refresh: bool,
+    stream: bool,
+    batch: Optional[TextIO],
+    workers: int,
+    output: str,
+    profile: Optional[str],
+    debug: bool,
+    latest: bool,
+):
     """Relate a purl to products in Trustify"""
+    if batch:
+        if purl or flaw:
+            raise click.UsageError("PURL and --flaw can't be used with --batch")
+    elif not purl:
+        raise click.UsageError("Missing argument 'PURL'.")
+
     if not debug:
         config_logging(level="INFO")
     else:
         config_logging(level="DEBUG")
 
+    # Keep stdout for the JSON document
+    quiet = _console_to_stderr() if output == "json" else nullcontext()
+    with tracing(profile, Console(stderr=True)):
+        with span("trust-products", purl=purl or ""), quiet:
+            _search(
+                purl,
+                flaw,
+                replace,
+                no_cache,
+                refresh,
+                stream,
+                batch,
+                workers,
+                latest,
+                output,
+            )
+
+
+def _search(
+    purl: Optional[str],
+    flaw: str,
+    replace: bool,
+    no_cache: bool,
+    refresh: bool,
+    stream: bool,
+    batch: Optional[TextIO],
+    workers: int,
+    latest: bool,
+    output: str = "rich",
+):
+    from trustshell.cache import ResponseCache
+    from trustshell.product_definitions import ProdDefs
+
+    cache = None
+    if not no_cache:
+        cache = ResponseCache()
+
+    if batch:
+        with _console_to_stderr():
+            _search_batch(
+                batch,
+                sys.stdout,
+                workers,
+                latest=latest,
+                cache=cache,
+                refresh=refresh,
+                stream=stream,
+            )
+        return
+
     try:
-        PackageURL.from_string(purl)
+        parse_purl(purl)
     except ValueError:
         console.print(f"{purl} is not a valid Package URL", style="error")
         sys.exit(1)
 
-    ancestor_trees = _get_roots(purl, latest)
+    ancestor_trees = _get_roots(
+        purl, latest, cache=cache, refresh=refresh, stream=stream
+    )
     if not ancestor_trees or len(ancestor_trees) == 0:
-        console.print("No results")
+        if output == "json":
+            _write_json_result(sys.stdout, purl, [], set())
+        else:
+            console.print("No results")
         return
 
-    prod_defs = ProdDefs()
-    ancestor_trees = prod_defs.extend_with_product_mappings(ancestor_trees)
-
-    for tree in ancestor_trees:
-        _render_tree(tree.root)
+    with span("load product definitions"):
+        prod_defs = ProdDefs()
+    with span("map products"):
+        ancestor_trees = prod_defs.extend_with_product_mappings(ancestor_trees)
+
+    affects = None
+    if output == "json":
+        with span("extract affects"):
+            affects = extract_affects(ancestor_trees)
+    with span("render", output=output):
+        if output == "json":
+            _write_json_result(sys.stdout, purl, ancestor_trees, affects)
+        elif output == "plain":
+            sys.stdout.write(
+                "".join(_render_tree_text(tree.root) for tree in ancestor_trees)
+            )
+            sys.stdout.flush()
+        else:
+            for tree in ancestor_trees:
+                _render_tree(tree.root)
 
     if not flaw:
         exit(0)
 
+    from trustshell.osidb import OSIDB
+
     osidb = OSIDB()
-    affects = extract_affects(ancestor_trees)
+    if affects is None:
+        with span("extract affects"):
+            affects = extract_affects(ancestor_trees)
     osidb.edit_flaw_affects(flaw, affects, replace)
 
 
+@contextmanager
+def _console_to_stderr():
+    """Send console messages to stderr, to keep stdout for machine readable output"""
+    consoles = (console, trustshell.console)
+    for c in consoles:
+        c.stderr = True
+    try:
+        yield
+    finally:
+        for c in consoles:
+            c.stderr = False
+
+
+def _read_batch_purls(lines: TextIO) -> list[str]:
+    """Read unique purls from lines, ignoring blank lines and comments"""
+    purls: dict[str, None] = {}
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            purls[line] = None
+    return list(purls)
+
+
+def _search_batch(lines: TextIO, output: TextIO, workers: int, **roots_kwargs) -> None:
+    """
+    Look up the ancestors of each purl in lines concurrently, then map them to products in
+    the order they were given, writing one JSON record per purl to output. A failure to look up
+    one purl is reported in its record and doesn't affect the others.
+    """
+    from trustshell.client import get_client
+    from trustshell.product_definitions import ProdDefs
+
+    purls = _read_batch_purls(lines)
+    if not purls:
+        return
+    with span("load product definitions"):
+        prod_defs = ProdDefs()
+    client = get_client()
+    if roots_kwargs.get("cache"):
+        # Look up the cache generation once, rather than in each worker
+        roots_kwargs["cache"].generation(client)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for purl in purls:
+            try:
+                parse_purl(purl)
+            except ValueError:
+                continue
+            futures[purl] = executor.submit(_get_roots, purl, **roots_kwargs)
+        for purl in purls:
+            record: dict[str, Any] = {"purl": purl}
+            try:
+                if purl not in futures:
+                    raise ValueError(f"{purl} is not a valid Package URL")
+                with span("wait for query", purl=purl):
+                    ancestor_trees = futures.pop(purl).result()
+                with span("map products"):
+                    ancestor_trees = prod_defs.extend_with_product_mappings(
+                        ancestor_trees
+                    )
+                record["trees"] = [_tree_to_dict(tree.root) for tree in ancestor_trees]
+                with span("extract affects"):
+                    record["affects"] = sorted(extract_affects(ancestor_trees))
+            except (Exception, SystemExit) as e:
+                # _build_node_purl exits on unexpected data, that shouldn't end the batch
+                record["error"] = str(e) or type(e).__name__
+                console.print(f"Failed to process {purl}: {e}", style="error")
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+
+
 def _check_flaw(ctx, param, value, dependent_option_name):
     """
     Callback function to check if --flaw is set.
@@ -130,6 +352,8 @@ def _check_flaw(ctx, param, value, dependent_option_name):
 def extract_affects(ancestor_trees: list[Node]) -> set[tuple[str, str]]:
     """Collect all the leaf and root node tuples. The root node is the direct parent of the CPE.
     The leaf node type should be ProductModule"""
+    from trustshell.product_definitions import ProductModule
+
     affects = set()
     for tree in ancestor_trees:
         ps_module_nodes = []
@@ -142,27 +366,25 @@ def extract_affects(ancestor_trees: list[Node]) -> set[tuple[str, str]]:
             for ancestor in ps_module_node.ancestors:
                 if ancestor.name.startswith("cpe:/"):
                     if ancestor.parent:
-                        purl = PackageURL.from_string(ancestor.parent.name)
-                        if purl.type == "oci" and "tag" in purl.qualifiers:
-                            purl.qualifiers.pop("tag")
-                        elif purl.type == "maven":
+                        purl = ancestor.parent.name
+                        purl_type = parse_purl(purl).type
+                        if purl_type == "oci":
+                            purl = purl_sans_version(purl, remove_tag=True)
+                        elif purl_type == "maven":
                             # If it's a maven type, we set the purl to root
-                            purl = PackageURL.from_string(ps_module_node.root.name)
-                        purl_sans_version = _purl_sans_version(purl)
-                        affects.add(
-                            (
-                                ps_module_node.name,
-                                purl_sans_version.to_string(),
-                            )
-                        )
+                            purl = purl_sans_version(ps_module_node.root.name)
+                        else:
+                            purl = purl_sans_version(purl)
+                        affects.add((ps_module_node.name, purl))
     return affects
 
 
-def _purl_sans_version(purl: PackageURL):
-    purl_data = purl.to_dict()
-    purl_data["version"] = ""
-    purl_sans_version = PackageURL(**purl_data)
-    return purl_sans_version
+def _tree_to_dict(node: Node) -> dict[str, Any]:
+    """Convert a tree to nested dicts of node names and children"""
+    return {
+        "name": node.name,
+        "children": [_tree_to_dict(child) for child in node.children],
+    }
 
 
 def _render_tree(root: Node):
@@ -171,26 +393,189 @@ def _render_tree(root: Node):
         console.print("%s%s" % (pre, node.name))
 
 
-def _get_roots(base_purl: str, latest: bool = True) -> list[Node]:
-    """Look up base_purl ancestors in Trustify"""
-
-    auth_header = {}
-    if AUTH_ENABLED:
-        access_token = check_or_get_access_token()
-        auth_header = {"Authorization": f"Bearer {access_token}"}
-
+def _render_tree_text(root: Node) -> str:
+    """Render a tree using name only, in the same layout as _render_tree, as plain text which
+    can be written all at once"""
+    lines = []
+    # Each node with the branch drawn before its name, and the prefix for its children
+    stack = [(root, "", "")]
+    while stack:
+        node, branch, indent = stack.pop()
+        lines.append(f"{branch}{node.name}\n")
+        children = node.children
+        for i in range(len(children) - 1, -1, -1):
+            if i == len(children) - 1:
+                stack.append(
+                    (children[i], indent + TREE_LAST_BRANCH, indent + TREE_SPACE)
+                )
+            else:
+                stack.append(
+                    (children[i], indent + TREE_BRANCH, indent + TREE_VERTICAL)
+                )
+    return "".join(lines)
+
+
+def _write_json_result(
+    output: TextIO,
+    purl: str,
+    ancestor_trees: list[Node],
+    affects: set[tuple[str, str]],
+) -> None:
+    """Write the product trees and affects of purl as a JSON document, the same as a batch
+    record"""
+    record = {
+        "purl": purl,
+        "trees": [_tree_to_dict(tree.root) for tree in ancestor_trees],
+        "affects": sorted(affects),
+    }
+    output.write(json.dumps(record) + "\n")
+    output.flush()
+
+
+def _get_roots(
+    base_purl: str,
+    latest: bool = True,
+    cache: Optional["ResponseCache"] = None,
+    refresh: bool = False,
+    stream: bool = False,
+) -> list[Node]:
+    """Look up base_purl ancestors in Trustify, using the response cache if one is given.
+    With stream the response is parsed incrementally instead of being decoded all at once."""
     if latest:
         request_url = f"{LATEST_ENDPOINT}?ancestors={ANCESTOR_COUNT}&q={urlencoded(f'purl~{base_purl}@')}"
     else:
         request_url = f"{ANALYSIS_ENDPOINT}?ancestors={ANCESTOR_COUNT}&q={urlencoded(f'purl~{base_purl}@')}"
-    ancestors_response = httpx.get(request_url, headers=auth_header, timeout=300)
-    ancestors_response.raise_for_status()
-    ancestors = ancestors_response.json()
+    from trustshell.client import get_client
+
+    client = get_client()
+    request_url = client.url(request_url)
+    if stream:
+        if cache:
+            chunks = cache.stream(client, request_url, refresh=refresh)
+        else:
+            chunks = _iter_response_bytes(client, request_url)
+        base_node = TreeNode("root")
+        with span("fetch and build ancestor tree from stream"):
+            total = build_ancestor_tree_from_stream(base_node, chunks)
+        logger.debug(f"Number of matches for {base_purl}: {total}")
+        return _trees_from_ancestor_tree(base_node)
+    if cache:
+        with span("fetch ancestors"):
+            body = cache.fetch(client, request_url, refresh=refresh)
+    else:
+        ancestors_response = client.get(request_url)
+        ancestors_response.raise_for_status()
+        body = ancestors_response.content
+    with span("decode json", bytes=len(body)):
+        ancestors = json.loads(body)
     logger.debug(f"Number of matches for {base_purl}: {ancestors['total']}")
     return _trees_with_cpes(ancestors)
 
 
-def build_ancestor_tree(parent: Node, ancestors):
+def _iter_response_bytes(client: "TrustifyClient", url: str) -> Iterator[bytes]:
+    with client.stream("GET", url) as response:
+        response.raise_for_status()
+        yield from response.iter_bytes()
+
+
+def build_ancestor_tree_from_stream(parent: TreeNode, chunks: Iterator[bytes]) -> int:
+    """
+    Build a tree which prunes to the same trees as the one from build_ancestor_tree, directly
+    from the chunks of an analysis response body, without decoding the whole response. Branches
+    which can't lead to a CPE are pruned as they're read. Returns the 'total' from the response.
+    """
+    tokens = iter_json_tokens(chunks)
+    if next(tokens)[0] != "{":
+        raise ValueError("Expected a JSON object in the analysis response")
+    total = 0
+    for key_kind, key in tokens:
+        if key_kind == "}":
+            break
+        first = next(tokens)
+        if key == "items" and first[0] == "[":
+            # The components themselves are kept, so they're logged if they have no CPEs
+            for node, _, _, _ in _stream_components(tokens, prune=False):
+                node.parent = parent
+        elif key == "total":
+            total = read_value(first, tokens)
+        else:
+            skip_value(first, tokens)
+    return total
+
+
+# A streamed node with the name it was built with, a digest of its branch, and whether there's
+# a CPE or container in the branch
+StreamedBranch = tuple[TreeNode, str, bytes, bool]
+
+
+def _stream_components(
+    tokens: Iterator[Token], prune: bool = True
+) -> list[StreamedBranch]:
+    """Build nodes for the components in a list, the opening '[' must already be consumed"""
+    branches: list[StreamedBranch] = []
+    for kind, _ in tokens:
+        if kind == "]":
+            break
+        if kind == "{":
+            branches.extend(_stream_component(tokens, prune))
+        else:
+            skip_value((kind, _), tokens)
+    return branches
+
+
+def _stream_component(tokens: Iterator[Token], prune: bool) -> list[StreamedBranch]:
+    """
+    Build the nodes for a single component, the opening '{' must already be consumed. Other
+    fields of the component are skipped without being decoded, as are the ancestors of
+    components which don't have a purl.
+
+    With prune, a component whose ancestors have no CPEs or containers is replaced by a leaf
+    named after its digest, rather than keeping its ancestors until the whole tree is pruned.
+    Those ancestors would be removed with _prune_ancestor_tree anyway, and the digest gives
+    _remove_duplicate_branches the same duplicates to remove as the ancestors would have.
+    """
+    purls: Optional[list[str]] = None
+    cpes: list[str] = []
+    children: list[StreamedBranch] = []
+    base_purl: Optional[str] = None
+    for key_kind, key in tokens:
+        if key_kind == "}":
+            break
+        first = next(tokens)
+        if key == "purl":
+            purls = read_value(first, tokens) or []
+            base_purl = _build_node_purl(purls)
+        elif key == "cpe":
+            cpes = read_value(first, tokens) or []
+        elif key == "ancestors" and first[0] == "[":
+            if purls is not None and not base_purl:
+                # This component will be represented by its CPEs, which have no ancestors
+                skip_value(first, tokens)
+            else:
+                children = _stream_components(tokens)
+        else:
+            skip_value(first, tokens)
+    if not base_purl:
+        return [(TreeNode(cpe), cpe, _branch_digest(cpe, []), True) for cpe in cpes]
+    digest = _branch_digest(base_purl, children)
+    keep = base_purl.startswith("pkg:oci/") or any(child[3] for child in children)
+    if prune and children and not keep:
+        # The NUL can't be in a purl, so the leaf can't have the name of another node
+        return [(TreeNode(f"{base_purl}\0{digest.hex()}"), base_purl, digest, False)]
+    node = TreeNode(base_purl, children=[child[0] for child in children])
+    return [(node, base_purl, digest, keep)]
+
+
+def _branch_digest(name: str, children: list[StreamedBranch]) -> bytes:
+    """A digest of a branch which matches the digest of another branch if, and only if,
+    _remove_duplicate_branches would treat them as duplicates"""
+    digest = hashlib.blake2b(name.encode("utf-8") + b"\0", digest_size=16)
+    for child in sorted(children, key=lambda child: child[1]):
+        digest.update(child[2])
+    return digest.digest()
+
+
+def build_ancestor_tree(parent: TreeNode, ancestors):
     """
     Recursive function to build an ancestor tree from a nested set of purls, or CPEs.
     """
@@ -202,9 +587,9 @@ def build_ancestor_tree(parent: Node, ancestors):
                 # Try the next ancestor
                 continue
             for cpe in cpes:
-                Node(cpe, parent=parent)
+                TreeNode(cpe, parent=parent)
         else:
-            node = Node(base_purl.to_string(), parent=parent)
+            node = TreeNode(base_purl, parent=parent)
             if "ancestors" in component:
                 build_ancestor_tree(node, component["ancestors"])
             # else try the next ancestor
@@ -231,110 +616,55 @@ def _remove_root_return_children(root):
     return children
 
 
-def _get_branch_signature(node):
-    """
-    Create a unique signature for a branch structure starting from the given node.
-    The signature represents the structure and node names in the branch.
-
-    Args:
-        node (Node): Root node of the branch to signature
-
-    Returns:
-        str: A string signature representing the branch structure
-    """
-    # Use a list to collect branch elements in pre-order traversal
-    elements = []
-
-    def traverse(current_node, path=""):
-        # Add node name and its level in the path
-        node_sig = f"{path}{current_node.name}"
-        elements.append(node_sig)
-
-        # Process children in a consistent order (sort by name)
-        for i, child in enumerate(sorted(current_node.children, key=lambda x: x.name)):
-            # Use numbers to indicate branching structure
-            traverse(child, f"{path}{i}.")
-
-    traverse(node)
-    return "|".join(elements)
-
+def _sweep_branches(root, keep: set) -> None:
+    """Detach the branches of a tree whose top node isn't in keep, root must be in keep"""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        children = node.children
+        kept = [child for child in children if child in keep]
+        if len(kept) != len(children):
+            node.children = kept
+        stack.extend(kept)
 
-def _has_cpe_node(node):
-    """
-    Check if the node or any of its descendants have a name starting with "cpe:/".
-
-    Args:
-        node (Node): The node to check
 
-    Returns:
-        bool: True if the node or any descendant has a name starting with "cpe:/", False otherwise
+def _remove_duplicate_branches(root: TreeNode):
     """
-    # Check if the current node's name starts with "cpe:/"
-    if node.name.startswith("cpe:/"):
-        return True
-
-    # Check if any descendant node's name starts with "cpe:/"
-    for descendant in PreOrderIter(node):
-        if descendant.name.startswith("cpe:/"):
-            return True
-
-    return False
-
-
-def _remove_non_cpe_branches(root):
-    # Inspect all the leaves for ones not starting with cpe:/
-    leaves_to_remove = set()
-    leaves_to_keep = set()
-    for leaf in root.leaves:
-        if leaf.name.startswith("cpe:/"):
-            leaves_to_keep.add(leaf)
-        else:
-            leaves_to_remove.add(leaf)
-    while leaves_to_remove:
-        to_remove = leaves_to_remove.pop()
-        if leaves_to_keep:
-            to_keep = next(iter(leaves_to_keep))
-            # remove all leaves and branches up to common ancestores
-            w = Walker()
-            try:
-                up, common, _ = w.walk(to_remove, to_keep)
-                for node in up:
-                    if node != common:
-                        node.parent = None
-            except WalkError:
-                continue
-    return root
+    Removes duplicate branch structures from a tree of ancestors
 
-
-def _remove_duplicate_branches(root):
-    """
-    Removes duplicate branch structures from an Anytree tree
+    Each branch is given an id in a single post-order pass. Branches with the same name and the
+    same child branch ids, in order of child name, get the same id, so comparing two branches
+    doesn't require walking them again.
 
     Args:
-        root (Node): The root node of the tree
+        root (TreeNode): The root node of the tree
 
     Returns:
-        Node: The root node of the modified tree with duplicate branches removed
+        TreeNode: The root node of the modified tree with duplicate branches removed
     """
-
-    # Dictionary to store branches by their signatures
-    branches_by_signature = defaultdict(list)
-
-    # Collect branch signatures (skip the root node)
-    for node in list(PreOrderIter(root))[1:]:
+    pre_order = root.pre_order()
+    branch_ids: dict[tuple[str, tuple[int, ...]], int] = {}
+    node_branch_ids: dict[TreeNode, int] = {}
+    # Children come after their parent in pre-order, so reversed it visits children first
+    for node in reversed(pre_order):
+        # Branches pruned while streaming are sorted by the name of the node they replace
+        children = sorted(node.children, key=lambda x: x.name.partition("\0")[0])
+        key = (node.name, tuple(node_branch_ids[child] for child in children))
+        node_branch_ids[node] = branch_ids.setdefault(key, len(branch_ids))
+
+    # Keep the first occurrence of each branch (skip the root node). A node's children are
+    # only removed after it's visited, so the tree is compared as it was before any removals
+    seen_branch_ids: set[int] = set()
+    for node in pre_order[1:]:
         # Only process nodes that have children (branches, not leaves)
-        if node.children:
-            signature = _get_branch_signature(node)
-            branches_by_signature[signature].append(node)
-
-    # Remove duplicate branches
-    for signature, nodes in branches_by_signature.items():
-        if len(nodes) > 1:
-            # Keep the first occurrence of the branch
-            for node in nodes[1:]:
-                # Remove this duplicate branch
-                if node.parent:
-                    node.parent = None
+        if not node.children:
+            continue
+        branch_id = node_branch_ids[node]
+        if branch_id in seen_branch_ids:
+            # Remove this duplicate branch
+            node.parent = None
+        else:
+            seen_branch_ids.add(branch_id)
 
     return root
 
@@ -343,53 +673,74 @@ def _trees_with_cpes(ancestor_data: dict[str, Any]) -> list[Node]:
     """Builds a tree of ancestors with a target component root"""
     if "items" not in ancestor_data or not ancestor_data["items"]:
         return []
-    base_node = Node("root")
-    build_ancestor_tree(base_node, ancestor_data["items"])
-    _remove_duplicate_branches(base_node)
-    _remove_duplicate_parent_nodes(base_node)
-    first_children = _remove_root_return_children(base_node)
-    trees_with_cpes: list[Node] = []
-    for tree in first_children:
+    base_node = TreeNode("root")
+    with span("build ancestor tree"):
+        build_ancestor_tree(base_node, ancestor_data["items"])
+    return _trees_from_ancestor_tree(base_node)
+
+
+def _trees_from_ancestor_tree(base_node: TreeNode) -> list[Node]:
+    """Split a tree of ancestors into trees per component which have CPEs. The tree is pruned
+    as TreeNodes, and the resulting trees are converted to anytree Nodes."""
+    with span("remove duplicate branches"):
+        _remove_duplicate_branches(base_node)
+    with span("prune ancestor tree"):
+        trees_with_cpes = _prune_ancestor_tree(base_node)
+    with span("convert trees"):
+        return [to_anytree(tree) for tree in trees_with_cpes]
+
+
+def _prune_ancestor_tree(base_node: TreeNode) -> list[TreeNode]:
+    """
+    Split a tree of ancestors into trees per component which have CPEs, in one pre-order walk
+    and one bottom-up pass. Nodes with the same name as their parent are merged into it, trees
+    for rpms in containers are skipped, and the branches which don't lead to a CPE are removed.
+    """
+    # Merge nodes with the same name as their parent while walking the tree in pre-order.
+    # Merged children are still visited, in their original order
+    nodes = base_node.pre_order()
+    for node in nodes[1:]:
+        parent = node.parent
+        if parent is not None and node.name == parent.name:
+            node.merge_into_parent()
+
+    # Children are visited before their parents in reverse pre-order, including the children
+    # of merged nodes, which are now children of an ancestor
+    cpe_nodes: set[TreeNode] = set()
+    container_nodes: set[TreeNode] = set()
+    for node in reversed(nodes):
+        parent = node.parent
+        if parent is None:
+            # Merged, or the base node
+            continue
+        if node in cpe_nodes or node.name.startswith("cpe:/"):
+            cpe_nodes.add(node)
+            cpe_nodes.add(parent)
+        if node in container_nodes or node.name.startswith("pkg:oci/"):
+            container_nodes.add(parent)
+
+    trees_with_cpes: list[TreeNode] = []
+    for tree in _remove_root_return_children(base_node):
         # Remove this once https://issues.redhat.com/browse/TC-2659 is implemented
-        if tree.name.startswith("pkg:rpm/"):
-            if container_in_tree(tree):
-                continue
-        if not _has_cpe_node(tree):
+        if tree.name.startswith("pkg:rpm/") and tree in container_nodes:
+            continue
+        if tree not in cpe_nodes:
             for leaf in tree.leaves:
+                # Branches pruned while streaming are leaves named with a NUL and a digest
+                ancestor = leaf.name.split("\0")[0]
                 logger.debug(
-                    f"Found result {tree.name} with ancestor: {leaf.name} but no CPE parent"
+                    f"Found result {tree.name} with ancestor: {ancestor} but no CPE parent"
                 )
         else:
             trees_with_cpes.append(tree)
-    return [_remove_non_cpe_branches(tree) for tree in trees_with_cpes]
-
-
-def container_in_tree(root: Node) -> bool:
-    """
-    Returns true if containers exist in tree descendants
-    """
-    for node in root.descendants:
-        if node.name.startswith("pkg:oci/"):
-            return True
-    return False
-
-
-def _remove_duplicate_parent_nodes(node: Node):
-    """
-    Removes nodes in an anytree tree that have the same name as their direct parent,
-    and reparents their children to the remaining node.
 
-    :param node: The node to process.
-    """
-    for descandant in node.descendants:
-        if descandant.name == descandant.parent.name:
-            new_children = list(descandant.siblings)
-            new_children.extend(descandant.children)
-            descandant.parent.children = new_children
-            descandant.parent = None
+    # Sweep the branches without a CPE from the trees which are kept
+    for tree in trees_with_cpes:
+        _sweep_branches(tree, cpe_nodes)
+    return trees_with_cpes
 
 
-def _build_node_purl(purls: list[str]) -> Optional[PackageURL]:
+def _build_node_purl(purls: list[str]) -> Optional[str]:
     """
     Generate a base purl with a version or tag qualifier from a list of purls with homogenous
     type/namespace, and name
@@ -398,39 +749,35 @@ def _build_node_purl(purls: list[str]) -> Optional[PackageURL]:
     purls (list[str]): A list of purls.
 
     Returns:
-    set[str]: A set of base purls
+    str: The base purl, or None if purls is empty
     """
     node_purls, type = _build_node_names_by_type(purls)
     if not node_purls:
         return None
     elif len(node_purls) > 1:
         if type == "oci":
-            purl_tags: dict[str, PackageURL] = {}
+            from trustshell.versions import latest_version
+
+            purl_tags: dict[str, str] = {}
             for purl in node_purls:
-                qualifiers = purl.qualifiers
-                if qualifiers and isinstance(qualifiers, dict) and "tag" in qualifiers:
-                    purl_tags[qualifiers["tag"]] = purl
+                tag = get_tag_from_purl(purl)
+                if tag:
+                    purl_tags[tag] = purl
             if purl_tags:
-                sorted_purls = sorted(
-                    purl_tags.keys(), key=lambda x: RpmVersion(x), reverse=True
-                )
-                return purl_tags[sorted_purls[0]]
+                return purl_tags[latest_version("oci", purl_tags)]
         else:
             console.print(f"multiple node purls found: {node_purls}", style="warning")
     return node_purls.pop()
 
 
-def _build_node_names_by_type(purls: list[str]) -> tuple[set[PackageURL], str]:
+def _build_node_names_by_type(purls: list[str]) -> tuple[set[str], str]:
     """
     Given some purl strings, return a unique set of base purls with versions or tag qualifiers
     """
     types = set()
-    node_purls: dict[PackageURL, str] = {}
+    node_purls: dict[str, str] = {}
     for purl in purls:
-        purl_obj = PackageURL.from_string(purl)
-        tag = get_tag_from_purl(purl_obj)
-        base_purl = _remove_qualifiers(purl_obj, tag)
-        node_purls[base_purl] = purl_obj.type
+        node_purls[normalize_purl(purl)] = parse_purl(purl).type
     types = set(node_purls.values())
     if not types:
         return (set(), "")
@@ -438,22 +785,3 @@ def _build_node_names_by_type(purls: list[str]) -> tuple[set[PackageURL], str]:
         console.print("Non homogenous types when calculating node name", style="error")
         sys.exit(1)
     return set(node_purls.keys()), types.pop()
-
-
-def _remove_qualifiers(purl: PackageURL, tag: str) -> PackageURL:
-    """Remove all qualifiers from a purl keeping repository_url, optionally setting a tag"""
-    qualifiers = {}
-    if "repository_url" in purl.qualifiers and purl.type == "oci":
-        qualifiers["repository_url"] = purl.qualifiers["repository_url"]
-    version = ""
-    if tag:
-        qualifiers["tag"] = tag
-    elif purl.version:
-        version = purl.version
-    return PackageURL(
-        type=purl.type,
-        name=purl.name,
-        namespace=purl.namespace,
-        version=version,
-        qualifiers=qualifiers,
-    )
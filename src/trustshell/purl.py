@@ -1,37 +1,34 @@
 import click
-import httpx
 import logging
 
 from packageurl import PackageURL
 from rich.console import Console
 from rich.theme import Theme
-from typing import Any
-from univers.versions import (
-    GenericVersion,
-    GolangVersion,
-    MavenVersion,
-    PypiVersion,
-    RpmVersion,
-    SemverVersion,
-    Version,
-)
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 
 from trustshell import (
-    AUTH_ENABLED,
-    TRUSTIFY_URL,
     get_tag_from_purl,
-    check_or_get_access_token,
+    parse_purl,
     print_version,
     config_logging,
     urlencoded,
 )
 
+# httpx, asyncio and univers are imported where they're needed, so --help starts quickly
+if TYPE_CHECKING:
+    import asyncio
+
+    import httpx
+
+    from trustshell.client import TrustifyClient
 
 custom_theme = Theme({"warning": "magenta", "error": "bold red"})
 console = Console(color_system="auto", theme=custom_theme)
 logger = logging.getLogger("trustshell")
 
-PURL_BASE_ENDPOINT = f"{TRUSTIFY_URL}purl/base"
+PURL_BASE_ENDPOINT = "purl/base"
+# Maximum number of base purl version lookups in flight at once
+DEFAULT_CONCURRENCY = 10
 
 
 @click.command(context_settings={"help_option_names": ["-h", "--help"]})
@@ -45,103 +42,171 @@ PURL_BASE_ENDPOINT = f"{TRUSTIFY_URL}purl/base"
 )
 @click.option("--debug", "-d", is_flag=True, help="Debug log level.")
 @click.option("--latest-version", "-l", is_flag=True, help="Include latest versions")
+@click.option(
+    "--concurrency",
+    "-c",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    help="Maximum number of concurrent version lookups.",
+)
+@click.option(
+    "--max-results",
+    "-m",
+    type=click.IntRange(min=1),
+    help="Stop after this many matching packages.",
+)
 @click.argument(
     "component",
     type=click.STRING,
 )
-def search(component: str, latest_version: bool, debug: bool):
+def search(
+    component: str,
+    latest_version: bool,
+    concurrency: int,
+    max_results: Optional[int],
+    debug: bool,
+):
     """Search for a component in Trustify"""
     if not debug:
         config_logging(level="INFO")
     else:
         config_logging(level="DEBUG")
 
-    auth_header = {}
-    if AUTH_ENABLED:
-        access_token = check_or_get_access_token()
-        auth_header = {"Authorization": f"Bearer {access_token}"}
+    from trustshell.client import get_client
 
-    purls = _query_trustify_packages(component, auth_header)
+    client = get_client()
+    console.print(f"Querying Trustify for packages matching {component}")
+    pages = _query_trustify_package_pages(component, client, max_results)
     if latest_version:
-        purls_with_version = _latest_package_versions(purls, auth_header)
-        console.print(
-            "Found these matching packages in Trustify, including the highest version found:"
-        )
-        for package_summary, package_details in purls_with_version.items():
-            console.print(f"{package_summary}@{package_details[0].string}")
+        import asyncio
+
+        found = asyncio.run(_print_latest_versions(pages, client, concurrency))
     else:
-        console.print("Found these matching packages in Trustify:")
-        for purl in purls:
-            console.print(purl)
+        found = False
+        for purls in pages:
+            if not found:
+                console.print("Found these matching packages in Trustify:")
+                found = True
+            for purl in purls:
+                console.print(purl)
+    if not found:
+        console.print(f"No packages found for {component}")
 
 
-def _query_trustify_packages(component: str, auth_header: dict[str, str]) -> list[str]:
+async def _print_latest_versions(
+    pages: Iterator[list[str]], client: "TrustifyClient", concurrency: int
+) -> bool:
     """
-    Given a search string 'component' use the Trustify PURL Base endpoint to find packages in PURL
-    format matching the given package. Accepts requests such as k8s.io/api that have both a PURL
-    namespace and name.
+    Print the packages in each page of base purls with their latest version, returns whether
+    any were found. The versions are looked up a page at a time, while the following pages are
+    fetched, and the lookups for all pages share one async client and its connections.
     """
-    package_query = {"q": component}
-    console.print(f"Querying Trustify for packages matching {component}")
-    package_response = httpx.get(
-        PURL_BASE_ENDPOINT, params=package_query, headers=auth_header
+    import asyncio
+
+    found = False
+    semaphore = asyncio.Semaphore(concurrency)
+    async with client.async_client(max_connections=concurrency) as async_client:
+        # The pages are fetched with blocking requests, so they're read in a thread to let the
+        # lookups for the previous page carry on
+        while purls := await asyncio.to_thread(next, pages, None):
+            if not found:
+                console.print(
+                    "Found these matching packages in Trustify, including the highest version found:"
+                )
+                found = True
+            all_versions = await _fetch_all_package_versions(
+                purls, client, async_client, semaphore
+            )
+            purls_with_version = _latest_package_versions(purls, all_versions)
+            for package_summary, package_details in purls_with_version.items():
+                console.print(f"{package_summary}@{package_details[0]}")
+    return found
+
+
+def _query_trustify_package_pages(
+    component: str,
+    client: "TrustifyClient",
+    max_results: Optional[int] = None,
+    page_size: Optional[int] = None,
+) -> Iterator[list[str]]:
+    """Get the purls of packages matching 'component', a page at a time. Pages after the
+    first are fetched concurrently, and no more than max_results purls are fetched."""
+    from trustshell.client import DEFAULT_PAGE_SIZE
+
+    pages = client.paginate(
+        PURL_BASE_ENDPOINT,
+        params={"q": component},
+        page_size=page_size or DEFAULT_PAGE_SIZE,
+        max_results=max_results,
     )
-    package_response.raise_for_status()
-    package_result = package_response.json()
-    if len(package_result["items"]) == 0:
-        console.print(f"No packages found for {component}")
-    return [item["purl"] for item in package_result["items"]]
+    for page in pages:
+        purls = [item["purl"] for item in page["items"]]
+        if purls:
+            yield purls
 
 
 def _latest_package_versions(
-    base_purls: list[str], auth_header: dict[str, str]
-) -> dict[str, tuple[Version, PackageURL]]:
-    """Get the latest version from a list of purls"""
-    packages: dict[str, tuple[Version, PackageURL]] = {}
-    for base_purl in base_purls:
-        versions = _get_package_versions(base_purl, auth_header)
-        purl = PackageURL.from_string(base_purl)
-        for version in versions:
-            # Use lexicographic ordering for OCI once KONFLUX-6210 is resolved
-            if purl.type in ("rpm", "oci"):
-                typed_version = RpmVersion(version)
-            elif purl.type == "maven":
-                typed_version = MavenVersion(version)
-            elif purl.type == "go":
-                typed_version = GolangVersion(version)
-            elif purl.type == "npm":
-                typed_version = SemverVersion(version)
-            elif purl.type == "pypi":
-                typed_version = PypiVersion(version)
-            else:
-                typed_version = GenericVersion(version)
-
-            if base_purl in packages:
-                current_version = packages[base_purl][0]
-                if current_version < typed_version:
-                    packages[base_purl] = typed_version, purl
-            else:
-                packages[base_purl] = typed_version, purl
+    base_purls: list[str], all_versions: list[set[str] | Exception]
+) -> dict[str, tuple[str, PackageURL]]:
+    """Get the latest version of each of base_purls from the versions looked up for them"""
+    from trustshell.versions import latest_version
+
+    packages: dict[str, tuple[str, PackageURL]] = {}
+    for base_purl, versions in zip(base_purls, all_versions):
+        if isinstance(versions, Exception):
+            console.print(
+                f"Failed to look up versions for {base_purl}: {versions}",
+                style="error",
+            )
+            continue
+        if not versions:
+            continue
+        purl = parse_purl(base_purl)
+        # Use lexicographic ordering for OCI once KONFLUX-6210 is resolved
+        packages[base_purl] = latest_version(purl.type, versions), purl
 
     return packages
 
 
-def _get_package_versions(base_purl: str, auth_header: dict[str, str]) -> set[str]:
+async def _fetch_all_package_versions(
+    base_purls: list[str],
+    client: "TrustifyClient",
+    async_client: "httpx.AsyncClient",
+    semaphore: "asyncio.Semaphore",
+) -> list[set[str] | Exception]:
     """
-    If an OCI base_purl is passed in, get its version from purl tags. Otherwise return the
-    purl versions reported by Trustify
+    Look up the versions of all base_purls concurrently, with at most as many requests in
+    flight as the semaphore allows. Results are returned in the same order as base_purls, a
+    failed lookup is returned as the exception which caused it rather than aborting the other
+    lookups.
     """
+    import asyncio
+
+    async def bounded_lookup(base_purl: str) -> set[str]:
+        async with semaphore:
+            purl_versions = await _lookup_base_purl_async(
+                client, async_client, base_purl
+            )
+        return _versions_from_base_purl(base_purl, purl_versions)
+
+    return await asyncio.gather(
+        *(bounded_lookup(base_purl) for base_purl in base_purls),
+        return_exceptions=True,
+    )
+
 
+def _versions_from_base_purl(base_purl: str, purl_versions: dict[str, Any]) -> set[str]:
+    """Extract the versions, or OCI tags from a Trustify base purl response"""
     logger.debug(f"Finding versions for {base_purl}")
-    purl = PackageURL.from_string(base_purl)
-    purl_versions = _lookup_base_purl(base_purl, auth_header)
+    purl = parse_purl(base_purl)
     versions: set[str] = set()
     if "versions" not in purl_versions:
         return versions
     if purl.type == "oci":
         for version in purl_versions["versions"]:
             for version_purl in version.get("purls", []):
-                tag = get_tag_from_purl(PackageURL.from_string(version_purl["purl"]))
+                tag = get_tag_from_purl(version_purl["purl"])
                 if tag:
                     versions.add(tag)
     else:
@@ -149,12 +214,13 @@ def _get_package_versions(base_purl: str, auth_header: dict[str, str]) -> set[st
     return versions
 
 
-def _lookup_base_purl(base_purl: str, auth_header: dict[str, str]) -> dict[str, Any]:
-    """Get the details of a base purl from Atlas"""
+async def _lookup_base_purl_async(
+    client: "TrustifyClient", async_client: "httpx.AsyncClient", base_purl: str
+) -> dict[str, Any]:
+    """Get the details of a base purl from Atlas using a shared async client"""
     encoded_base_purl = urlencoded(base_purl)
-    # TODO use asyncio
-    base_purl_response = httpx.get(
-        f"{PURL_BASE_ENDPOINT}/{encoded_base_purl}", headers=auth_header
+    base_purl_response = await async_client.get(
+        client.url(f"{PURL_BASE_ENDPOINT}/{encoded_base_purl}")
     )
     base_purl_response.raise_for_status()
     return base_purl_response.json()
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+# Set to a file path to write a trace of each trust-products run, like --profile
+TRACE_ENV = "TRUSTSHELL_TRACE"
+
+
+class Span:
+    """A completed timing span"""
+
+    __slots__ = (
+        "name",
+        "category",
+        "start_ns",
+        "duration_ns",
+        "self_ns",
+        "tid",
+        "args",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        category: str,
+        start_ns: int,
+        duration_ns: int,
+        self_ns: int,
+        tid: int,
+        args: dict[str, Any],
+    ):
+        self.name = name
+        self.category = category
+        self.start_ns = start_ns
+        self.duration_ns = duration_ns
+        # Time not spent in nested spans
+        self.self_ns = self_ns
+        self.tid = tid
+        self.args = args
+
+
+class Tracer:
+    """
+    Records nested timing spans from any thread. Spans can be written as a Chrome trace event
+    file, which can be opened in chrome://tracing or https://ui.perfetto.dev, and summarized
+    as a table of time per span name.
+    """
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.thread_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        # Per thread stack of the time spent in nested spans of each open span
+        self._local = threading.local()
+
+    @contextmanager
+    def span(
+        self, name: str, category: str, args: dict[str, Any]
+    ) -> Iterator[dict[str, Any]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0)
+        start_ns = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            duration_ns = time.perf_counter_ns() - start_ns
+            nested_ns = stack.pop()
+            if stack:
+                stack[-1] += duration_ns
+            thread = threading.current_thread()
+            span = Span(
+                name,
+                category,
+                start_ns,
+                duration_ns,
+                duration_ns - nested_ns,
+                thread.ident or 0,
+                args,
+            )
+            with self._lock:
+                self.spans.append(span)
+                self.thread_names.setdefault(span.tid, thread.name)
+
+    def stop(self) -> None:
+        self.end_ns = time.perf_counter_ns()
+
+    @property
+    def wall_ns(self) -> int:
+        return (self.end_ns or time.perf_counter_ns()) - self.start_ns
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """Get the spans as complete ('X') events of the Chrome trace event format"""
+        pid = os.getpid()
+        events: list[dict[str, Any]] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+            for tid, thread_name in self.thread_names.items()
+        ]
+        for span in sorted(self.spans, key=lambda s: s.start_ns):
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (span.start_ns - self.start_ns) / 1000,
+                    "dur": span.duration_ns / 1000,
+                    "pid": pid,
+                    "tid": span.tid,
+                    "args": span.args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def summary(self) -> list[tuple[str, int, float, float, float]]:
+        """Get (name, calls, total ms, self ms, max ms) of the spans with each name, in order
+        of total time"""
+        totals: dict[str, list] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += span.duration_ns
+            total[2] += span.self_ns
+            total[3] = max(total[3], span.duration_ns)
+        rows = [
+            (name, calls, total_ns / 1e6, self_ns / 1e6, max_ns / 1e6)
+            for name, (calls, total_ns, self_ns, max_ns) in totals.items()
+        ]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def print_summary(self, console: Console) -> None:
+        table = Table(title=f"Trace summary, {self.wall_ns / 1e6:.1f}ms wall time")
+        table.add_column("Span")
+        table.add_column("Calls", justify="right")
+        table.add_column("Total ms", justify="right")
+        table.add_column("Self ms", justify="right")
+        table.add_column("Max ms", justify="right")
+        for name, calls, total_ms, self_ms, max_ms in self.summary():
+            table.add_row(
+                name, str(calls), f"{total_ms:.1f}", f"{self_ms:.1f}", f"{max_ms:.1f}"
+            )
+        console.print(table)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Get the active tracer, if tracing is enabled"""
+    return _tracer
+
+
+@contextmanager
+def span(name: str, category: str = "trustshell", **args: Any) -> Iterator[dict]:
+    """
+    Time the enclosed block as a span of the active trace, args are recorded with it. Yields
+    the args dict so details only known at the end, eg. a response status, can be added.
+    Does nothing if tracing isn't enabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, args) as span_args:
+        yield span_args
+
+
+@contextmanager
+def tracing(path: Optional[str], console: Console) -> Iterator[Optional[Tracer]]:
+    """
+    Trace the enclosed block if path is set, then write the trace to path and print a summary
+    to console, even if the block exits early.
+    """
+    global _tracer
+    if not path:
+        yield None
+        return
+    tracer = _tracer = Tracer()
+    try:
+        yield tracer
+    finally:
+        _tracer = None
+        tracer.stop()
+        tracer.write(path)
+        tracer.print_summary(console)
+        console.print(f"Wrote trace to {path}")
@@ -0,0 +1,152 @@
+import sys
+from typing import Iterable, Optional, Union
+
+from anytree import Node
+
+
+class TreeNode:
+    """
+    A compact tree node for building and pruning ancestor trees, which can have tens of
+    thousands of nodes. Node names are interned because the same purls are found in many
+    branches, and there is no per node attribute dict.
+
+    Implements the parts of the anytree NodeMixin API which are used while pruning, so anytree
+    iterators, RenderTree and Walker can be used with it. Trees are converted with to_anytree
+    once they are pruned.
+    """
+
+    __slots__ = ("name", "_parent", "_children")
+
+    def __init__(
+        self,
+        name: str,
+        parent: Optional["TreeNode"] = None,
+        children: Optional[Iterable["TreeNode"]] = None,
+    ):
+        self.name = sys.intern(name)
+        self._parent: Optional[TreeNode] = None
+        # Leaves share the empty tuple, a list is only allocated for nodes with children
+        self._children: Union[list[TreeNode], tuple[()]] = ()
+        if children:
+            self.children = children
+        if parent is not None:
+            self.parent = parent
+
+    def __repr__(self) -> str:
+        return f"TreeNode({self.name!r})"
+
+    @property
+    def parent(self) -> Optional["TreeNode"]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, value: Optional["TreeNode"]) -> None:
+        if value is self._parent:
+            return
+        if self._parent is not None:
+            siblings = self._parent._children
+            for i, sibling in enumerate(siblings):
+                if sibling is self:
+                    del siblings[i]
+                    break
+        self._parent = value
+        if value is not None:
+            if value._children:
+                value._children.append(self)
+            else:
+                value._children = [self]
+
+    @property
+    def children(self) -> tuple["TreeNode", ...]:
+        return tuple(self._children)
+
+    @children.setter
+    def children(self, children: Iterable["TreeNode"]) -> None:
+        for child in self._children:
+            child._parent = None
+        self._children = ()
+        for child in children:
+            child.parent = self
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self._children
+
+    @property
+    def is_root(self) -> bool:
+        return self._parent is None
+
+    @property
+    def root(self) -> "TreeNode":
+        node = self
+        while node._parent is not None:
+            node = node._parent
+        return node
+
+    @property
+    def path(self) -> tuple["TreeNode", ...]:
+        """The nodes from the root to this node"""
+        path = [self]
+        node = self
+        while node._parent is not None:
+            node = node._parent
+            path.append(node)
+        return tuple(reversed(path))
+
+    @property
+    def ancestors(self) -> tuple["TreeNode", ...]:
+        return self.path[:-1]
+
+    @property
+    def siblings(self) -> tuple["TreeNode", ...]:
+        if self._parent is None:
+            return ()
+        return tuple(node for node in self._parent._children if node is not self)
+
+    def merge_into_parent(self) -> None:
+        """Remove this node, moving its children to the end of its parent's children"""
+        parent = self._parent
+        if parent is None:
+            return
+        siblings = parent._children
+        for i, sibling in enumerate(siblings):
+            if sibling is self:
+                del siblings[i]
+                break
+        for child in self._children:
+            child._parent = parent
+        if self._children:
+            siblings.extend(self._children)
+        self._parent = None
+        self._children = ()
+
+    def pre_order(self) -> list["TreeNode"]:
+        """This node and its descendants in pre-order"""
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node._children))
+        return nodes
+
+    @property
+    def descendants(self) -> tuple["TreeNode", ...]:
+        return tuple(self.pre_order()[1:])
+
+    @property
+    def leaves(self) -> tuple["TreeNode", ...]:
+        return tuple(node for node in self.pre_order() if not node._children)
+
+
+def to_anytree(root: TreeNode) -> Node:
+    """Copy a tree of TreeNodes to anytree Nodes"""
+    if isinstance(root, Node):
+        return root
+    nodes: dict[TreeNode, Node] = {}
+    for node in reversed(root.pre_order()):
+        # Children are visited before their parent
+        nodes[node] = Node(
+            node.name, children=[nodes.pop(child) for child in node._children]
+        )
+    return nodes[root]
@@ -0,0 +1,284 @@
+import click
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Optional, TextIO
+
+from rich.console import Console
+from rich.theme import Theme
+
+from trustshell import config_logging, parse_purl, print_version, products
+from trustshell.trace import TRACE_ENV, span, tracing
+
+# OSIDB (osidb_bindings), the Trustify client and product definitions are imported where
+# they're needed, so --help starts quickly
+if TYPE_CHECKING:
+    from osidb_bindings.bindings.python_client.models import Flaw
+
+    from trustshell.osidb import OSIDB
+
+custom_theme = Theme({"warning": "magenta", "error": "bold red"})
+console = Console(color_system="auto", theme=custom_theme)
+logger = logging.getLogger("trustshell")
+
+
+class FlawPlan:
+    """The purls listed for a flaw in a triage manifest, and the affects changes they lead to"""
+
+    def __init__(self, flaw_id: str):
+        self.flaw_id = flaw_id
+        self.purls: list[str] = []
+        self.flaw: Optional["Flaw"] = None
+        self.affects: set[tuple[str, str]] = set()
+        self.affects_to_add: set[tuple[str, str]] = set()
+        self.affects_to_delete: dict[tuple[str, str], str] = {}
+        # A flaw with errors isn't updated, its affects might be incomplete
+        self.errors: list[str] = []
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.affects_to_add or self.affects_to_delete)
+
+
+@click.command(context_settings={"help_option_names": ["-h", "--help"]})
+@click.option(
+    "--version",
+    "-V",
+    is_flag=True,
+    callback=print_version,
+    expose_value=False,
+    is_eager=True,
+)
+@click.option(
+    "--replace",
+    "-r",
+    is_flag=True,
+    help="Replace the NEW affects of each flaw with the ones found.",
+)
+@click.option(
+    "--yes", "-y", is_flag=True, help="Apply the changes without asking to confirm."
+)
+@click.option(
+    "--no-cache", is_flag=True, help="Don't read or write the local response cache."
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Ignore cached responses and update the cache with fresh ones.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=products.DEFAULT_BATCH_WORKERS,
+    show_default=True,
+    help="Number of concurrent Trustify and OSIDB queries.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    envvar=TRACE_ENV,
+    help="Time each phase of the run, write the timings to a Chrome trace event file and "
+    f"print a summary. Can also be set with {TRACE_ENV}.",
+)
+@click.option("--debug", "-d", is_flag=True, help="Debug log level.")
+@click.argument("manifest", type=click.File("r"))
+def triage(
+    manifest: TextIO,
+    replace: bool,
+    yes: bool,
+    no_cache: bool,
+    refresh: bool,
+    workers: int,
+    profile: Optional[str],
+    debug: bool,
+):
+    """Relate the purls of many flaws to products and update their affects in one pass
+
+    Each line of MANIFEST is an OSIDB flaw uuid or CVE followed by the purls of the affected
+    components, separated by whitespace. Use '-' to read the manifest from stdin, which
+    requires --yes as there's no way to confirm the changes.
+    """
+    if manifest.name == "<stdin>" and not yes:
+        raise click.UsageError("--yes is required to read the manifest from stdin")
+    if not debug:
+        config_logging(level="INFO")
+    else:
+        config_logging(level="DEBUG")
+
+    plans = read_manifest(manifest)
+    if not plans:
+        console.print("No flaws found in the manifest", style="warning")
+        return
+
+    from trustshell.cache import ResponseCache
+    from trustshell.osidb import OSIDB
+
+    with tracing(profile, Console(stderr=True)):
+        with span("trust-triage", flaws=len(plans)):
+            cache = None
+            if not no_cache:
+                cache = ResponseCache()
+            osidb = OSIDB()
+            console.print(f"Looking up affects for {len(plans)} flaws...")
+            plan_triage(plans, osidb, workers, replace, cache=cache, refresh=refresh)
+            updates = review(plans)
+            failed: list[str] = []
+            if updates:
+                if not yes:
+                    click.confirm(
+                        f"Apply the above changes to {updates} flaws?", abort=True
+                    )
+                failed = apply_triage(plans, osidb)
+
+    skipped = [plan.flaw_id for plan in plans if plan.errors]
+    console.print(
+        f"Updated {updates - len(failed)} flaws, {len(failed)} failed, "
+        f"{len(skipped)} skipped because of errors."
+    )
+    if failed:
+        console.print(f"Failed to update: {', '.join(failed)}", style="error")
+    if skipped:
+        console.print(f"Skipped: {', '.join(skipped)}", style="warning")
+    if failed or skipped:
+        sys.exit(1)
+
+
+def read_manifest(lines: TextIO) -> list[FlawPlan]:
+    """Read the rows of a triage manifest, rows for the same flaw are merged. Blank lines and
+    comments are ignored."""
+    plans: dict[str, FlawPlan] = {}
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        flaw_id, *purls = line.split()
+        if not purls:
+            console.print(
+                f"Error: No purls given for {flaw_id} on line {number} of the manifest.",
+                style="error",
+            )
+            sys.exit(1)
+        plan = plans.setdefault(flaw_id, FlawPlan(flaw_id))
+        for purl in purls:
+            if purl not in plan.purls:
+                plan.purls.append(purl)
+    return list(plans.values())
+
+
+def plan_triage(
+    plans: list[FlawPlan],
+    osidb: "OSIDB",
+    workers: int,
+    replace: bool,
+    **roots_kwargs: Any,
+) -> None:
+    """
+    Work out the affects changes for each flaw in plans. The flaws are retrieved from OSIDB
+    and the ancestors of every purl are queried in Trustify concurrently, while the purls whose
+    ancestors have arrived are mapped to products, in manifest order. Each purl is only
+    queried once, however many flaws list it. Failures are recorded in the plans.
+    """
+    from trustshell.client import get_client
+    from trustshell.product_definitions import ProdDefs
+
+    purls = list(dict.fromkeys(purl for plan in plans for purl in plan.purls))
+    client = get_client()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        flaws = {
+            plan.flaw_id: executor.submit(osidb.retrieve_flaw, plan.flaw_id)
+            for plan in plans
+        }
+        if roots_kwargs.get("cache"):
+            # Look up the cache generation once, rather than in each worker
+            roots_kwargs["cache"].generation(client)
+        roots = {}
+        for purl in purls:
+            try:
+                parse_purl(purl)
+            except ValueError:
+                continue
+            roots[purl] = executor.submit(products._get_roots, purl, **roots_kwargs)
+        with span("load product definitions"):
+            prod_defs = ProdDefs()
+
+        affects_by_purl: dict[str, set[tuple[str, str]]] = {}
+        errors_by_purl: dict[str, str] = {}
+        for purl in purls:
+            try:
+                if purl not in roots:
+                    raise ValueError(f"{purl} is not a valid Package URL")
+                with span("wait for query", purl=purl):
+                    ancestor_trees = roots.pop(purl).result()
+                with span("map products"):
+                    ancestor_trees = prod_defs.extend_with_product_mappings(
+                        ancestor_trees
+                    )
+                with span("extract affects"):
+                    affects_by_purl[purl] = products.extract_affects(ancestor_trees)
+            except (Exception, SystemExit) as e:
+                # _build_node_purl exits on unexpected data, that shouldn't end the triage
+                errors_by_purl[purl] = (
+                    f"Failed to process {purl}: {str(e) or type(e).__name__}"
+                )
+
+        for plan in plans:
+            for purl in plan.purls:
+                if purl in errors_by_purl:
+                    plan.errors.append(errors_by_purl[purl])
+                else:
+                    plan.affects |= affects_by_purl[purl]
+            try:
+                with span("wait for flaw", flaw=plan.flaw_id):
+                    plan.flaw = flaws[plan.flaw_id].result()
+            except Exception as e:
+                plan.errors.append(f"Could not retrieve flaw {plan.flaw_id}: {e}")
+                continue
+            if plan.affects:
+                plan.affects_to_add, plan.affects_to_delete = osidb.plan_affects(
+                    plan.flaw, plan.affects, replace
+                )
+
+
+def review(plans: list[FlawPlan]) -> int:
+    """Print the changes planned for every flaw, returns the number of flaws to update"""
+    updates = 0
+    for plan in plans:
+        console.print(f"\n{plan.flaw_id}", style="bold")
+        if plan.errors:
+            for error in plan.errors:
+                console.print(f"  {error}", style="error")
+            console.print("  Skipped", style="warning")
+            continue
+        for ps_module, purl in sorted(plan.affects_to_delete):
+            console.print(f"  - {ps_module},{purl}")
+        for ps_module, purl in sorted(plan.affects_to_add):
+            console.print(f"  + {ps_module},{purl}")
+        if plan.has_changes:
+            updates += 1
+        elif not plan.affects:
+            console.print("  No affects found", style="warning")
+        else:
+            console.print("  No changes")
+    added = sum(len(plan.affects_to_add) for plan in plans if not plan.errors)
+    deleted = sum(len(plan.affects_to_delete) for plan in plans if not plan.errors)
+    console.print(
+        f"\n{updates} flaws to update: {added} affects to add, {deleted} to delete\n"
+    )
+    return updates
+
+
+def apply_triage(plans: list[FlawPlan], osidb: "OSIDB") -> list[str]:
+    """Apply the planned changes to each flaw without errors, returns the flaws which
+    couldn't be updated"""
+    failed = []
+    for plan in plans:
+        if plan.errors or not plan.has_changes:
+            continue
+        console.print(f"Updating {plan.flaw_id}...")
+        try:
+            osidb.apply_affects(plan.flaw, plan.affects_to_add, plan.affects_to_delete)
+        except SystemExit:
+            # The failed changes were already reported, carry on with the other flaws
+            failed.append(plan.flaw_id)
+    return failed
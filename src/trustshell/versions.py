@@ -0,0 +1,83 @@
+import functools
+import re
+from typing import Any, Iterable
+
+from univers.rpm import from_evr
+from univers.versions import (
+    GenericVersion,
+    GolangVersion,
+    InvalidVersion,
+    MavenVersion,
+    PypiVersion,
+    RpmVersion,
+    SemverVersion,
+    Version,
+)
+
+# Number of (purl type, version) sort keys to keep
+VERSION_CACHE_SIZE = 65536
+
+# Version schemes by purl type, other types use GenericVersion. OCI tags are compared like RPM
+# versions.
+VERSION_CLASSES: dict[str, type[Version]] = {
+    "rpm": RpmVersion,
+    "oci": RpmVersion,
+    "maven": MavenVersion,
+    "go": GolangVersion,
+    "npm": SemverVersion,
+    "pypi": PypiVersion,
+}
+
+# Segments compared by rpmvercmp, any other characters are separators
+_RPM_SEGMENT_RE = re.compile(r"(~)|(\^)|([a-zA-Z]+)|([0-9]+)")
+# Ranks of rpmvercmp segments: tilde sorts before the end of a version, caret after the end
+# but before any other segment, and numeric segments are newer than alphabetic ones
+_RPM_TILDE = (0,)
+_RPM_END = (1,)
+_RPM_CARET = (2,)
+_RPM_ALPHA = 3
+_RPM_NUMERIC = 4
+
+
+def _rpm_vercmp_key(value: str) -> tuple:
+    """A key which orders version or release strings the same as rpmvercmp"""
+    # rpm versions can only be ascii, anything else is ignored
+    value = value.encode("ascii", "ignore").decode("ascii")
+    key: list[tuple] = []
+    for tilde, caret, alpha, numeric in _RPM_SEGMENT_RE.findall(value):
+        if tilde:
+            key.append(_RPM_TILDE)
+        elif caret:
+            key.append(_RPM_CARET)
+        elif alpha:
+            key.append((_RPM_ALPHA, alpha))
+        else:
+            key.append((_RPM_NUMERIC, int(numeric)))
+    key.append(_RPM_END)
+    return tuple(key)
+
+
+def rpm_sort_key(version: str) -> tuple:
+    """A key which orders [epoch:]version[-release] strings the same as RpmVersion"""
+    normalized = RpmVersion.normalize(version)
+    if not normalized:
+        raise InvalidVersion(f"{version!r} is not a valid {RpmVersion!r}")
+    epoch, version, release = from_evr(normalized)
+    return epoch, _rpm_vercmp_key(version), _rpm_vercmp_key(release)
+
+
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
+def version_key(purl_type: str, version: str) -> Any:
+    """
+    Get a sort key for a version of a package with the given purl type. Keys of the same purl
+    type can be compared with each other. RPM versions and OCI tags get a precomputed tuple,
+    other types get a parsed univers Version.
+    """
+    if purl_type in ("rpm", "oci"):
+        return rpm_sort_key(version)
+    return VERSION_CLASSES.get(purl_type, GenericVersion)(version)
+
+
+def latest_version(purl_type: str, versions: Iterable[str]) -> str:
+    """Get the latest of some versions of a package with the given purl type"""
+    return max(versions, key=functools.partial(version_key, purl_type))
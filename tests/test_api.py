@@ -0,0 +1,75 @@
+import json
+from unittest.mock import patch
+
+import httpx
+from click.testing import CliRunner
+
+from trustshell.api import api
+from trustshell.client import TrustifyClient
+
+ITEMS = [{"purl": f"pkg:rpm/redhat/lib{i}", "uuid": str(i)} for i in range(5)]
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/missing"):
+        return httpx.Response(404, text="not found")
+    offset = int(request.url.params.get("offset", 0))
+    limit = int(request.url.params.get("limit", len(ITEMS)))
+    return httpx.Response(
+        200, json={"items": ITEMS[offset : offset + limit], "total": len(ITEMS)}
+    )
+
+
+def _invoke(args: list[str]):
+    client = TrustifyClient(
+        base_url="https://trustify.example.com/api/v2/",
+        auth_enabled=False,
+        transport=httpx.MockTransport(_handler),
+    )
+    with patch("trustshell.client.get_client", return_value=client):
+        return CliRunner().invoke(api, args)
+
+
+def test_raw_output():
+    result = _invoke(["purl/base", "--raw"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout_bytes) == {"items": ITEMS, "total": 5}
+
+
+def test_raw_output_to_file(tmp_path):
+    output = tmp_path / "response.json"
+    result = _invoke(["purl/base", "-o", str(output)])
+    assert result.exit_code == 0
+    assert json.loads(output.read_bytes())["total"] == 5
+
+
+def test_select():
+    result = _invoke(["purl/base", "--select", "items.purl"])
+    assert result.stdout.splitlines() == [json.dumps(item["purl"]) for item in ITEMS]
+
+
+def test_all_pages():
+    result = _invoke(["purl/base", "--all-pages", "q=lib", "limit=2"])
+    assert [json.loads(line) for line in result.stdout.splitlines()] == ITEMS
+    result = _invoke(["purl/base", "-a", "-S", "items.uuid", "limit=2"])
+    assert result.stdout.splitlines() == [json.dumps(item["uuid"]) for item in ITEMS]
+
+
+def test_all_pages_from_offset():
+    result = _invoke(["purl/base", "--all-pages", "limit=2", "offset=3"])
+    assert [json.loads(line) for line in result.stdout.splitlines()] == ITEMS[3:]
+
+
+def test_all_pages_invalid_limit():
+    for param in ("limit=ten", "limit=0", "limit=-1"):
+        result = _invoke(["purl/base", "--all-pages", param])
+        assert result.exit_code == 2
+        assert "The limit parameter must be a positive integer." in result.output
+    result = _invoke(["purl/base", "--all-pages", "offset=-1"])
+    assert result.exit_code == 2
+    assert "The offset parameter must be a non-negative integer." in result.output
+
+
+def test_streamed_http_error():
+    result = _invoke(["purl/base/missing", "--raw"])
+    assert "HTTP error 404: not found" in result.stdout
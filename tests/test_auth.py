@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+import jwt
+
+from trustshell.auth import TokenBroker, token_expiry
+
+KEY = "a-signing-key-which-is-long-enough-for-hs256"
+
+
+def _token(expires_in: float, subject: str = "user") -> str:
+    return jwt.encode(
+        {"sub": subject, "exp": int(time.time() + expires_in)},
+        KEY,
+        algorithm="HS256",
+    )
+
+
+class _Fetcher:
+    def __init__(self, tokens: list[str], delay: float = 0):
+        self.tokens = tokens
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.tokens.pop(0)
+
+
+def test_token_expiry():
+    token = _token(600)
+    assert token_expiry(token) == jwt.decode(token, KEY, algorithms=["HS256"])["exp"]
+    assert token_expiry(_token(-600)) is not None
+    assert token_expiry("not a jwt") is None
+
+
+def test_token_is_cached(tmp_path):
+    token_file = str(tmp_path / "config" / "access_token.jwt")
+    token = _token(600)
+    fetch = _Fetcher([token])
+    broker = TokenBroker(token_file, fetch)
+    assert broker.get_token() == token
+    # The token file isn't read again while the token is cached
+    os.remove(token_file)
+    assert broker.get_token() == token
+    assert fetch.calls == 1
+
+
+def test_token_file_is_written_atomically(tmp_path):
+    token_file = tmp_path / "access_token.jwt"
+    token = _token(600)
+    TokenBroker(str(token_file), _Fetcher([token])).get_token()
+    assert token_file.read_text() == token
+    assert token_file.stat().st_mode & 0o777 == 0o600
+    assert os.listdir(tmp_path) == ["access_token.jwt"]
+
+
+def test_token_from_file(tmp_path):
+    token_file = tmp_path / "access_token.jwt"
+    token = _token(600)
+    token_file.write_text(token)
+    fetch = _Fetcher([])
+    assert TokenBroker(str(token_file), fetch).get_token() == token
+    assert fetch.calls == 0
+
+
+def test_token_refreshed_before_expiry(tmp_path):
+    token_file = tmp_path / "access_token.jwt"
+    # Valid, but within the refresh margin
+    token_file.write_text(_token(30))
+    new_token = _token(600, "new")
+    fetch = _Fetcher([new_token])
+    broker = TokenBroker(str(token_file), fetch, refresh_margin=60)
+    assert broker.get_token() == new_token
+    assert token_file.read_text() == new_token
+
+
+def test_short_lived_token_is_used(tmp_path):
+    token = _token(40)
+    fetch = _Fetcher([token])
+    broker = TokenBroker(str(tmp_path / "access_token.jwt"), fetch, refresh_margin=60)
+    assert broker.get_token() == token
+    assert broker.get_token() == token
+    assert fetch.calls == 1
+
+
+def test_refresh_is_single_flight(tmp_path):
+    token = _token(600)
+    fetch = _Fetcher([token], delay=0.1)
+    broker = TokenBroker(str(tmp_path / "access_token.jwt"), fetch)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(broker.get_token()))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [token] * 8
+    assert fetch.calls == 1
+
+
+def test_invalidated_token_is_replaced(tmp_path):
+    old_token, new_token = _token(600, "old"), _token(600, "new")
+    fetch = _Fetcher([old_token, new_token])
+    broker = TokenBroker(str(tmp_path / "access_token.jwt"), fetch)
+    assert broker.get_token() == old_token
+    broker.invalidate(old_token)
+    # The rejected token isn't read back from the token file
+    assert broker.get_token() == new_token
+    # Invalidating an older token doesn't drop the new one
+    broker.invalidate(old_token)
+    assert broker.get_token() == new_token
+    assert fetch.calls == 2
+
+
+def test_failed_fetch(tmp_path):
+    broker = TokenBroker(str(tmp_path / "access_token.jwt"), _Fetcher([""]))
+    assert broker.get_token() == ""
+    assert not os.path.exists(tmp_path / "access_token.jwt")
+
+
+def test_cached_token(tmp_path):
+    token = _token(600)
+    fetch = _Fetcher([token])
+    broker = TokenBroker(str(tmp_path / "access_token.jwt"), fetch)
+    # Nothing is fetched until get_token is called
+    assert broker.cached_token() == ""
+    assert fetch.calls == 0
+    assert broker.get_token() == token
+    assert broker.cached_token() == token
+    broker.invalidate(token)
+    assert broker.cached_token() == ""
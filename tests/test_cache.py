@@ -0,0 +1,120 @@
+import contextlib
+import os
+import threading
+import time
+
+import httpx
+
+from trustshell.cache import ResponseCache
+from trustshell.client import TrustifyClient
+
+BASE_URL = "https://trustify.example.com/api/v2/"
+COMPONENT_URL = f"{BASE_URL}analysis/latest/component?q=purl~pkg%3Arpm%2Fopenssl@"
+
+
+def _trustify(status: dict, requests: list[str]) -> TrustifyClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        if request.url.path.endswith("analysis/status"):
+            return httpx.Response(200, json=status)
+        return httpx.Response(200, content=b'{"items": [], "total": 0}')
+
+    return TrustifyClient(
+        base_url=BASE_URL, auth_enabled=False, transport=httpx.MockTransport(handler)
+    )
+
+
+def test_fetch_uses_cache(tmp_path):
+    requests: list[str] = []
+    client = _trustify({"sbom_count": 1, "graph_count": 1}, requests)
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    assert cache.fetch(client, COMPONENT_URL) == b'{"items": [], "total": 0}'
+    assert cache.fetch(client, COMPONENT_URL) == b'{"items": [], "total": 0}'
+    # One status lookup and one component lookup
+    assert len(requests) == 2
+
+
+def test_fetch_refresh_bypasses_cache(tmp_path):
+    requests: list[str] = []
+    client = _trustify({"sbom_count": 1, "graph_count": 1}, requests)
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.fetch(client, COMPONENT_URL)
+    cache.fetch(client, COMPONENT_URL, refresh=True)
+    assert len(requests) == 3
+
+
+def test_new_sboms_invalidate_cache(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put(COMPONENT_URL, b"{}", [1, 1])
+    assert cache.get(COMPONENT_URL, [1, 1]) == b"{}"
+    assert cache.get(COMPONENT_URL, [2, 1]) is None
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl=0)
+    cache.put(COMPONENT_URL, b"{}", [1, 1])
+    time.sleep(0.01)
+    assert cache.get(COMPONENT_URL, [1, 1]) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), max_bytes=1000)
+    body = b"x" * 400
+    cache.put("first", body, [1, 1])
+    cache.put("second", body, [1, 1])
+    # Make 'first' the most recently used entry
+    past = time.time() - 60
+    os.utime(cache._path(cache.key("second")), (past, past))
+    cache.get("first", [1, 1])
+    cache.put("third", body, [1, 1])
+    assert cache.get("first", [1, 1]) == body
+    assert cache.get("second", [1, 1]) is None
+    assert cache.get("third", [1, 1]) == body
+
+
+def test_concurrent_evicts(tmp_path, monkeypatch):
+    cache = ResponseCache(cache_dir=str(tmp_path), max_bytes=10000)
+    for i in range(10):
+        cache.put(f"entry-{i}", b"x" * 400, [1, 1])
+    cache.max_bytes = 1000
+    other = ResponseCache(cache_dir=str(tmp_path), max_bytes=1000)
+    scandir = os.scandir
+    calls = []
+
+    def scandir_then_evict(path):
+        # Another evict removes entries after they're listed, before they're looked at
+        with scandir(path) as it:
+            entries = list(it)
+        if not calls:
+            calls.append(path)
+            thread = threading.Thread(target=other.evict)
+            thread.start()
+            thread.join()
+        return contextlib.nullcontext(entries)
+
+    monkeypatch.setattr(os, "scandir", scandir_then_evict)
+    cache.evict()
+    assert calls
+    sizes = [os.path.getsize(entry.path) for entry in scandir(tmp_path)]
+    assert len(sizes) == 2
+    assert sum(sizes) <= 1000
+
+
+def test_clear_while_entries_are_removed(tmp_path, monkeypatch):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    for i in range(3):
+        cache.put(f"entry-{i}", b"x" * 400, [1, 1])
+    other = ResponseCache(cache_dir=str(tmp_path))
+    scandir = os.scandir
+
+    def scandir_then_clear(path):
+        # Another clear removes the entries after they're listed, before they're removed
+        with scandir(path) as it:
+            entries = list(it)
+        monkeypatch.setattr(os, "scandir", scandir)
+        other.clear()
+        return contextlib.nullcontext(entries)
+
+    monkeypatch.setattr(os, "scandir", scandir_then_clear)
+    cache.clear()
+    assert not list(scandir(tmp_path))
@@ -0,0 +1,214 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from trustshell.client import AuthenticationError, TrustifyClient
+
+BASE_URL = "https://trustify.example.com/api/v2/"
+
+
+def _echo_transport(requests: list[httpx.Request]) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={})
+
+    return httpx.MockTransport(handler)
+
+
+def test_relative_endpoint_url():
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False)
+    assert client.url("analysis/status") == f"{BASE_URL}analysis/status"
+    assert client.url("/purl/base") == f"{BASE_URL}purl/base"
+    assert client.url("https://other.example.com/x") == "https://other.example.com/x"
+
+
+def test_endpoint_timeouts():
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False)
+    assert client.timeout(f"{BASE_URL}analysis/status").read == 30.0
+    assert client.timeout(f"{BASE_URL}analysis/latest/component?q=x").read == 300.0
+    assert client.timeout("purl/base/pkg%3Arpm").read == 60.0
+    assert client.timeout("https://other.example.com/products.json").read == 300.0
+
+
+@patch("trustshell.client.get_token_broker")
+def test_auth_header_only_sent_to_trustify(mock_broker):
+    mock_broker.return_value.get_token.return_value = "token"
+    requests: list[httpx.Request] = []
+    client = TrustifyClient(
+        base_url=BASE_URL, auth_enabled=True, transport=_echo_transport(requests)
+    )
+    client.get("analysis/status")
+    client.get("purl/base")
+    client.head("https://proddefs.example.com/products.json")
+    assert requests[0].headers["Authorization"] == "Bearer token"
+    assert requests[1].headers["Authorization"] == "Bearer token"
+    assert "Authorization" not in requests[2].headers
+    # The token is looked up for each request, the broker caches it
+    assert mock_broker.return_value.get_token.call_count == 2
+
+
+@patch("trustshell.client.get_token_broker")
+def test_rejected_token_is_refreshed(mock_broker):
+    mock_broker.return_value.get_token.side_effect = ["old", "new"]
+    tokens: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        tokens.append(request.headers["Authorization"])
+        if request.headers["Authorization"] == "Bearer old":
+            return httpx.Response(401)
+        return httpx.Response(200, json={})
+
+    client = TrustifyClient(
+        base_url=BASE_URL, auth_enabled=True, transport=httpx.MockTransport(handler)
+    )
+    assert client.get("analysis/status").status_code == 200
+    assert tokens == ["Bearer old", "Bearer new"]
+    mock_broker.return_value.invalidate.assert_called_once_with("old")
+
+
+@patch("trustshell.client.get_token_broker")
+def test_missing_token_raises_instead_of_exiting(mock_broker):
+    # Requests are sent from worker threads, where exiting wouldn't stop the CLI
+    mock_broker.return_value.get_token.return_value = ""
+    requests: list[httpx.Request] = []
+    client = TrustifyClient(
+        base_url=BASE_URL, auth_enabled=True, transport=_echo_transport(requests)
+    )
+    with pytest.raises(AuthenticationError):
+        client.get("analysis/status")
+    assert not requests
+
+
+@patch("trustshell.client.get_token_broker")
+def test_async_auth_uses_cached_token_and_refreshes_in_thread(mock_broker):
+    broker = mock_broker.return_value
+    broker.cached_token.side_effect = ["", "cached"]
+    loop_thread = threading.get_ident()
+    refresh_threads: list[int] = []
+
+    def get_token() -> str:
+        refresh_threads.append(threading.get_ident())
+        return "fetched"
+
+    broker.get_token.side_effect = get_token
+    requests: list[httpx.Request] = []
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=True)
+
+    async def main() -> None:
+        async with httpx.AsyncClient(
+            auth=client.auth, transport=_echo_transport(requests)
+        ) as async_client:
+            await async_client.get(client.url("analysis/status"))
+            await async_client.get(client.url("purl/base"))
+
+    asyncio.run(main())
+    assert [r.headers["Authorization"] for r in requests] == [
+        "Bearer fetched",
+        "Bearer cached",
+    ]
+    # Only the refresh, which may block, left the event loop
+    assert len(refresh_threads) == 1
+    assert refresh_threads[0] != loop_thread
+
+
+@patch("trustshell.client.check_or_get_access_token", return_value="token")
+def test_authenticate(mock_token):
+    TrustifyClient(base_url=BASE_URL, auth_enabled=False).authenticate()
+    mock_token.assert_not_called()
+    TrustifyClient(base_url=BASE_URL, auth_enabled=True).authenticate()
+    mock_token.assert_called_once()
+
+
+def test_client_is_reused():
+    requests: list[httpx.Request] = []
+    client = TrustifyClient(
+        base_url=BASE_URL, auth_enabled=False, transport=_echo_transport(requests)
+    )
+    http_client = client.client
+    client.get("analysis/status")
+    client.get("analysis/status")
+    assert client.client is http_client
+    client.close()
+    assert client.client is not http_client
+
+
+def _paged_transport(
+    items: list[str], requests: list[dict], max_limit: int = 1000, total: bool = True
+) -> httpx.MockTransport:
+    """Serve items from a limit/offset paginated endpoint, recording the pages requested"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset = int(request.url.params["offset"])
+        limit = min(int(request.url.params["limit"]), max_limit)
+        requests.append({"offset": offset, "limit": limit})
+        body = {"items": [{"purl": item} for item in items[offset : offset + limit]]}
+        if total:
+            body["total"] = len(items)
+        return httpx.Response(200, json=body)
+
+    return httpx.MockTransport(handler)
+
+
+def _paged_client(transport: httpx.MockTransport) -> TrustifyClient:
+    return TrustifyClient(base_url=BASE_URL, auth_enabled=False, transport=transport)
+
+
+def test_paginate_fetches_all_pages_in_order():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(25)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests))
+    pages = list(client.paginate("purl/base", params={"q": "lib"}, page_size=10))
+    assert [item["purl"] for page in pages for item in page["items"]] == items
+    assert sorted(r["offset"] for r in requests) == [0, 10, 20]
+    # The last page only asks for the remaining items
+    assert {"offset": 20, "limit": 5} in requests
+
+
+def test_paginate_max_results():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(25)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests))
+    pages = list(client.paginate("purl/base", page_size=10, max_results=12))
+    assert [item["purl"] for page in pages for item in page["items"]] == items[:12]
+    assert sorted(r["offset"] for r in requests) == [0, 10]
+
+
+def test_paginate_server_page_limit():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(25)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests, max_limit=8))
+    pages = list(client.paginate("purl/base", page_size=10))
+    assert [item["purl"] for page in pages for item in page["items"]] == items
+
+
+def test_paginate_from_offset():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(25)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests))
+    pages = list(client.paginate("purl/base", page_size=10, offset=7))
+    assert [item["purl"] for page in pages for item in page["items"]] == items[7:]
+    assert sorted(r["offset"] for r in requests) == [7, 17]
+    assert {"offset": 17, "limit": 8} in requests
+
+
+def test_paginate_without_total():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(20)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests, total=False))
+    pages = list(client.paginate("purl/base", page_size=10))
+    assert [item["purl"] for page in pages for item in page["items"]] == items
+    assert [r["offset"] for r in requests] == [0, 10, 20]
+
+
+def test_paginate_stops_when_closed():
+    items = [f"pkg:rpm/redhat/lib{i}" for i in range(1000)]
+    requests: list[dict] = []
+    client = _paged_client(_paged_transport(items, requests))
+    pages = client.paginate("purl/base", page_size=10, concurrency=2)
+    assert len(next(pages)["items"]) == 10
+    pages.close()
+    # Only the first page and the pages already in flight were fetched
+    assert len(requests) <= 3
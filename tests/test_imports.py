@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+# Commands are run many times from wrapper scripts, so importing them must stay quick
+COMMAND_MODULES = [
+    "trustshell.products",
+    "trustshell.purl",
+    "trustshell.api",
+    "trustshell.triage",
+]
+# Modules which are slow to import and only needed once a command does some work
+DEFERRED_MODULES = [
+    "httpx",
+    "jwt",
+    "univers",
+    "osidb_bindings",
+    "requests",
+    "webbrowser",
+    "http.server",
+    "asyncio",
+    "trustshell.oidc.oidc_pkce_authcode",
+]
+# A coarse budget for the cumulative import time of the command modules, in seconds
+IMPORT_TIME_BUDGET = 1.0
+
+
+def _import_times(tmp_path) -> dict[str, int]:
+    """Import the command modules in a new interpreter, returns the cumulative import time in
+    microseconds of each module imported"""
+    env = dict(os.environ, HOME=str(tmp_path))
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {', '.join(COMMAND_MODULES)}",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_command_imports_are_deferred(tmp_path):
+    times = _import_times(tmp_path)
+    for module in COMMAND_MODULES:
+        assert module in times
+    imported = [
+        module
+        for module in times
+        for deferred in DEFERRED_MODULES
+        if module == deferred or module.startswith(f"{deferred}.")
+    ]
+    assert imported == []
+    total = sum(times[module] for module in COMMAND_MODULES) / 1e6
+    assert total < IMPORT_TIME_BUDGET
+
+
+def test_import_has_no_side_effects(tmp_path):
+    _import_times(tmp_path)
+    assert not os.path.exists(tmp_path / ".config" / "trustshell")
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from trustshell.json_stream import (
+    iter_json_tokens,
+    project,
+    read_value,
+    select_values,
+    skip_value,
+)
+
+
+def _chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_tokens():
+    data = b'{"a": [1, -2.5e3, true, null], "b": "x"}'
+    assert list(iter_json_tokens([data])) == [
+        ("{", None),
+        ("s", "a"),
+        ("[", None),
+        ("v", 1),
+        ("v", -2500.0),
+        ("v", True),
+        ("v", None),
+        ("]", None),
+        ("s", "b"),
+        ("s", "x"),
+        ("}", None),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5])
+def test_tokens_split_across_chunks(size):
+    document = {"name": 'quoted "é" \\ ☃', "values": [12345, 0.5, False]}
+    data = json.dumps(document, ensure_ascii=False).encode("utf-8")
+    tokens = iter_json_tokens(_chunked(data, size))
+    assert read_value(next(tokens), tokens) == document
+
+
+def test_skip_value():
+    tokens = iter_json_tokens([b'[{"a": [1, {"b": 2}]}, "next"]'])
+    assert next(tokens) == ("[", None)
+    skip_value(next(tokens), tokens)
+    assert next(tokens) == ("s", "next")
+
+
+def test_invalid_json():
+    with pytest.raises(ValueError):
+        list(iter_json_tokens([b'{"a": "unterminated']))
+
+
+SELECT_DATA = {
+    "items": [
+        {"purl": ["pkg:rpm/redhat/a", "pkg:rpm/redhat/b"], "name": "a"},
+        {"purl": [], "name": "b", "ancestors": [{"name": "c"}]},
+        {"name": "d"},
+    ],
+    "total": 3,
+}
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        (["total"], [3]),
+        (["items", "name"], ["a", "b", "d"]),
+        (["items", "purl"], ["pkg:rpm/redhat/a", "pkg:rpm/redhat/b"]),
+        (["items", "ancestors", "name"], ["c"]),
+        (["items", "missing"], []),
+        (["total", "missing"], []),
+    ],
+)
+def test_select_values(path, expected):
+    tokens = iter_json_tokens(_chunked(json.dumps(SELECT_DATA).encode(), 7))
+    assert list(select_values(path, next(tokens), tokens)) == expected
+    assert list(project(SELECT_DATA, path)) == expected
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import httpx
+import jwt
+import pytest
+
+OIDC_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "trustshell", "oidc")
+KEY = "a-signing-key-which-is-long-enough-for-hs256"
+
+
+class _TokenEndpoint(BaseHTTPRequestHandler):
+    """A stand-in SSO token endpoint, which is slow to respond like a real one"""
+
+    calls = 0
+    delay = 0.1
+    expires_in = 600
+    fail = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            body = json.dumps({"error": "invalid_grant"}).encode()
+        else:
+            access_token = jwt.encode(
+                {"sub": "user", "exp": int(time.time() + self.expires_in)},
+                KEY,
+                algorithm="HS256",
+            )
+            body = json.dumps(
+                {"access_token": access_token, "refresh_token": f"r{self.calls}"}
+            ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(server):
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def oidc_server(monkeypatch):
+    monkeypatch.syspath_prepend(OIDC_DIR)
+    import oidc_pkce_authcode
+    import oidc_pkce_server
+
+    monkeypatch.setattr(_TokenEndpoint, "calls", 0)
+    token_endpoint = HTTPServer(("127.0.0.1", 0), _TokenEndpoint)
+    monkeypatch.setattr(
+        oidc_pkce_authcode, "token_endpoint", f"{_serve(token_endpoint)}/token"
+    )
+    monkeypatch.setattr(oidc_pkce_server.Handler, "log_message", lambda *args: None)
+    server = oidc_pkce_server.CustomHTTPServer(
+        ("127.0.0.1", 0), oidc_pkce_server.Handler
+    )
+    url = _serve(server)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+    token_endpoint.shutdown()
+    token_endpoint.server_close()
+
+
+def test_challenge_without_refresh_token(oidc_server):
+    server, url = oidc_server
+    response = httpx.get(f"{url}/index.html").json()
+    assert response["code_challenge"] == server.code_challenge
+    assert response["state"] == server.state
+
+
+def test_access_token_is_cached(oidc_server):
+    server, url = oidc_server
+    server.token_cache.refresh_token = "r0"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(
+            executor.map(lambda _: httpx.get(f"{url}/index.html").json(), range(8))
+        )
+    tokens = {response["access_token"] for response in responses}
+    # Concurrent requests share one refresh
+    assert len(tokens) == 1
+    assert _TokenEndpoint.calls == 1
+    assert httpx.get(f"{url}/index.html").json()["access_token"] in tokens
+
+    stats = httpx.get(f"{url}/stats").json()
+    assert stats["hits"] == 8
+    assert stats["misses"] == 1
+    assert stats["refresh_ms_max"] >= 100
+    assert server.token_cache.refresh_token == "r1"
+
+
+def test_expiring_access_token_is_refreshed(oidc_server, monkeypatch):
+    server, url = oidc_server
+    monkeypatch.setattr(_TokenEndpoint, "expires_in", 30)
+    server.token_cache.refresh_token = "r0"
+    httpx.get(f"{url}/index.html")
+    httpx.get(f"{url}/index.html")
+    # Tokens which expire within the refresh margin aren't cached
+    assert _TokenEndpoint.calls == 2
+
+
+def test_failed_refresh(oidc_server, monkeypatch):
+    server, url = oidc_server
+    monkeypatch.setattr(_TokenEndpoint, "fail", True)
+    server.token_cache.refresh_token = "r0"
+    response = httpx.get(f"{url}/index.html")
+    assert response.status_code == 502
+    assert httpx.get(f"{url}/stats").json()["errors"] == 1
@@ -1,6 +1,11 @@
+import threading
 import unittest
+from types import SimpleNamespace
 
+import click
 import pytest
+import requests
+from requests import HTTPError
 
 from trustshell.osidb import OSIDB
 
@@ -25,3 +30,173 @@ class TestOSIDB(unittest.TestCase):
         input_list = ["ps_module1,"]
         with pytest.raises(SystemExit):
             OSIDB.parse_module_purl_tuples(input_list)
+
+
+def _http_error(status_code: int, text: str) -> HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode()
+    return HTTPError(f"{status_code} Error", response=response)
+
+
+class _StubAffects:
+    """Stands in for the affects endpoints of an OSIDB session"""
+
+    def __init__(self, failures=None):
+        # Errors to raise, by purl, the first time a chunk containing it is created
+        self.failures = dict(failures or {})
+        self.created = []
+        self.deleted = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def bulk_create(self, form_data):
+        with self.lock:
+            self.calls += 1
+            for affect in form_data:
+                if affect["purl"] in self.failures:
+                    raise self.failures.pop(affect["purl"])
+            self.created.extend(form_data)
+        return SimpleNamespace(results=form_data)
+
+    def delete(self, id):
+        with self.lock:
+            self.deleted.append(id)
+
+
+def _affect(ps_module, purl, uuid, affectedness="NEW"):
+    return SimpleNamespace(
+        ps_module=ps_module, purl=purl, uuid=uuid, affectedness=affectedness
+    )
+
+
+FLAW = SimpleNamespace(uuid="flaw-uuid", embargoed=False, affects=[])
+
+
+def _osidb(affects: _StubAffects, flaw=FLAW) -> OSIDB:
+    session = SimpleNamespace(
+        affects=affects,
+        flaws=SimpleNamespace(retrieve=lambda id: flaw),
+    )
+    return OSIDB(session=session, chunk_size=10, workers=3, retry_delay=0)
+
+
+def test_add_affects_in_chunks():
+    affects = _StubAffects()
+    new_affects = {("module", f"pkg:npm/a{i}") for i in range(25)}
+    _osidb(affects).add_affects(FLAW, new_affects)
+    assert affects.calls == 3
+    assert {(a["ps_module"], a["purl"]) for a in affects.created} == new_affects
+
+
+def test_add_affects_retries_chunk():
+    affects = _StubAffects({"pkg:npm/a3": _http_error(503, "busy")})
+    new_affects = {("module", f"pkg:npm/a{i}") for i in range(25)}
+    _osidb(affects).add_affects(FLAW, new_affects)
+    assert affects.calls == 4
+    assert len(affects.created) == 25
+
+
+def test_add_affects_reports_failed_chunk():
+    affects = _StubAffects({"pkg:npm/a3": _http_error(400, "bad purl")})
+    new_affects = {("module", f"pkg:npm/a{i}") for i in range(25)}
+    with pytest.raises(SystemExit):
+        _osidb(affects).add_affects(FLAW, new_affects)
+    # Client errors aren't retried, the other chunks are still added
+    assert affects.calls == 3
+    assert len(affects.created) == 15
+
+
+def test_replace_affects(monkeypatch):
+    # Decline editing, confirm the replacement
+    monkeypatch.setattr(click, "confirm", lambda text, abort=False: abort)
+    flaw = SimpleNamespace(
+        uuid="flaw-uuid",
+        embargoed=False,
+        affects=[_affect("module", f"pkg:npm/old{i}", f"old{i}") for i in range(30)]
+        + [
+            _affect("module", "pkg:npm/kept", "kept"),
+            _affect("module", "pkg:npm/fixed", "fixed", affectedness="AFFECTED"),
+        ],
+    )
+    affects = _StubAffects()
+    new_affects = {("module", "pkg:npm/kept"), ("module", "pkg:npm/new")}
+    _osidb(affects, flaw).edit_flaw_affects("CVE-2025-0001", new_affects, True)
+    assert sorted(affects.deleted) == sorted(f"old{i}" for i in range(30))
+    assert [a["purl"] for a in affects.created] == ["pkg:npm/new"]
+
+
+def test_plan_affects_replace_only_adds_missing_new_affects():
+    flaw = SimpleNamespace(
+        affects=[
+            _affect("module", "pkg:npm/kept", "kept"),
+            _affect("module", "pkg:npm/fixed", "fixed", affectedness="AFFECTED"),
+            _affect("module", "pkg:npm/old", "old"),
+        ]
+    )
+    new_affects = {
+        ("module", "pkg:npm/kept"),
+        ("module", "pkg:npm/fixed"),
+        ("module", "pkg:npm/new"),
+    }
+    to_add, to_delete = OSIDB.plan_affects(flaw, new_affects, replace_mode=True)
+    # NEW affects which are kept aren't deleted and added again
+    assert to_add == {("module", "pkg:npm/fixed"), ("module", "pkg:npm/new")}
+    assert to_delete == {("module", "pkg:npm/old"): "old"}
+
+
+class _CommitThenFailAffects(_StubAffects):
+    """Creates the first chunk it's sent, then fails as if the response was lost"""
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    def bulk_create(self, form_data):
+        with self.lock:
+            self.calls += 1
+            self.created.extend(form_data)
+            if self.error:
+                error, self.error = self.error, None
+                raise error
+        return SimpleNamespace(results=form_data)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [requests.exceptions.ReadTimeout("timed out"), _http_error(500, "oops")],
+)
+def test_add_affects_retry_does_not_duplicate(error):
+    affects = _CommitThenFailAffects(error)
+    flaw = SimpleNamespace(uuid="flaw-uuid", embargoed=False, affects=[])
+
+    osidb = _osidb_with_created(affects)
+    new_affects = {("module", f"pkg:npm/a{i}") for i in range(5)}
+    osidb.add_affects(flaw, new_affects)
+    assert len(affects.created) == 5
+    assert affects.calls == 1
+
+
+def _osidb_with_created(affects: _StubAffects, existing=()) -> OSIDB:
+    def retrieve(id):
+        # The flaw as OSIDB sees it, with the affects created so far
+        return SimpleNamespace(
+            uuid=id,
+            affects=list(existing)
+            + [_affect(a["ps_module"], a["purl"], a["purl"]) for a in affects.created],
+        )
+
+    session = SimpleNamespace(affects=affects, flaws=SimpleNamespace(retrieve=retrieve))
+    return OSIDB(session=session, chunk_size=10, workers=1, retry_delay=0)
+
+
+def test_add_affects_retry_creates_affects_which_existed_before():
+    # The flaw already has the affect in another state, and the create fails without OSIDB
+    # acting on it, so it still has to be created
+    existing = [_affect("module", "pkg:npm/a0", "fixed", affectedness="AFFECTED")]
+    affects = _StubAffects({"pkg:npm/a0": _http_error(500, "oops")})
+    flaw = SimpleNamespace(uuid="flaw-uuid", embargoed=False, affects=existing)
+    new_affects = {("module", f"pkg:npm/a{i}") for i in range(5)}
+    _osidb_with_created(affects, existing).add_affects(flaw, new_affects)
+    assert {(a["ps_module"], a["purl"]) for a in affects.created} == new_affects
+    assert affects.calls == 2
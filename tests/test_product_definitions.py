@@ -1,9 +1,17 @@
 import json
+import os
+import tempfile
 import unittest
 from anytree import Node
 from unittest.mock import patch
 from test_products import _check_node_names_at_depth
-from trustshell.product_definitions import ProdDefs, ProductStream
+from trustshell.product_definitions import (
+    CPEMatcher,
+    ProdDefs,
+    ProductModule,
+    ProductStream,
+    _split_literal_prefix,
+)
 from trustshell.products import _render_tree
 
 
@@ -195,3 +203,192 @@ class TestProdDefs(unittest.TestCase):
         _check_node_names_at_depth(second_root, 3, ["quay-3"])
         _check_node_names_at_depth(third_root, 2, ["quay-3.13"])
         _check_node_names_at_depth(third_root, 3, ["quay-3"])
+
+    def test_split_literal_prefix(self):
+        assert _split_literal_prefix("cpe:/a:redhat:rhel_eus:9\\.2") == (
+            "cpe:/a:redhat:rhel_eus:9.2",
+            "",
+        )
+        assert _split_literal_prefix("cpe:/a:redhat:.*:9") == ("cpe:/a:redhat:", ".*:9")
+        assert _split_literal_prefix("cpe:/a:redhat:quay?") == (
+            "cpe:/a:redhat:qua",
+            "y?",
+        )
+        assert _split_literal_prefix("cpe:/a|cpe:/o") == ("", "cpe:/a|cpe:/o")
+
+    def test_cpe_matcher_same_as_module_match(self):
+        modules = [
+            ProductModule("rhel-9", ["cpe:/o:redhat:enterprise_linux:9"]),
+            ProductModule("rhel-10", ["cpe:/o:redhat:enterprise_linux:10"]),
+            ProductModule("openshift", ["cpe:/a:redhat:openshift:4.*::el9"]),
+            ProductModule("any", ["cpe:/*:redhat:quay:3", "cpe:/a:redhat:quay"]),
+        ]
+        matcher = CPEMatcher()
+        for module in modules:
+            matcher.add(module, module.cpe_patterns)
+        cpes = [
+            "cpe:/o:redhat:enterprise_linux:9",
+            "cpe:/o:redhat:enterprise_linux:10",
+            "cpe:/o:redhat:enterprise_linux:1",
+            "cpe:/a:redhat:openshift:4.16::el9",
+            "cpe:/a:redhat:openshift:4.16::el8",
+            "cpe:/o:redhat:quay:3.13",
+            "cpe:/a:redhat:quay",
+            "",
+        ]
+        # A matcher loaded from the plain data of its trie matches the same way
+        loaded = CPEMatcher.from_trie(modules, json.loads(json.dumps(matcher.trie())))
+        for cpe in cpes:
+            expected = [module for module in modules if module.match(cpe)]
+            assert matcher.match(cpe) == expected, cpe
+            assert loaded.match(cpe) == expected, cpe
+
+    @patch("trustshell.product_definitions.ProdDefs.get_product_definitions_service")
+    def test_match_module_pattern(self, mock_service):
+        mock_service.return_value = self.mock_proddefs_data
+        prod_defs = ProdDefs()
+        result = prod_defs.match_module_pattern("cpe:/a:redhat:quay:3")
+        assert [(m.name, m.parent.name) for m in result] == [
+            ("quay-3", "quay-3.12"),
+            ("quay-3", "quay-3.13"),
+        ]
+        assert prod_defs.match_module_pattern("cpe:/a:redhat:ansible:2") == []
+
+    @patch("trustshell.product_definitions.ProdDefs.get_product_definitions_service")
+    def test_extend_with_product_mappings_keeps_prod_defs(self, mock_service):
+        """Test that mapping the same module for several components gives each of them their
+        own products, and doesn't modify the product definitions"""
+        mock_service.return_value = self.mock_proddefs_data
+        prod_defs = ProdDefs()
+        test_trees = []
+        for component in ("oci:quay@123", "oci:quay@345"):
+            component_node = Node(component)
+            Node("cpe:/a:redhat:quay:3", parent=component_node)
+            test_trees.append(component_node)
+        result = prod_defs.extend_with_product_mappings(test_trees)
+        assert len(result) == 4
+        assert [r.root.name for r in result] == [
+            "oci:quay@123",
+            "oci:quay@123",
+            "oci:quay@345",
+            "oci:quay@345",
+        ]
+        for r in result:
+            assert len(r.children) == 1
+            _check_node_names_at_depth(r.root, 3, ["quay-3"])
+        for stream in prod_defs.product_trees:
+            assert stream.parent is None
+
+    def test_prod_defs_index(self):
+        """Test that the index built from the product definitions is used until the etag of the
+        product definitions changes"""
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            patch.dict(
+                os.environ, {"PRODDEFS_URL": "https://example.com/products.json"}
+            ),
+            patch.object(
+                ProdDefs, "INDEX_FILE", os.path.join(tmp_dir, "products-{}.index")
+            ),
+            patch.object(ProdDefs, "get_etag", return_value="etag-1"),
+            patch.object(ProdDefs, "get_product_definitions_service") as mock_service,
+        ):
+            mock_service.return_value = self.mock_proddefs_data
+            built = ProdDefs()
+            assert mock_service.call_count == 1
+            assert os.path.exists(os.path.join(tmp_dir, "products-active.index"))
+
+            loaded = ProdDefs()
+            assert mock_service.call_count == 1
+            assert [t.name for t in loaded.product_trees] == [
+                t.name for t in built.product_trees
+            ]
+            assert loaded.stream_nodes_by_cpe.keys() == built.stream_nodes_by_cpe.keys()
+            assert [
+                m.parent.name
+                for m in loaded.match_module_pattern("cpe:/a:redhat:quay:3")
+            ] == ["quay-3.12", "quay-3.13"]
+            assert _index_snapshot(loaded) == _index_snapshot(built)
+            # The index is plain JSON, nothing in it is executed when it's loaded
+            with open(os.path.join(tmp_dir, "products-active.index")) as f:
+                assert json.loads(f.readline()) == {
+                    "version": ProdDefs.INDEX_VERSION,
+                    "etag": "etag-1",
+                }
+                json.loads(f.readline())
+
+            # The index for all streams is separate
+            ProdDefs(active_only=False)
+            assert mock_service.call_count == 2
+
+            ProdDefs.get_etag.return_value = "etag-2"
+            ProdDefs()
+            assert mock_service.call_count == 3
+
+    def test_prod_defs_unreadable_index_is_rebuilt(self):
+        """Test that an index which can't be loaded, eg. one pickled by an older version, is
+        rebuilt from the product definitions"""
+        index_file_contents = [
+            b"\x80\x05\x95\x00\x00",
+            b"not json",
+            json.dumps({"version": ProdDefs.INDEX_VERSION, "etag": "etag-1"}).encode()
+            + b"\n"
+            + json.dumps(
+                {
+                    "streams": [["quay-3.12", [], True]],
+                    "modules": [],
+                    "product_trees": [0],
+                    "stream_nodes_by_cpe": {"cpe:/a:redhat:quay:3": [1]},
+                }
+            ).encode(),
+        ]
+        with (
+            patch.dict(os.environ, {}, clear=True),
+            patch.object(
+                ProdDefs,
+                "get_product_definitions_service",
+                return_value=self.mock_proddefs_data,
+            ),
+        ):
+            built = ProdDefs()
+        for contents in index_file_contents:
+            with (
+                tempfile.TemporaryDirectory() as tmp_dir,
+                patch.dict(
+                    os.environ, {"PRODDEFS_URL": "https://example.com/products.json"}
+                ),
+                patch.object(
+                    ProdDefs, "INDEX_FILE", os.path.join(tmp_dir, "products-{}.index")
+                ),
+                patch.object(ProdDefs, "get_etag", return_value="etag-1"),
+                patch.object(
+                    ProdDefs, "get_product_definitions_service"
+                ) as mock_service,
+            ):
+                mock_service.return_value = self.mock_proddefs_data
+                with open(os.path.join(tmp_dir, "products-active.index"), "wb") as f:
+                    f.write(contents)
+                rebuilt = ProdDefs()
+                assert mock_service.call_count == 1
+                assert _index_snapshot(rebuilt) == _index_snapshot(built)
+                # The rebuilt index replaced the unreadable one
+                assert _index_snapshot(ProdDefs()) == _index_snapshot(built)
+                assert mock_service.call_count == 1
+
+
+def _index_snapshot(prod_defs: ProdDefs) -> tuple:
+    """Everything product mapping uses from a ProdDefs, comparable between instances"""
+    return (
+        [
+            (stream.name, stream.cpes, stream.active, [m.name for m in stream.children])
+            for stream in prod_defs.product_trees
+        ],
+        {
+            cpe: [(stream.name, stream.active) for stream in streams]
+            for cpe, streams in prod_defs.stream_nodes_by_cpe.items()
+        },
+        [
+            (module.name, module.cpe_patterns, module.parent.name)
+            for module in prod_defs.module_matcher.items
+        ],
+    )
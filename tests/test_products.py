@@ -1,15 +1,27 @@
+import io
 import json
 
-from anytree import Node
+import pytest
+from anytree import Node, PreOrderIter, RenderTree, Walker
+from anytree.walker import WalkError
+from click.testing import CliRunner
 
+from trustshell import normalize_purl, product_definitions, products, purl_sans_version
+from trustshell.tree import TreeNode, to_anytree
 from trustshell.products import (
     _build_node_purl,
-    _remove_duplicate_parent_nodes,
-    _remove_non_cpe_branches,
+    _trees_from_ancestor_tree,
+    build_ancestor_tree,
+    build_ancestor_tree_from_stream,
+    _remove_duplicate_branches,
+    _prune_ancestor_tree,
+    _remove_root_return_children,
     _trees_with_cpes,
     _render_tree,
-    _has_cpe_node,
-    container_in_tree,
+    _render_tree_text,
+    _read_batch_purls,
+    _search_batch,
+    _tree_to_dict,
 )
 
 
@@ -24,7 +36,7 @@ def test_build_node_purl_rpm():
         "pkg:rpm/redhat/webkit2gtk3@2.42.5-1.el9?arch=src&repository_id=rhel-9-for-x86_64-appstream"
         "pkg:rpm/redhat/webkit2gtk3@2.42.5-1.el9?arch=src&repository_id=rhel-9-for-x86_64-appstream"
     ]
-    result = _build_node_purl(purls).to_string()
+    result = _build_node_purl(purls)
     assert result == "pkg:rpm/redhat/webkit2gtk3@2.42.5-1.el9"
 
 
@@ -35,11 +47,33 @@ def test_build_node_purl_oci():
         "pkg:oci/quay@sha256:9?repo_url=x.com/quay/quay-builder-qemu-rhcos-rhel8&tag=v3.12.8",
         "pkg:oci/quay@sha256:9?repo_url=x.com/quay/quay-builder-qemu-rhcos-rhel8&tag=v3.12",
     ]
-    result = _build_node_purl(purls).to_string()
+    result = _build_node_purl(purls)
     print(result)
     assert result == "pkg:oci/quay?tag=v3.12.8-1"
 
 
+def test_normalize_purl():
+    purl = (
+        "pkg:oci/quay-builder-qemu-rhcos-rhel8@sha256:9?arch=amd64"
+        "&repository_url=registry.redhat.io/quay/quay-builder-qemu-rhcos-rhel8&tag=v3.12.8-1"
+    )
+    result = normalize_purl(purl)
+    assert result == (
+        "pkg:oci/quay-builder-qemu-rhcos-rhel8?"
+        "repository_url=registry.redhat.io/quay/quay-builder-qemu-rhcos-rhel8&tag=v3.12.8-1"
+    )
+    assert normalize_purl(purl) is result
+    rpm = "pkg:rpm/redhat/openssl@3.0.7-18.el9_2?arch=src&repository_id=rhel-9"
+    assert normalize_purl(rpm) == "pkg:rpm/redhat/openssl@3.0.7-18.el9_2"
+
+
+def test_purl_sans_version():
+    oci = "pkg:oci/quay@sha256:9?tag=v3.12.8-1"
+    assert purl_sans_version(oci) == "pkg:oci/quay?tag=v3.12.8-1"
+    assert purl_sans_version(oci, remove_tag=True) == "pkg:oci/quay"
+    assert purl_sans_version("pkg:npm/a@1") == "pkg:npm/a"
+
+
 def test_trees_with_cpes_srpm():
     with open("tests/testdata/openssl.json", "r") as file:
         data = json.load(file)
@@ -201,39 +235,238 @@ def test_trees_with_cpes_quarkus_xmlsec():
     _check_node_names_at_depth(result[0], 5, ["cpe:/a:redhat:camel_quarkus:3:*:*:*"])
 
 
+@pytest.mark.parametrize(
+    "fixture",
+    [
+        "NGX.json",
+        "chardet.json",
+        "libreoffice.json",
+        "openssl-libs.json",
+        "openssl.json",
+        "quarkus-3.15-xmlsec.json",
+        "quarkus-3.20-agroal-api.json",
+        "quarkus-vertx-core.json",
+        "quay-builder-qemu-index-name.json",
+        "quay-builder-qemu-multi.json",
+        "quay-builder-qemu-rhcos-rhel-8.json",
+    ],
+)
+def test_build_ancestor_tree_from_stream(fixture):
+    path = f"tests/testdata/{fixture}"
+    with open(path) as file:
+        data = json.load(file)
+    expected = [_tree_lines(tree) for tree in _trees_with_cpes(data)]
+
+    def chunks():
+        with open(path, "rb") as file:
+            while chunk := file.read(1000):
+                yield chunk
+
+    base_node = TreeNode("root")
+    total = build_ancestor_tree_from_stream(base_node, chunks())
+    assert total == data["total"]
+    result = [_tree_lines(tree) for tree in _trees_from_ancestor_tree(base_node)]
+    assert result == expected
+
+
+def _component(purl, *ancestors, cpe=()):
+    return {"purl": [purl] if purl else [], "cpe": list(cpe), "ancestors": ancestors}
+
+
+def test_build_ancestor_tree_from_stream_prunes_branches_without_cpes():
+    def chain(name, depth):
+        # A long branch of ancestors without a CPE
+        component = _component(f"pkg:npm/{name}-{depth}@1")
+        for i in reversed(range(depth)):
+            component = _component(f"pkg:npm/{name}-{i}@1", component)
+        return component
+
+    product = _component(None, cpe=["cpe:/a:redhat:product:1"])
+    data = {
+        "items": [
+            # Branches whose children have the same names, but in a different order, aren't
+            # duplicates
+            _component(
+                "pkg:npm/a@1",
+                _component(
+                    "pkg:npm/b@1",
+                    _component("pkg:npm/c@1", chain("x", 3)),
+                    _component("pkg:npm/c@1", chain("y", 3)),
+                    product,
+                ),
+                _component(
+                    "pkg:npm/b@1",
+                    _component("pkg:npm/c@1", chain("y", 3)),
+                    _component("pkg:npm/c@1", chain("x", 3)),
+                    product,
+                ),
+            ),
+            _component("pkg:npm/d@1", chain("z", 50)),
+        ],
+        "total": 3,
+    }
+    expected = [_tree_lines(tree) for tree in _trees_with_cpes(data)]
+    base_node = TreeNode("root")
+    build_ancestor_tree_from_stream(base_node, [json.dumps(data).encode("utf-8")])
+    # Only the branch leading to the CPE is kept whole, the others are single leaves
+    assert len(base_node.descendants) == 11
+    result = [_tree_lines(tree) for tree in _trees_from_ancestor_tree(base_node)]
+    assert result == expected
+
+
+def test_build_ancestor_tree_from_stream_drops_empty_components():
+    body = json.dumps(
+        {
+            "items": [
+                {"purl": [], "cpe": [], "ancestors": []},
+                {
+                    "purl": [],
+                    "cpe": ["cpe:/a:redhat:quay:3"],
+                    "ancestors": [{"purl": ["pkg:oci/quay"], "cpe": []}],
+                },
+            ],
+            "total": 2,
+        }
+    ).encode("utf-8")
+    base_node = TreeNode("root")
+    build_ancestor_tree_from_stream(base_node, [body])
+    assert [node.name for node in base_node.descendants] == ["cpe:/a:redhat:quay:3"]
+
+
+def _tree_lines(root):
+    return [f"{pre}{node.name}" for pre, _, node in RenderTree(root)]
+
+
 def _check_node_names_at_depth(result, depth, expected):
     node_names = [node.name for node in result.descendants if node.depth == depth]
     assert sorted(expected) == sorted(node_names)
 
 
+# The pruning steps which _prune_ancestor_tree replaced, kept as an oracle for it
+
+
+def _has_cpe_node(node):
+    """
+    Check if the node or any of its descendants have a name starting with "cpe:/".
+    """
+    if node.name.startswith("cpe:/"):
+        return True
+    for descendant in PreOrderIter(node):
+        if descendant.name.startswith("cpe:/"):
+            return True
+    return False
+
+
+def _remove_non_cpe_branches(root):
+    # Inspect all the leaves for ones not starting with cpe:/
+    leaves_to_remove = set()
+    leaves_to_keep = set()
+    for leaf in root.leaves:
+        if leaf.name.startswith("cpe:/"):
+            leaves_to_keep.add(leaf)
+        else:
+            leaves_to_remove.add(leaf)
+    while leaves_to_remove:
+        to_remove = leaves_to_remove.pop()
+        if leaves_to_keep:
+            to_keep = next(iter(leaves_to_keep))
+            # remove all leaves and branches up to common ancestores
+            w = Walker()
+            try:
+                up, common, _ = w.walk(to_remove, to_keep)
+                for node in up:
+                    if node != common:
+                        node.parent = None
+            except WalkError:
+                continue
+    return root
+
+
+def _container_in_tree(root):
+    """
+    Returns true if containers exist in tree descendants
+    """
+    for node in root.descendants:
+        if node.name.startswith("pkg:oci/"):
+            return True
+    return False
+
+
+def _remove_duplicate_parent_nodes(node):
+    """
+    Removes nodes in an anytree tree that have the same name as their direct parent,
+    and reparents their children to the remaining node.
+    """
+    for descandant in node.descendants:
+        if descandant.name == descandant.parent.name:
+            new_children = list(descandant.siblings)
+            new_children.extend(descandant.children)
+            descandant.parent.children = new_children
+            descandant.parent = None
+
+
+def _prune_stepwise(base_node):
+    """Prune a tree of ancestors one step at a time, as an oracle for _prune_ancestor_tree"""
+    _remove_duplicate_parent_nodes(base_node)
+    trees = []
+    for tree in _remove_root_return_children(base_node):
+        if tree.name.startswith("pkg:rpm/") and _container_in_tree(tree):
+            continue
+        if _has_cpe_node(tree):
+            trees.append(_remove_non_cpe_branches(tree))
+    return trees
+
+
+def _copy_tree(node, node_class, parent=None):
+    copy = node_class(node.name, parent=parent)
+    for child in node.children:
+        _copy_tree(child, node_class, parent=copy)
+    return copy
+
+
+def _prune_like_oracle(tree):
+    """Prune tree as the only component in a tree of ancestors with _prune_ancestor_tree, check
+    it matches the oracle and return the resulting trees"""
+    # Not named root like the usual base node, the top node of some of the test trees is named
+    # root and would be merged into it
+    base_node = Node("ancestors")
+    _copy_tree(tree, Node, parent=base_node)
+    expected = [_tree_lines(pruned) for pruned in _prune_stepwise(base_node)]
+    base_node = TreeNode("ancestors")
+    _copy_tree(tree, TreeNode, parent=base_node)
+    trees = [to_anytree(pruned) for pruned in _prune_ancestor_tree(base_node)]
+    assert [_tree_lines(pruned) for pruned in trees] == expected
+    return trees
+
+
 def test_has_cpe_node_with_cpe_name():
     root = Node("cpe:/a", children=[Node("cpe:/b"), Node("d")])
-    assert _has_cpe_node(root)
+    assert _prune_like_oracle(root)
 
 
 def test_has_cpe_node_without_cpe_name():
     root = Node("d", children=[Node("cpe:/a"), Node("b")])
-    assert _has_cpe_node(root)
+    assert _prune_like_oracle(root)
 
 
 def test_has_cpe_node_with_cpe_descendant():
     root = Node("d", children=[Node("b"), Node("cpe:/a")])
-    assert _has_cpe_node(root)
+    assert _prune_like_oracle(root)
 
 
 def test_has_cpe_node_with_multiple_cpe_descendants():
     root = Node("d", children=[Node("b"), Node("cpe:/a"), Node("cpe:/b")])
-    assert _has_cpe_node(root)
+    assert _prune_like_oracle(root)
 
 
 def test_has_cpe_node_with_no_descendants():
     root = Node("d")
-    assert not _has_cpe_node(root)
+    assert not _prune_like_oracle(root)
 
 
 def test_has_cpe_node_with_empty_children():
     root = Node("d")
-    assert not _has_cpe_node(root)
+    assert not _prune_like_oracle(root)
 
 
 def test_remove_non_cpe_branches():
@@ -250,17 +483,16 @@ def test_remove_non_cpe_branches():
     srpm = Node("srpm", parent=base1)
     Node("srpm", parent=base2)
     Node("cpe:/", parent=srpm)
-    _remove_non_cpe_branches(root)
-    _render_tree(root)
+    [result] = _prune_like_oracle(root)
 
     # Assert that the tree structure is as expected
     # root
     # ├── base
     # │   └── srpm
     # │       └── cpe:/
-    _check_node_names_at_depth(root, 1, ["base"])
-    _check_node_names_at_depth(root, 2, ["srpm"])
-    _check_node_names_at_depth(root, 3, ["cpe:/"])
+    _check_node_names_at_depth(result, 1, ["base"])
+    _check_node_names_at_depth(result, 2, ["srpm"])
+    _check_node_names_at_depth(result, 3, ["cpe:/"])
 
 
 def test_remove_multi_non_cpe_branches():
@@ -281,17 +513,16 @@ def test_remove_multi_non_cpe_branches():
     Node("srpm", parent=base2)
     Node("srpm", parent=base3)
     Node("cpe:/", parent=srpm)
-    _remove_non_cpe_branches(root)
-    _render_tree(root)
+    [result] = _prune_like_oracle(root)
 
     # Assert that the tree structure is as expected
     # root
     # ├── base
     # │   └── srpm
     # │       └── cpe:/
-    _check_node_names_at_depth(root, 1, ["base"])
-    _check_node_names_at_depth(root, 2, ["srpm"])
-    _check_node_names_at_depth(root, 3, ["cpe:/"])
+    _check_node_names_at_depth(result, 1, ["base"])
+    _check_node_names_at_depth(result, 2, ["srpm"])
+    _check_node_names_at_depth(result, 3, ["cpe:/"])
 
 
 def test_remove_non_cpe_branches_multi_cpe():
@@ -314,8 +545,7 @@ def test_remove_non_cpe_branches_multi_cpe():
     srpm3 = Node("srpm", parent=base3)
     Node("cpe:/", parent=srpm)
     Node("cpe:/", parent=srpm3)
-    _remove_non_cpe_branches(root)
-    _render_tree(root)
+    [result] = _prune_like_oracle(root)
 
     # Assert that the tree structure is as expected
     # root
@@ -325,29 +555,238 @@ def test_remove_non_cpe_branches_multi_cpe():
     # ├── base
     # │   └── srpm
     # │       └── cpe:/
-    _check_node_names_at_depth(root, 1, ["base", "base"])
-    _check_node_names_at_depth(root, 2, ["srpm", "srpm"])
-    _check_node_names_at_depth(root, 3, ["cpe:/", "cpe:/"])
+    _check_node_names_at_depth(result, 1, ["base", "base"])
+    _check_node_names_at_depth(result, 2, ["srpm", "srpm"])
+    _check_node_names_at_depth(result, 3, ["cpe:/", "cpe:/"])
+
+
+def test_prune_ancestor_tree_keeps_shared_ancestors():
+    # The oracle only walks each non-CPE leaf to one of the CPEs, so it can remove a branch
+    # shared with another CPE, like a below
+    # root
+    # ├── a
+    # │   ├── cpe:/a
+    # │   └── x
+    # │       └── y
+    # └── b
+    #     ├── z
+    #     └── cpe:/b
+    base_node = TreeNode("base")
+    root = TreeNode("root", parent=base_node)
+    a = TreeNode("a", parent=root)
+    TreeNode("cpe:/a", parent=a)
+    TreeNode("y", parent=TreeNode("x", parent=a))
+    b = TreeNode("b", parent=root)
+    TreeNode("z", parent=b)
+    TreeNode("cpe:/b", parent=b)
+    [tree] = _prune_ancestor_tree(base_node)
+    assert _tree_lines(tree) == [
+        "root",
+        "├── a",
+        "│   └── cpe:/a",
+        "└── b",
+        "    └── cpe:/b",
+    ]
+
+
+def test_prune_ancestor_tree_many_leaves():
+    base_node = TreeNode("root")
+    node = base_node
+    for depth in range(50):
+        node = TreeNode(f"pkg:npm/chain-{depth}@1", parent=node)
+        for leaf in range(100):
+            TreeNode(f"pkg:npm/leaf-{depth}-{leaf}@1", parent=node)
+    cpe = TreeNode("cpe:/a:redhat:product:1", parent=node)
+    [tree] = _prune_ancestor_tree(base_node)
+    assert tree.leaves == (cpe,)
+    assert len(tree.descendants) == 50
 
 
 def test_remove_duplicate_parent_nodes():
-    # Create a tree with duplicate parent nodes
+    # Create a tree with duplicate parent nodes, which leads to a CPE so it isn't pruned
     root = Node("root")
     child1 = Node("child1", parent=root)
     child2 = Node("child1", parent=child1)
     child3 = Node("child1", parent=child2)
-    Node("grandchild1", parent=child3)
-    _remove_duplicate_parent_nodes(root)
-    _render_tree(root)
+    grandchild1 = Node("grandchild1", parent=child3)
+    Node("cpe:/", parent=grandchild1)
+    [result] = _prune_like_oracle(root)
     # Assert that the tree structure is as expected
-    _check_node_names_at_depth(root, 1, ["child1"])
-    _check_node_names_at_depth(root, 2, ["grandchild1"])
+    _check_node_names_at_depth(result, 1, ["child1"])
+    _check_node_names_at_depth(result, 2, ["grandchild1"])
 
 
 def test_remove_rpms_in_containers():
-    # Create a tree with an rpm in a container
+    # Create a tree with an rpm in a container, which leads to a CPE
     # pkg:rpm/redhat/openssl-libs
     # └── pkg:oci/quay-builder-qemu-rhcos-rhel8
+    #     └── cpe:/a:redhat:quay:3
     root = Node("pkg:rpm/redhat/openssl-libs")
-    Node("pkg:oci/quay-builder-qemu-rhcos-rhel8", parent=root)
-    assert container_in_tree(root)
+    oci = Node("pkg:oci/quay-builder-qemu-rhcos-rhel8", parent=root)
+    Node("cpe:/a:redhat:quay:3", parent=oci)
+    assert _prune_like_oracle(root) == []
+
+
+@pytest.mark.parametrize(
+    "fixture",
+    [
+        "openssl.json",
+        "openssl-libs.json",
+        "libreoffice.json",
+        "quay-builder-qemu-multi.json",
+        "quarkus-3.20-agroal-api.json",
+        "quarkus-vertx-core.json",
+    ],
+)
+def test_prune_ancestor_tree_matches_stepwise(fixture):
+    with open(f"tests/testdata/{fixture}") as file:
+        items = json.load(file)["items"]
+    results = []
+    for prune in (_prune_stepwise, _prune_ancestor_tree):
+        base_node = TreeNode("root")
+        build_ancestor_tree(base_node, items)
+        _remove_duplicate_branches(base_node)
+        results.append([_tree_lines(tree) for tree in prune(base_node)])
+    assert results[0] == results[1]
+
+
+def test_prune_ancestor_tree():
+    base_node = TreeNode("root")
+    # Merged into its parent, the children of merged nodes go after the parent's children
+    npm = TreeNode("pkg:npm/a@1", parent=base_node)
+    same = TreeNode("pkg:npm/a@1", parent=npm)
+    TreeNode("cpe:/a:redhat:one:1", parent=same)
+    TreeNode("pkg:npm/no-cpe@1", parent=same)
+    TreeNode("cpe:/a:redhat:two:1", parent=npm)
+    # Rpms in containers are skipped
+    rpm = TreeNode("pkg:rpm/redhat/b@1", parent=base_node)
+    oci = TreeNode(
+        "pkg:oci/c?tag=1", parent=TreeNode("pkg:rpm/redhat/srpm@1", parent=rpm)
+    )
+    TreeNode("cpe:/a:redhat:three:1", parent=oci)
+    # Trees without CPEs are skipped
+    TreeNode("pkg:npm/d@1", parent=TreeNode("pkg:npm/e@1", parent=base_node))
+
+    trees = _prune_ancestor_tree(base_node)
+    assert [_tree_lines(tree) for tree in trees] == [
+        [
+            "pkg:npm/a@1",
+            "├── cpe:/a:redhat:two:1",
+            "└── cpe:/a:redhat:one:1",
+        ]
+    ]
+    assert base_node.is_leaf
+
+
+def test_read_batch_purls():
+    lines = io.StringIO("pkg:npm/a@1\n\n# a comment\n  pkg:npm/b@1  \npkg:npm/a@1\n")
+    assert _read_batch_purls(lines) == ["pkg:npm/a@1", "pkg:npm/b@1"]
+
+
+def test_tree_to_dict():
+    root = Node("cpe:/a:redhat:product:1")
+    Node("pkg:npm/a@1", parent=root)
+    assert _tree_to_dict(root) == {
+        "name": "cpe:/a:redhat:product:1",
+        "children": [{"name": "pkg:npm/a@1", "children": []}],
+    }
+
+
+class _FakeProdDefs:
+    def extend_with_product_mappings(self, ancestor_trees):
+        return ancestor_trees
+
+
+def test_search_batch(monkeypatch):
+    def get_roots(purl, **kwargs):
+        if purl == "pkg:npm/broken@1":
+            raise RuntimeError("lookup failed")
+        root = Node("cpe:/a:redhat:product:1")
+        return [Node(purl, parent=root)]
+
+    monkeypatch.setattr(products, "_get_roots", get_roots)
+    monkeypatch.setattr(product_definitions, "ProdDefs", _FakeProdDefs)
+    monkeypatch.setattr(products, "extract_affects", lambda trees: {("p", "c")})
+    lines = io.StringIO("pkg:npm/broken@1\nnot-a-purl\npkg:npm/a@1\npkg:npm/broken@1\n")
+    output = io.StringIO()
+    _search_batch(lines, output, 2, cache=None)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [r["purl"] for r in records] == [
+        "pkg:npm/broken@1",
+        "not-a-purl",
+        "pkg:npm/a@1",
+    ]
+    assert records[0]["error"] == "lookup failed"
+    assert "not a valid Package URL" in records[1]["error"]
+    assert records[2]["affects"] == [["p", "c"]]
+    assert records[2]["trees"] == [
+        {
+            "name": "cpe:/a:redhat:product:1",
+            "children": [{"name": "pkg:npm/a@1", "children": []}],
+        }
+    ]
+
+
+@pytest.mark.parametrize("fixture", ["libreoffice", "quarkus-vertx-core", "NGX"])
+def test_render_tree_text(fixture):
+    with open(f"tests/testdata/{fixture}.json") as file:
+        data = json.load(file)
+    base_node = TreeNode("root")
+    build_ancestor_tree(base_node, data["items"])
+    root = to_anytree(base_node)
+    expected = "".join(f"{pre}{node.name}\n" for pre, _, node in RenderTree(root))
+    assert _render_tree_text(root) == expected
+
+
+@pytest.mark.parametrize("output", ["plain", "json"])
+def test_search_output(monkeypatch, output):
+    def get_roots(purl, *args, **kwargs):
+        root = Node("pkg:npm/a@1")
+        Node("cpe:/a:redhat:product:1", parent=root)
+        return [root]
+
+    monkeypatch.setattr(products, "_get_roots", get_roots)
+    monkeypatch.setattr(product_definitions, "ProdDefs", _FakeProdDefs)
+    monkeypatch.setattr(products, "extract_affects", lambda trees: {("p", "c")})
+    result = CliRunner().invoke(
+        products.search, ["--no-cache", "-o", output, "pkg:npm/a@1"]
+    )
+    assert result.exit_code == 0
+    if output == "plain":
+        assert result.stdout == "pkg:npm/a@1\n└── cpe:/a:redhat:product:1\n"
+    else:
+        assert json.loads(result.stdout) == {
+            "purl": "pkg:npm/a@1",
+            "trees": [
+                {
+                    "name": "pkg:npm/a@1",
+                    "children": [{"name": "cpe:/a:redhat:product:1", "children": []}],
+                }
+            ],
+            "affects": [["p", "c"]],
+        }
+
+
+def test_remove_duplicate_branches():
+    root = TreeNode("root")
+    for children in (["cpe:/a", "cpe:/b"], ["cpe:/b", "cpe:/a"], ["cpe:/a"]):
+        branch = TreeNode("pkg:rpm/redhat/openssl@3", parent=root)
+        for child in children:
+            TreeNode(child, parent=branch)
+    deep = TreeNode("pkg:oci/quay@sha256:1", parent=root)
+    TreeNode("cpe:/a", parent=TreeNode("pkg:rpm/redhat/openssl@3", parent=deep))
+
+    _remove_duplicate_branches(root)
+
+    # The second branch only differs by the order of its children. The branch below the
+    # container is a duplicate of the third branch
+    assert _tree_lines(root) == [
+        "root",
+        "├── pkg:rpm/redhat/openssl@3",
+        "│   ├── cpe:/a",
+        "│   └── cpe:/b",
+        "├── pkg:rpm/redhat/openssl@3",
+        "│   └── cpe:/a",
+        "└── pkg:oci/quay@sha256:1",
+    ]
@@ -1,12 +1,161 @@
+import asyncio
 import json
 from unittest.mock import patch
-from trustshell.purl import _get_package_versions
 
+import httpx
+import pytest
+from click.testing import CliRunner
 
-@patch("trustshell.purl._lookup_base_purl")
-def test_package_versions(mock_lookup):
+from trustshell import purl
+from trustshell.client import TrustifyClient
+from trustshell.purl import (
+    _fetch_all_package_versions,
+    _latest_package_versions,
+    _lookup_base_purl_async,
+    _print_latest_versions,
+    _query_trustify_package_pages,
+    search,
+)
+
+BASE_URL = "https://trustify.example.com/api/v2/"
+
+
+def test_package_versions():
     base_purl = "pkg:oci/quay-builder-qemu-rhcos-rhel-8"
     expected_output = {"v3.12.8-1", "v3.12.8", "v3.12"}
     with open("tests/testdata/base_purl-quay-builder-qemu-rhcos-rhel-8.json") as file:
-        mock_lookup.return_value = json.load(file)
-    assert _get_package_versions(base_purl, {}) == expected_output
+        details = json.load(file)
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        return httpx.Response(200, json=details)
+
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False)
+
+    async def fetch_all():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as ac:
+            return await _fetch_all_package_versions(
+                [base_purl], client, ac, asyncio.Semaphore(1)
+            )
+
+    assert asyncio.run(fetch_all()) == [expected_output]
+    # The lookup uses the base URL of the client
+    assert requested == [
+        f"{BASE_URL}purl/base/pkg%3Aoci%2Fquay-builder-qemu-rhcos-rhel-8"
+    ]
+
+
+def test_lookup_base_purl_async_error():
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False)
+
+    async def lookup():
+        transport = httpx.MockTransport(lambda request: httpx.Response(404))
+        async with httpx.AsyncClient(transport=transport) as ac:
+            return await _lookup_base_purl_async(client, ac, "pkg:rpm/redhat/missing")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(lookup())
+
+
+@patch("trustshell.purl._lookup_base_purl_async")
+def test_fetch_all_package_versions_order_and_errors(mock_lookup):
+    base_purls = [
+        "pkg:rpm/redhat/openssl",
+        "pkg:rpm/redhat/missing",
+        "pkg:rpm/redhat/openssl-libs",
+    ]
+
+    async def lookup(client, async_client, base_purl):
+        # Respond in reverse order to check results keep the input order
+        await asyncio.sleep(0.01 * (len(base_purls) - base_purls.index(base_purl)))
+        if base_purl == "pkg:rpm/redhat/missing":
+            raise ValueError("not found")
+        return {"versions": [{"version": f"{base_purl}-1"}]}
+
+    async def fetch_all():
+        async with httpx.AsyncClient() as async_client:
+            return await _fetch_all_package_versions(
+                base_purls, TrustifyClient(), async_client, asyncio.Semaphore(2)
+            )
+
+    mock_lookup.side_effect = lookup
+    results = asyncio.run(fetch_all())
+    assert results[0] == {"pkg:rpm/redhat/openssl-1"}
+    assert isinstance(results[1], ValueError)
+    assert results[2] == {"pkg:rpm/redhat/openssl-libs-1"}
+
+
+def test_latest_package_versions_skips_failed_lookups():
+    result = _latest_package_versions(
+        ["pkg:rpm/redhat/openssl", "pkg:rpm/redhat/missing"],
+        [{"1.0-1", "1.10-1"}, ValueError("not found")],
+    )
+    assert list(result.keys()) == ["pkg:rpm/redhat/openssl"]
+    assert result["pkg:rpm/redhat/openssl"][0] == "1.10-1"
+
+
+def test_query_trustify_packages_pages():
+    items = [{"purl": f"pkg:rpm/redhat/lib{i}"} for i in range(7)]
+    loops = set()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path[len("/api/v2/") :]
+        if path.startswith("purl/base/"):
+            loops.add(asyncio.get_running_loop())
+            return httpx.Response(200, json={"versions": [{"version": "1.0"}]})
+        offset = int(request.url.params["offset"])
+        limit = int(request.url.params["limit"])
+        assert request.url.params["q"] == "lib"
+        return httpx.Response(
+            200, json={"items": items[offset : offset + limit], "total": len(items)}
+        )
+
+    transport = httpx.MockTransport(handler)
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False, transport=transport)
+    pages = list(_query_trustify_package_pages("lib", client, page_size=3))
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+    # The pages are consumed in one event loop, with one async client for every lookup
+    pages = _query_trustify_package_pages("lib", client, max_results=4, page_size=3)
+    with (
+        patch.object(
+            TrustifyClient,
+            "async_client",
+            autospec=True,
+            side_effect=lambda c, max_connections: httpx.AsyncClient(
+                transport=transport
+            ),
+        ) as mock_async_client,
+        purl.console.capture() as capture,
+    ):
+        assert asyncio.run(_print_latest_versions(pages, client, 2))
+    assert mock_async_client.call_count == 1
+    assert len(loops) == 1
+    assert capture.get().splitlines()[1:] == [
+        f"{item['purl']}@1.0" for item in items[:4]
+    ]
+
+
+@patch.object(TrustifyClient, "async_client", autospec=True)
+@patch("trustshell.purl._lookup_base_purl_async")
+@patch("trustshell.purl._query_trustify_package_pages")
+def test_search_looks_up_versions_per_page(mock_pages, mock_lookup, mock_async_client):
+    pages = [["pkg:rpm/redhat/lib0", "pkg:rpm/redhat/lib1"], ["pkg:rpm/redhat/lib2"]]
+    mock_pages.return_value = iter(pages)
+    mock_async_client.side_effect = lambda client, max_connections: httpx.AsyncClient()
+    loops = set()
+
+    async def lookup(client, async_client, base_purl):
+        loops.add(asyncio.get_running_loop())
+        return {"versions": [{"version": "1.0"}]}
+
+    mock_lookup.side_effect = lookup
+    result = CliRunner().invoke(search, ["--latest-version", "-m", "3", "lib"])
+    assert result.exit_code == 0
+    assert mock_pages.call_args.args[2] == 3
+    # One async client and event loop are used for the lookups of every page
+    assert mock_async_client.call_count == 1
+    assert len(loops) == 1
+    assert [call.args[2] for call in mock_lookup.call_args_list] == pages[0] + pages[1]
+    assert "pkg:rpm/redhat/lib2@1.0" in result.output
@@ -0,0 +1,94 @@
+import io
+import json
+import threading
+
+import httpx
+from rich.console import Console
+
+from trustshell import trace
+from trustshell.client import TrustifyClient
+from trustshell.trace import Tracer, span, tracing
+
+BASE_URL = "https://trustify.example.com/api/v2/"
+
+
+def test_span_disabled():
+    assert trace.get_tracer() is None
+    with span("nothing", count=1) as args:
+        args["more"] = 2
+    assert trace.get_tracer() is None
+
+
+def test_nested_spans(tmp_path):
+    path = tmp_path / "trace.json"
+    output = io.StringIO()
+    with tracing(str(path), Console(file=output, width=200)) as tracer:
+        with span("outer"):
+            with span("inner", size=3) as args:
+                args["status"] = 200
+            with span("inner"):
+                pass
+    assert trace.get_tracer() is None
+
+    outer = [s for s in tracer.spans if s.name == "outer"][0]
+    inner = [s for s in tracer.spans if s.name == "inner"]
+    assert len(inner) == 2
+    assert outer.self_ns == outer.duration_ns - sum(s.duration_ns for s in inner)
+    assert inner[0].args == {"size": 3, "status": 200}
+
+    summary = {row[0]: row for row in tracer.summary()}
+    assert summary["inner"][1] == 2
+    assert summary["outer"][2] >= summary["inner"][2]
+
+    events = json.loads(path.read_text())["traceEvents"]
+    complete = [e for e in events if e["ph"] == "X"]
+    assert [e["name"] for e in complete] == ["outer", "inner", "inner"]
+    assert complete[0]["ts"] <= complete[1]["ts"]
+    assert complete[0]["dur"] >= complete[1]["dur"] + complete[2]["dur"]
+    assert any(e["ph"] == "M" for e in events)
+    assert "inner" in output.getvalue()
+    assert f"Wrote trace to {path}" in output.getvalue()
+
+
+def test_trace_written_on_exit(tmp_path):
+    path = tmp_path / "trace.json"
+    try:
+        with tracing(str(path), Console(file=io.StringIO())):
+            with span("exiting"):
+                raise SystemExit(0)
+    except SystemExit:
+        pass
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [e["name"] for e in events if e["ph"] == "X"] == ["exiting"]
+
+
+def test_spans_from_threads():
+    tracer = Tracer()
+
+    def work():
+        with tracer.span("work", "test", {}):
+            pass
+
+    with tracer.span("main", "test", {}):
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    main = [s for s in tracer.spans if s.name == "main"][0]
+    # Spans in other threads aren't nested in the main thread's span
+    assert main.self_ns == main.duration_ns
+    assert len({s.tid for s in tracer.spans}) == 4
+
+
+def test_http_spans(tmp_path):
+    transport = httpx.MockTransport(lambda request: httpx.Response(404, json={}))
+    client = TrustifyClient(base_url=BASE_URL, auth_enabled=False, transport=transport)
+    with tracing(str(tmp_path / "trace.json"), Console(file=io.StringIO())) as tracer:
+        client.get("analysis/status")
+        with client.stream("GET", "purl/base?q=x") as response:
+            response.read()
+    assert [(s.name, s.category, s.args["status"]) for s in tracer.spans] == [
+        ("GET /api/v2/analysis/status", "http", 404),
+        ("GET /api/v2/purl/base", "http", 404),
+    ]
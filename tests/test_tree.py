@@ -0,0 +1,76 @@
+from anytree import Node, PreOrderIter, RenderTree
+from anytree.walker import Walker
+
+from trustshell.tree import TreeNode, to_anytree
+
+
+def _tree():
+    root = TreeNode("root")
+    a = TreeNode("pkg:npm/a@1", parent=root)
+    TreeNode("cpe:/a:redhat:one:1", parent=a)
+    TreeNode("cpe:/a:redhat:two:1", parent=a)
+    TreeNode("pkg:npm/b@1", parent=root)
+    return root
+
+
+def test_tree_node_navigation():
+    root = _tree()
+    a, b = root.children
+    cpe_one, cpe_two = a.children
+    assert cpe_one.root is root
+    assert cpe_one.path == (root, a, cpe_one)
+    assert cpe_one.ancestors == (root, a)
+    assert cpe_one.siblings == (cpe_two,)
+    assert root.descendants == (a, cpe_one, cpe_two, b)
+    assert root.leaves == (cpe_one, cpe_two, b)
+    assert cpe_one.is_leaf and not a.is_leaf
+    assert [node.name for node in PreOrderIter(root)][:2] == ["root", "pkg:npm/a@1"]
+
+
+def test_tree_node_reparent():
+    root = _tree()
+    a, b = root.children
+    cpe_one, cpe_two = a.children
+    cpe_one.parent = b
+    assert a.children == (cpe_two,)
+    assert b.children == (cpe_one,)
+    a.children = [cpe_two, cpe_one]
+    assert b.is_leaf
+    assert cpe_one.parent is a
+    a.parent = None
+    assert root.children == (b,)
+    assert a.is_root
+
+
+def test_tree_node_names_are_interned():
+    name = "".join(["pkg:npm/", "a@1"])
+    assert TreeNode(name).name is TreeNode("pkg:npm/a@1").name
+
+
+def test_tree_node_walk():
+    root = _tree()
+    a, b = root.children
+    up, common, down = Walker().walk(a.children[0], b)
+    assert up == (a.children[0], a)
+    assert common is root
+    assert down == (b,)
+
+
+def test_to_anytree():
+    root = _tree()
+    result = to_anytree(root)
+    assert isinstance(result, Node)
+    assert [f"{pre}{node.name}" for pre, _, node in RenderTree(result)] == [
+        f"{pre}{node.name}" for pre, _, node in RenderTree(root)
+    ]
+    assert result.leaves[0].parent.name == "pkg:npm/a@1"
+
+
+def test_tree_node_merge_into_parent():
+    root = _tree()
+    a, b = root.children
+    cpe_one, cpe_two = a.children
+    a.merge_into_parent()
+    assert root.children == (b, cpe_one, cpe_two)
+    assert cpe_one.parent is root
+    assert a.is_root and a.is_leaf
@@ -0,0 +1,150 @@
+import io
+import threading
+from types import SimpleNamespace
+
+import pytest
+from anytree import Node
+from click.testing import CliRunner
+
+from trustshell import osidb, product_definitions, products
+from trustshell.osidb import OSIDB
+from trustshell.triage import (
+    apply_triage,
+    plan_triage,
+    read_manifest,
+    review,
+    triage,
+)
+
+
+class _FakeProdDefs:
+    def extend_with_product_mappings(self, ancestor_trees):
+        return ancestor_trees
+
+
+class _StubSession:
+    """Stands in for an OSIDB session with a few flaws"""
+
+    def __init__(self, flaws):
+        self.flaws = SimpleNamespace(retrieve=self.retrieve)
+        self.affects = SimpleNamespace(bulk_create=self.bulk_create, delete=self.delete)
+        self._flaws = flaws
+        self.created = []
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def retrieve(self, id):
+        # Flaws can be retrieved by CVE or uuid
+        for cve, flaw in self._flaws.items():
+            if id in (cve, flaw.uuid):
+                return flaw
+        raise KeyError(id)
+
+    def bulk_create(self, form_data):
+        with self.lock:
+            self.created.extend(form_data)
+        return SimpleNamespace(results=form_data)
+
+    def delete(self, id):
+        with self.lock:
+            self.deleted.append(id)
+
+
+def _flaw(uuid, affects=()):
+    return SimpleNamespace(
+        uuid=uuid,
+        embargoed=False,
+        affects=[
+            SimpleNamespace(ps_module=m, purl=p, uuid=f"{m}-{p}", affectedness="NEW")
+            for m, p in affects
+        ],
+    )
+
+
+@pytest.fixture
+def triage_env(monkeypatch):
+    queried = []
+
+    def get_roots(purl, **kwargs):
+        queried.append(purl)
+        if purl == "pkg:npm/broken@1":
+            raise RuntimeError("lookup failed")
+        return [Node(purl)]
+
+    monkeypatch.setattr(products, "_get_roots", get_roots)
+    monkeypatch.setattr(product_definitions, "ProdDefs", _FakeProdDefs)
+    monkeypatch.setattr(
+        products,
+        "extract_affects",
+        lambda trees: {("module", tree.name) for tree in trees},
+    )
+    session = _StubSession(
+        {
+            "CVE-1": _flaw("uuid-1", [("module", "pkg:npm/stale@1")]),
+            "CVE-2": _flaw("uuid-2", [("module", "pkg:npm/b@1")]),
+            "CVE-3": _flaw("uuid-3"),
+        }
+    )
+    return OSIDB(session=session, retry_delay=0), session, queried
+
+
+def test_read_manifest():
+    lines = io.StringIO(
+        "# flaw purls...\nCVE-1 pkg:npm/a@1 pkg:npm/b@1\n\nCVE-2 pkg:npm/b@1\n"
+        "CVE-1  pkg:npm/c@1 pkg:npm/a@1\n"
+    )
+    plans = read_manifest(lines)
+    assert [(plan.flaw_id, plan.purls) for plan in plans] == [
+        ("CVE-1", ["pkg:npm/a@1", "pkg:npm/b@1", "pkg:npm/c@1"]),
+        ("CVE-2", ["pkg:npm/b@1"]),
+    ]
+    with pytest.raises(SystemExit):
+        read_manifest(io.StringIO("CVE-1\n"))
+
+
+def test_plan_and_apply_triage(triage_env):
+    osidb_client, session, queried = triage_env
+    plans = read_manifest(
+        io.StringIO(
+            "CVE-1 pkg:npm/a@1 pkg:npm/b@1\nCVE-2 pkg:npm/b@1\n"
+            "CVE-3 pkg:npm/broken@1\nCVE-4 pkg:npm/a@1\n"
+        )
+    )
+    plan_triage(plans, osidb_client, 4, replace=True, cache=None)
+    # Purls shared by several flaws are only queried once
+    assert sorted(queried) == ["pkg:npm/a@1", "pkg:npm/b@1", "pkg:npm/broken@1"]
+    cve1, cve2, cve3, cve4 = plans
+    assert cve1.affects_to_add == {("module", "pkg:npm/a@1"), ("module", "pkg:npm/b@1")}
+    assert cve1.affects_to_delete == {
+        ("module", "pkg:npm/stale@1"): "module-pkg:npm/stale@1"
+    }
+    assert not cve2.has_changes and not cve2.errors
+    assert cve3.errors == ["Failed to process pkg:npm/broken@1: lookup failed"]
+    assert "Could not retrieve flaw CVE-4" in cve4.errors[0]
+
+    assert review(plans) == 1
+    assert apply_triage(plans, osidb_client) == []
+    assert session.deleted == ["module-pkg:npm/stale@1"]
+    assert sorted(a["purl"] for a in session.created) == ["pkg:npm/a@1", "pkg:npm/b@1"]
+    assert {a["flaw"] for a in session.created} == {"uuid-1"}
+
+
+def test_triage_command(triage_env, monkeypatch, tmp_path):
+    osidb_client, session, _ = triage_env
+    monkeypatch.setattr(osidb, "OSIDB", lambda: osidb_client)
+    runner = CliRunner()
+    manifest = "CVE-1 pkg:npm/a@1\nCVE-3 pkg:npm/c@1\n"
+    manifest_file = tmp_path / "manifest.txt"
+    manifest_file.write_text(manifest)
+    result = runner.invoke(triage, ["--no-cache", str(manifest_file)], input="n\n")
+    assert result.exit_code == 1
+    assert "Apply the above changes to 2 flaws?" in result.output
+    assert session.created == []
+
+    result = runner.invoke(triage, ["--no-cache", "-"], input=manifest)
+    assert result.exit_code == 2
+
+    result = runner.invoke(triage, ["--no-cache", "--yes", "-"], input=manifest)
+    assert result.exit_code == 0
+    assert "Updated 2 flaws, 0 failed, 0 skipped" in result.output
+    assert sorted(a["purl"] for a in session.created) == ["pkg:npm/a@1", "pkg:npm/c@1"]
@@ -0,0 +1,103 @@
+import os
+import threading
+
+import httpx
+import pytest
+
+from trustshell.client import TrustifyClient, fixture_name
+from trustshell.products import _trees_with_cpes
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), "..", "benchmarks")
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), "testdata")
+OPENSSL_QUERY = {"q": "purl~pkg:rpm/redhat/openssl@", "ancestors": "10000"}
+
+
+@pytest.fixture
+def trustify_server(monkeypatch):
+    monkeypatch.syspath_prepend(BENCHMARKS_DIR)
+    import trustify_server
+
+    servers = []
+
+    def start(fixture_dirs=(TESTDATA_DIR,), **kwargs):
+        store = trustify_server.FixtureStore(list(fixture_dirs), kwargs.pop("scale", 1))
+        server = trustify_server.TrustifyServer(
+            ("127.0.0.1", 0), store, quiet=True, **kwargs
+        )
+        threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        ).start()
+        servers.append(server)
+        return server, TrustifyClient(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}/api/v2/",
+            auth_enabled=False,
+        )
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_analysis(trustify_server):
+    _, client = trustify_server()
+    response = client.get("analysis/latest/component", params=OPENSSL_QUERY)
+    assert response.status_code == 200
+    trees = _trees_with_cpes(response.json())
+    assert [tree.name for tree in trees] == ["pkg:rpm/redhat/openssl@3.0.7-18.el9_2"]
+    assert client.get("analysis/status").json()["sbom_count"] > 0
+
+
+def test_scale(trustify_server):
+    _, client = trustify_server()
+    response = client.get("analysis/component", params=OPENSSL_QUERY).json()
+    assert response["total"] == 19
+    sboms = {item["sbom_id"] for item in response["items"]}
+    _, client = trustify_server(scale=3)
+    response = client.get("analysis/component", params=OPENSSL_QUERY).json()
+    assert response["total"] == 3 * 19
+    assert len({item["sbom_id"] for item in response["items"]}) == 3 * len(sboms)
+
+
+def test_purl_search_and_details(trustify_server):
+    _, client = trustify_server()
+    pages = list(client.paginate("purl/base", params={"q": "qemu"}, page_size=2))
+    purls = [item["purl"] for page in pages for item in page["items"]]
+    assert "pkg:oci/quay-builder-qemu-rhcos-rhel8" in purls
+    details = client.get("purl/base/pkg%3Arpm%2Fredhat%2Fopenssl").json()
+    assert "3.0.7-18.el9_2" in {v["version"] for v in details["versions"]}
+    assert client.get("purl/base/pkg%3Anpm%2Fmissing").status_code == 404
+
+
+def test_errors_and_latency(trustify_server):
+    server, client = trustify_server(error_rate=1.0, latency=0.05)
+    response = client.get("analysis/status")
+    assert response.status_code == 503
+    assert response.elapsed.total_seconds() >= 0.05
+    assert server.errors == 1
+
+
+def test_record_and_serve(trustify_server, tmp_path):
+    _, client = trustify_server()
+    record_dir = tmp_path / "recorded"
+    recording = TrustifyClient(
+        base_url=client.base_url, auth_enabled=False, record_dir=str(record_dir)
+    )
+    with recording.stream("GET", "analysis/component", params=OPENSSL_QUERY) as r:
+        recorded = r.read()
+    assert recording.get("purl/base/pkg%3Anpm%2Fmissing").status_code == 404
+    names = os.listdir(record_dir)
+    assert len(names) == 1 and names[0].startswith("openssl-")
+
+    # The recorded responses can be served on their own
+    _, replay = trustify_server(fixture_dirs=[record_dir])
+    response = replay.get("analysis/component", params=OPENSSL_QUERY)
+    assert response.json() == httpx.Response(200, content=recorded).json()
+
+
+def test_fixture_name():
+    assert fixture_name("purl/base/pkg%3Arpm%2Fredhat%2Fopenssl").startswith(
+        "base_purl-openssl-"
+    )
+    assert fixture_name("analysis/status").startswith("analysis-status-")
+    assert fixture_name("analysis/status") != fixture_name("analysis/status?x=1")
@@ -0,0 +1,61 @@
+import itertools
+
+import pytest
+from univers.versions import InvalidVersion, RpmVersion
+
+from trustshell.versions import latest_version, rpm_sort_key, version_key
+
+RPM_VERSIONS = [
+    "1.0",
+    "1.0.0",
+    "1.0~rc1",
+    "1.0~~",
+    "1.0^",
+    "1.0^git1",
+    "1.0a",
+    "1.0.a",
+    "1.01",
+    "1.10",
+    "1:0.1",
+    "2.0-1",
+    "2.0-1.el9",
+    "2.0-1.el9_2",
+    "2.0-10",
+    "v3.12.8-1",
+    "3.12.8",
+    "3.12.8-1.1",
+    "é1.0",
+]
+
+
+def test_rpm_sort_key_matches_rpm_version():
+    for a, b in itertools.combinations(RPM_VERSIONS, 2):
+        key_a, key_b = rpm_sort_key(a), rpm_sort_key(b)
+        version_a, version_b = RpmVersion(a), RpmVersion(b)
+        assert (key_a < key_b) == (version_a < version_b), (a, b)
+        assert (key_a == key_b) == (version_a == version_b), (a, b)
+
+
+def test_rpm_sort_key_invalid():
+    with pytest.raises(InvalidVersion):
+        rpm_sort_key("v")
+
+
+@pytest.mark.parametrize(
+    "purl_type,versions,expected",
+    [
+        ("rpm", ["1.0-1", "1.10-1", "1.9-1"], "1.10-1"),
+        ("oci", ["v3.12.8-1", "v3.12.10", "v3.12.8"], "v3.12.10"),
+        ("maven", ["1.0.0.redhat-00001", "1.0.1", "1.0.0"], "1.0.1"),
+        ("go", ["v1.9.0", "v1.10.0"], "v1.10.0"),
+        ("npm", ["1.0.0-rc.1", "1.0.0", "0.9.9"], "1.0.0"),
+        ("pypi", ["1.0rc1", "1.0", "1.0.post1"], "1.0.post1"),
+        ("generic", ["b", "a"], "b"),
+    ],
+)
+def test_latest_version(purl_type, versions, expected):
+    assert latest_version(purl_type, versions) == expected
+
+
+def test_version_key_is_cached():
+    assert version_key("maven", "1.0.0") is version_key("maven", "1.0.0")